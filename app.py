@@ -1,44 +1,137 @@
-import time
-from collections import deque
+import array
+from math import exp
+
+from time_buckets import day_parts
+
+# app class represents an App in mobile. its launches are kept as
+# exponentially decayed scores per time bucket, stored in the
+# usage_scores rows shared by all apps of an applist. by default the
+# buckets are morning (before 12), afternoon and night (after 19).
+
+DAY_PARTS = day_parts((12, 20))
+MORNING = 0
+AFTERNOON = 1
+NIGHT = 2
+
+# time constant of the decay in seconds
+TIME_CONSTANT = 14 * 24 * 2400.0
+
+
+def get_bucket(hour):
+	return DAY_PARTS.bucket_of(0, hour)
+
+
+class usage_scores:
+	# Every launch at time tp adds exp((tp - ref_time) / TIME_CONSTANT) to
+	# the entry of its bucket, so the score at time now is
+	# 10 * entry * exp((ref_time - now) / TIME_CONSTANT), which equals
+	# 10 * sum(exp((tp - now) / TIME_CONSTANT)) over all launches.
+	# ref_time is moved forward before the increments could overflow,
+	# which rescales every entry and bumps epoch.
+	#
+	# values is a dense array of num_buckets entries per app, so bucket
+	# b of all apps is values[b::num_buckets]. totals keeps the sum of
+	# every row, so a launch costs the same for any number of buckets.
+	RESCALE_LIMIT = 500.0
+
+	def __init__(self, num_buckets=3):
+		self.num_buckets = num_buckets
+		self.ref_time = None
+		self.epoch = 0
+		self.values = array.array('d')
+		self.totals = array.array('d')
+
+	def add_row(self):
+		self.values.extend([0.0] * self.num_buckets)
+		self.totals.append(0.0)
+		return len(self.totals) - 1
+
+	def add(self, index, bucket, timestamp):
+		if self.ref_time is None:
+			self.ref_time = timestamp
+		elif (timestamp - self.ref_time) / TIME_CONSTANT > usage_scores.RESCALE_LIMIT:
+			self.rebase(timestamp)
+		increment = exp((timestamp - self.ref_time) / TIME_CONSTANT)
+		self.values[index * self.num_buckets + bucket] += increment
+		self.totals[index] += increment
+
+	def add_batch(self, indexes, buckets, timestamps):
+		# same as calling add for every launch, with a single overflow
+		# check for the whole batch
+		if not timestamps:
+			return
+		if self.ref_time is None:
+			self.ref_time = timestamps[0]
+		latest = max(timestamps)
+		if (latest - self.ref_time) / TIME_CONSTANT > usage_scores.RESCALE_LIMIT:
+			self.rebase(latest)
+		ref_time = self.ref_time
+		num_buckets = self.num_buckets
+		values = self.values
+		totals = self.totals
+		for index, bucket, timestamp in zip(indexes, buckets, timestamps):
+			increment = exp((timestamp - ref_time) / TIME_CONSTANT)
+			values[index * num_buckets + bucket] += increment
+			totals[index] += increment
+
+	def keep_rows(self, keep):
+		# keeps only the given rows, in order. row keep[i] becomes row i.
+		num_buckets = self.num_buckets
+		values = array.array('d')
+		for index in keep:
+			values.extend(self.values[index * num_buckets:(index + 1) * num_buckets])
+		self.values = values
+		self.totals = array.array('d', [self.totals[index] for index in keep])
+		self.epoch += 1
+
+	def rebase(self, ref_time):
+		factor = exp((self.ref_time - ref_time) / TIME_CONSTANT)
+		self.values = array.array('d', [value * factor for value in self.values])
+		self.totals = array.array('d', [total * factor for total in self.totals])
+		self.ref_time = ref_time
+		self.epoch += 1
+
+	def decay(self, now):
+		# factor turning a stored value into a score at time now
+		if self.ref_time is None:
+			return 0.0
+		return 10 * exp((self.ref_time - now) / TIME_CONSTANT)
+
+	def get(self, index, bucket, now):
+		return self.values[index * self.num_buckets + bucket] * self.decay(now)
+
+	def get_row(self, index, now):
+		# scores of all buckets of an app
+		factor = self.decay(now)
+		return [value * factor for value in
+				self.values[index * self.num_buckets:(index + 1) * self.num_buckets]]
+
+	def get_bucket_scores(self, bucket, now):
+		# scores of all apps in one bucket, in row order
+		factor = self.decay(now)
+		return [value * factor for value in self.values[bucket::self.num_buckets]]
+
+	def total(self, index):
+		# undecayed score of all buckets. all apps decay by the same
+		# factor, so ordering apps by total orders them by score.
+		return self.totals[index]
 
-# app class represents an App in mobile. it includes three deques to store
-# time of app is loaded.
 
 class app:
-	def __init__(self, name):
+	def __init__(self, name, scores, clock, scheme=DAY_PARTS):
 		self.name = name
-		# record value for each state
-		self.mor_val = 0;
-		self.non_val = 0;
-		self.ngt_val = 0;
-		# use a queue to store the time of app is loaded
-		self.num_mor_usg = deque()
-		self.num_non_usg = deque()
-		self.num_ngt_usg = deque()
+		self.scores = scores
+		self.clock = clock
+		self.scheme = scheme
+		self.index = scores.add_row()
+		# record value for each bucket
+		self.values = [0] * scheme.num_buckets
 
 	def is_opened(self):
-		# add time in queue structure
-		if (float(time.strftime('%H')) < 12):
-			self.num_mor_usg.appendleft(time.time())
-		elif (float(time.strftime('%H')) > 19):
-			self.num_ngt_usg.appendleft(time.time())
-		else:
-			self.num_non_usg.appendleft(time.time())
-
-	def get_mor_usg(self):
-        # pop out time point passes 2 weeks interval
-		while (time.time() - self.num_mor_usg[-1] > 14 * 24 * 3600.0):
-			self.num_mor_usg.pop()
-		return self.num_mor_usg
-
-	def get_non_usg(self):
-        # pop out time point passes 2 weeks interval
-		while (time.time() - self.num_non_usg[-1] > 14 * 24 * 3600.0):
-			self.num_non_usg.pop()
-		return self.num_non_usg
-
-	def get_ngt_usg(self):
-        # pop out time point passes 2 weeks interval
-		while (time.time() - self.num_ngt_usg[-1] > 14 * 24 * 3600.0):
-			self.num_ngt_usg.pop();
-		return self.num_ngt_usg
+		# add launch to the score of the current bucket
+		bucket = self.scheme.bucket_of(self.clock.weekday(), self.clock.hour())
+		self.scores.add(self.index, bucket, self.clock.time())
+
+	def cal_val(self, now):
+		self.values = self.scores.get_row(self.index, now)
+		return sum(self.values)
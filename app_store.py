@@ -0,0 +1,240 @@
+""" Persistent app usage scores for many users
+
+AppStore keeps the per time bucket scores of applist (morning, afternoon
+and night by default) for every (user, app) pair in a set of sqlite
+databases. Users are spread over the shards by a stable hash of the
+user id, so a shard stays small enough to query and to copy around on
+its own.
+
+Scores use the same decay as applist: a launch at time tp adds
+exp((tp - ref_time) / TIME_CONSTANT) to its bucket, where ref_time is a
+single reference time shared by all rows, and a score at time now is
+the stored value times 10 * exp((ref_time - now) / TIME_CONSTANT). Rows
+therefore only change when the user launches the app, which is what
+makes incremental export possible: every upsert batch gets a new change
+sequence number and each row remembers the batch that last touched it.
+"""
+import csv
+import json
+import os
+import sqlite3
+import zlib
+from collections import defaultdict
+from math import exp
+
+from app import DAY_PARTS, TIME_CONSTANT
+from clock import SystemClock
+from time_buckets import BucketScheme, get_bucket_scheme
+
+# Bucket b of a scheme is stored in column b<b>, total holds the sum of
+# all buckets so apps can be ordered without adding up every column
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS scores (
+    user TEXT NOT NULL,
+    app TEXT NOT NULL,
+    total REAL NOT NULL,
+    %s,
+    seq INTEGER NOT NULL,
+    PRIMARY KEY (user, app)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS scores_seq ON scores (seq);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value
+);
+"""
+
+_UPSERT = """
+INSERT INTO scores (user, app, total, %s, seq) VALUES (?, ?, ?, %s, ?)
+ON CONFLICT (user, app) DO UPDATE SET
+    total = total + excluded.total,
+    %s,
+    seq = excluded.seq
+"""
+
+
+class AppStore:
+    """ Sharded on-disk store of per-user app scores
+
+    Attributes:
+        path (str): Directory holding the shard databases
+        shards (int): Number of shards. Must stay the same for the
+            lifetime of a store.
+        scheme (:obj:'BucketScheme'): Time buckets of the scores, a
+            scheme or its description. Must stay the same for the
+            lifetime of a store.
+        clock (:obj:'SystemClock'): Clock used to decay scores in
+            queries and exports
+    """
+    RESCALE_LIMIT = 500.0
+
+    def __init__(self, path, shards=16, scheme=None, clock=None):
+        self.path = path
+        self.shards = shards
+        if scheme is None:
+            scheme = DAY_PARTS
+        elif not isinstance(scheme, BucketScheme):
+            scheme = get_bucket_scheme(scheme)
+        self.scheme = scheme
+        self.clock = clock if clock is not None else SystemClock()
+        os.makedirs(path, exist_ok=True)
+
+        columns = ['b%d' % bucket for bucket in range(scheme.num_buckets)]
+        self._schema = _SCHEMA % ',\n    '.join('%s REAL NOT NULL' % column for column in columns)
+        self._upsert = _UPSERT % (', '.join(columns), ', '.join('?' * len(columns)),
+                                  ',\n    '.join('%s = %s + excluded.%s' % (column, column, column)
+                                                for column in columns))
+        self._rescale = 'UPDATE scores SET total = total * ?, %s' % \
+            ', '.join('%s = %s * ?' % (column, column) for column in columns)
+
+        # The layout of an existing store is checked on its first shard
+        # before the other shards are opened
+        self._connections = [self._connect(0)]
+        try:
+            meta = dict(self._connections[0].execute('SELECT key, value FROM meta'))
+            if 'shards' in meta and int(meta['shards']) != shards:
+                raise Exception("Store at %s has %s shards, not %s" % (path, meta['shards'], shards))
+            if 'buckets' in meta and meta['buckets'] != scheme.spec:
+                raise Exception("Store at %s uses buckets %s, not %s" % (path, meta['buckets'], scheme.spec))
+            for shard in range(1, shards):
+                self._connections.append(self._connect(shard))
+        except Exception:
+            self.close()
+            raise
+        self.ref_time = meta.get('ref_time')
+        self.seq = max(connection.execute('SELECT COALESCE(MAX(seq), 0) FROM scores').fetchone()[0]
+                       for connection in self._connections)
+
+    def _connect(self, shard):
+        connection = sqlite3.connect(os.path.join(self.path, 'shard-%03d.sqlite' % shard))
+        try:
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.executescript(self._schema)
+        except Exception:
+            connection.close()
+            raise
+        return connection
+
+    def close(self):
+        for connection in self._connections:
+            connection.close()
+        self._connections = []
+
+    def shard_of(self, user):
+        return zlib.crc32(user.encode('utf-8')) % self.shards
+
+    def _set_meta(self, **values):
+        connection = self._connections[0]
+        with connection:
+            connection.executemany('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)',
+                                   list(values.items()))
+
+    def upsert(self, launches):
+        """ Adds a batch of launches
+
+        Args:
+            launches: Either an iterable of (user, app, time, hour)
+                tuples, or a columnar dict of equally long 'user',
+                'app_id', 'time' and 'hour' sequences. Times are seconds
+                as returned by clock.to_seconds. The weekday of a launch
+                is taken from its time.
+
+        Returns:
+            int: Change sequence number of the batch
+        """
+        if isinstance(launches, dict):
+            launches = zip(launches['user'], launches['app_id'], launches['time'], launches['hour'])
+
+        # Sum the batch per (user, app) before touching the database
+        scheme = self.scheme
+        num_buckets = scheme.num_buckets
+        increments = defaultdict(lambda: [0.0] * num_buckets)
+        latest = None
+        for user, app_id, timestamp, hour in launches:
+            if self.ref_time is None:
+                self.ref_time = timestamp
+                self._set_meta(ref_time=timestamp, shards=self.shards, buckets=scheme.spec)
+            if latest is None or timestamp > latest:
+                latest = timestamp
+            # 1970-01-01 was a Thursday
+            bucket = scheme.bucket_of((int(timestamp // 86400) + 3) % 7, hour)
+            increments[(user, app_id)][bucket] += exp((timestamp - self.ref_time) / TIME_CONSTANT)
+        if not increments:
+            return self.seq
+
+        if (latest - self.ref_time) / TIME_CONSTANT > AppStore.RESCALE_LIMIT:
+            factor = exp((self.ref_time - latest) / TIME_CONSTANT)
+            self.rebase(latest)
+            for values in increments.values():
+                values[:] = [value * factor for value in values]
+
+        self.seq += 1
+        rows = [[] for _ in range(self.shards)]
+        for (user, app_id), values in increments.items():
+            rows[self.shard_of(user)].append((user, app_id, sum(values), *values, self.seq))
+        for connection, shard_rows in zip(self._connections, rows):
+            if shard_rows:
+                with connection:
+                    connection.executemany(self._upsert, shard_rows)
+        return self.seq
+
+    def rebase(self, ref_time):
+        """ Moves the reference time forward, rescaling every row """
+        factor = exp((self.ref_time - ref_time) / TIME_CONSTANT)
+        for connection in self._connections:
+            with connection:
+                connection.execute(self._rescale, (factor,) * (self.scheme.num_buckets + 1))
+        self.ref_time = ref_time
+        self._set_meta(ref_time=ref_time)
+
+    def decay(self, now=None):
+        if self.ref_time is None:
+            return 0.0
+        if now is None:
+            now = self.clock.time()
+        return 10 * exp((self.ref_time - now) / TIME_CONSTANT)
+
+    def get_app(self, user, num):
+        """ Returns the num apps of a user with the highest value
+
+        Same (value, app) tuples and order as applist.get_app
+        """
+        connection = self._connections[self.shard_of(user)]
+        factor = self.decay()
+        return [(total * factor, app_id)
+                for app_id, total in connection.execute(
+                    'SELECT app, total FROM scores WHERE user = ? '
+                    'ORDER BY total DESC, app DESC LIMIT ?', (user, num))]
+
+    def changed_rows(self, since=0):
+        """ Yields (user, app, overall, <bucket scores>) of rows changed after seq since """
+        factor = self.decay()
+        columns = ', '.join('b%d' % bucket for bucket in range(self.scheme.num_buckets))
+        for connection in self._connections:
+            for user, app_id, total, *values in connection.execute(
+                    'SELECT user, app, total, %s FROM scores WHERE seq > ? ORDER BY user, app' % columns,
+                    (since,)):
+                yield (user, app_id, total * factor) + tuple(value * factor for value in values)
+
+    def export(self, path, since=0):
+        """ Writes the rows changed after seq since to a CSV or JSON lines file
+
+        The format follows the extension of path ('.json' or '.jsonl'
+        for JSON lines, CSV otherwise). Bucket scores are named by the
+        labels of the scheme.
+
+        Returns:
+            int: Sequence number to pass as since to the next export
+        """
+        seq = self.seq
+        with open(path, 'wt', newline='') as fp:
+            columns = ['user', 'app', 'overall'] + self.scheme.labels
+            if path.endswith('.json') or path.endswith('.jsonl'):
+                for row in self.changed_rows(since):
+                    fp.write(json.dumps(dict(zip(columns, row))) + '\n')
+            else:
+                writer = csv.writer(fp)
+                writer.writerow(columns)
+                writer.writerows(self.changed_rows(since))
+        return seq
@@ -1,57 +1,201 @@
-from app import app
-from math import exp
-import heapq
-import time
+#! /usr/bin/env python
+from app import app, usage_scores, DAY_PARTS
+from bisect import bisect_left, insort
+import argparse
+import array
 import csv
 
+from clock import SystemClock, SimulatedClock, to_seconds
+from events import EventType, AppActivityUsageEvent
+from state_store import load_state, save_state
+from time_buckets import BucketScheme, get_bucket_scheme
+
 # list class store all apps and their priority value.
 class applist:
-    def __init__(self):
+    def __init__(self, clock=None, scheme=None):
+        # clock used to timestamp launches, the wall clock by default
+        self.clock = clock if clock is not None else SystemClock()
+        # time buckets of the scores, morning/afternoon/night by default
+        if scheme is None:
+            scheme = DAY_PARTS
+        elif not isinstance(scheme, BucketScheme):
+            scheme = get_bucket_scheme(scheme)
+        self.scheme = scheme
         # dict contains all apps
         self.list = {}
-        # use three priority queues to put app with priority value
-        self.pq = []
+        # decayed launch scores of all apps, one row per app
+        self.scores = usage_scores(scheme.num_buckets)
+        # apps sorted by (undecayed score, name), kept up to date for
+        # the apps launched since the last query
+        self.ranking = []
+        self.ranked = {}
+        self.changed = set()
+        self.epoch = 0
 
     # writes result to csv file
     def get_result(self, path, num):
         f = open(path, 'wt')
         try:
             writer = csv.writer(f)
-            writer.writerow(('app', 'overall', 'mor', 'non', 'ngt'));
+            writer.writerow(['app', 'overall'] + self.scheme.labels);
             list = self.get_app(num)
+            now = self.clock.time()
             for app in self.list:
-                writer.writerow((app, self.list[app].mor_val + self.list[app].non_val +
-                    self.list[app].ngt_val, self.list[app].mor_val, self.list[app].non_val,
-                    self.list[app].ngt_val))
+                overall = self.list[app].cal_val(now)
+                writer.writerow([app, overall] + self.list[app].values)
         finally:
             f.close()
 
+    # writes the launch scores of all apps to a state file
+    def save_state(self, path):
+        save_state(path, {'applist/apps': list(self.list),
+                          'applist/meta': {'ref_time': self.scores.ref_time,
+                                           'buckets': self.scheme.spec},
+                          'applist/values': self.scores.values,
+                          'applist/totals': self.scores.totals})
+
+    # restores the launch scores written by save_state
+    def load_state(self, path):
+        state = load_state(path)
+        try:
+            meta = state['applist/meta']
+            if meta['buckets'] != self.scheme.spec:
+                raise Exception("Saved applist state uses buckets %s, not %s"
+                                % (meta['buckets'], self.scheme.spec))
+            self.list = {}
+            self.scores = usage_scores(self.scheme.num_buckets)
+            for name in state['applist/apps']:
+                self.list[name] = app(name, self.scores, self.clock, self.scheme)
+            self.scores.values = array.array('d', state['applist/values'])
+            self.scores.totals = array.array('d', state['applist/totals'])
+            self.scores.ref_time = meta['ref_time']
+            self.ranking = []
+            self.ranked = {}
+            self.changed = set(self.list)
+            self.epoch = self.scores.epoch
+        finally:
+            state.close()
+
     def load_app(self, name):
         # create app if it doesn't exist
         if name not in self.list:
-            self.list[name] = app(name)
-        # call is_open method push time point
+            self.list[name] = app(name, self.scores, self.clock, self.scheme)
+        # call is_open method to add the launch to its score
         self.list[name].is_opened()
+        self.changed.add(name)
+
+    # adds many launches in one call. events is either an iterable of
+    # trace events, of which only apps moving to the foreground count as
+    # launches, or a columnar batch: a dict of equally long 'app_id' and
+    # 'time' (seconds, see clock.to_seconds) sequences. the bucket of a
+    # launch comes from its time, or from optional 'hour' and 'weekday'
+    # sequences. the clock is not moved.
+    def load_apps(self, events):
+        scheme = self.scheme
+        if isinstance(events, dict):
+            names, times = events['app_id'], events['time']
+            if 'hour' not in events:
+                buckets = [scheme.bucket_of_seconds(seconds) for seconds in times]
+            elif 'weekday' in events:
+                buckets = [scheme.bucket_of(weekday, hour)
+                           for weekday, hour in zip(events['weekday'], events['hour'])]
+            else:
+                buckets = [scheme.bucket_of((int(seconds // 86400) + 3) % 7, hour)
+                           for seconds, hour in zip(times, events['hour'])]
+        else:
+            names, times, buckets = [], array.array('d'), []
+            for event in events:
+                if event.event_type == EventType.APP_ACTIVITY_USAGE and \
+                        event.usage_event == AppActivityUsageEvent.UsageEvent.MOVE_FOREGROUND:
+                    names.append(event.app_id)
+                    times.append(to_seconds(event.timestamp))
+                    buckets.append(scheme.bucket(event.timestamp))
+
+        indexes = []
+        for name in names:
+            if name not in self.list:
+                self.list[name] = app(name, self.scores, self.clock, self.scheme)
+            indexes.append(self.list[name].index)
+        self.changed.update(names)
+        self.scores.add_batch(indexes, buckets, times)
+        return len(names)
 
+    # drops the apps whose value decayed below min_value. returns the
+    # number of apps dropped.
+    def prune(self, min_value):
+        factor = self.scores.decay(self.clock.time())
+        keep = [name for name in self.list
+                if self.scores.total(self.list[name].index) * factor >= min_value]
+        dropped = len(self.list) - len(keep)
+        if dropped:
+            self.scores.keep_rows([self.list[name].index for name in keep])
+            self.list = {name: self.list[name] for name in keep}
+            for index, name in enumerate(keep):
+                self.list[name].index = index
+        return dropped
+
+    # returns the num apps with the highest value as (value, app) tuples
     def get_app(self, num):
         self.cal_val()
-        return heapq.nlargest(num, self.pq)
+        now = self.clock.time()
+        top = []
+        for i in range(len(self.ranking) - 1, max(len(self.ranking) - num, 0) - 1, -1):
+            name = self.ranking[i][1]
+            top.append((self.list[name].cal_val(now), name))
+        return top
 
-    # calculate priority value
+    # reorder the apps whose value changed since the last call
     def cal_val(self):
-        self.pq = []
-        for app in self.list:
-            self.list[app].mor_val = self.cal_exp(self.list[app].num_mor_usg)
-            self.list[app].non_val = self.cal_exp(self.list[app].num_non_usg)
-            self.list[app].ngt_val = self.cal_exp(self.list[app].num_ngt_usg)
-            # push each app into heap according to value
-            heapq.heappush(self.pq, (self.list[app].mor_val + self.list[app].non_val + self.list[app].ngt_val, app))
-
-    # exponentially decrease the priority value
-    def cal_exp(self, dq):
-        val = 0;
-        for tp in dq:
-            val += exp((tp - time.time()) / (14 * 24 * 2400))
-        # increase all value by multiply 10
-        val *= 10
-        return val
+        if self.epoch != self.scores.epoch:
+            # all scores were rescaled, rebuild the ranking
+            self.epoch = self.scores.epoch
+            self.ranking = []
+            self.ranked = {}
+            self.changed = set(self.list)
+        for name in self.changed:
+            key = self.ranked.get(name)
+            if key is not None:
+                del self.ranking[bisect_left(self.ranking, key)]
+            key = (self.scores.total(self.list[name].index), name)
+            self.ranked[name] = key
+            insort(self.ranking, key)
+        self.changed.clear()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Per-app usage scores of a trace')
+    parser.add_argument('--trace', type=str, required=True,
+                        help='User log trace file')
+    parser.add_argument('--output', type=str, default='applist.csv',
+                        help='CSV file to write the app scores to')
+    parser.add_argument('--num', type=int, default=10,
+                        help='Number of top apps to print')
+    parser.add_argument('--min_value', type=float, default=0,
+                        help='Drop apps whose value decayed below this after every batch')
+    parser.add_argument('--buckets', type=str, default=DAY_PARTS.spec,
+                        help="Time bucket scheme, e.g. 'day_parts:12,20', 'hour_of_day:4', "
+                             "'hour_of_week' or 'weekday_weekend'")
+    parser.add_argument('--batch_size', type=int, default=10000,
+                        help='Number of trace events ingested per batch')
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    from trace_reader import get_trace_reader
+
+    args = parse_args()
+    reader = get_trace_reader(args.trace)
+    reader.build()
+    clock = SimulatedClock(reader.get_start_time())
+    apps = applist(clock, args.buckets)
+    while not reader.end_of_trace():
+        batch = reader.get_events(args.batch_size)
+        apps.load_apps(batch)
+        clock.set(batch[-1].timestamp)
+        if args.min_value:
+            apps.prune(args.min_value)
+    reader.finish()
+
+    apps.get_result(args.output, args.num)
+    for value, name in apps.get_app(args.num):
+        print("%s: %s" % (name, value))
@@ -0,0 +1,58 @@
+#! /usr/bin/env python
+""" Benchmarks trace load time per compression codec
+
+Every trace is re-encoded with each available codec into a temporary
+directory, then loaded with read_trace. The size of the file and the
+best load time over the repeats are reported.
+
+command: python3 bench_trace_io.py traces/trace2.json.gz traces/trace2.pkl.gz --repeat 3
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+from convert_trace import read_trace, write_trace
+from trace_codecs import CODEC_EXTENSIONS, available_codecs, strip_codec_extension
+
+
+def time_load(filename, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        read_trace(filename)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def bench_trace(filename, codecs, repeat, output):
+    trace_data = read_trace(filename)
+    name = os.path.basename(strip_codec_extension(filename))
+    output.write("======== %s (%d events) ========\n" % (name, len(trace_data['logs'])))
+    output.write("%-8s %12s %10s\n" % ('codec', 'bytes', 'load (s)'))
+    with tempfile.TemporaryDirectory() as directory:
+        for codec in codecs:
+            path = os.path.join(directory, name + CODEC_EXTENSIONS[codec])
+            write_trace(path, trace_data, codec)
+            output.write("%-8s %12d %10.3f\n" % (codec, os.path.getsize(path), time_load(path, repeat)))
+            os.remove(path)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Benchmark trace load time per codec')
+    parser.add_argument('traces', type=str, nargs='*',
+                        default=['traces/trace2.json.gz', 'traces/trace2.pkl.gz'],
+                        help='Trace files to benchmark')
+    parser.add_argument('--codecs', type=str, nargs='*', default=None,
+                        help='Codecs to benchmark, all available codecs by default')
+    parser.add_argument('--repeat', type=int, default=3, help='Loads per codec')
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    codecs = args.codecs or available_codecs()
+    for trace in args.traces:
+        bench_trace(trace, codecs, args.repeat, sys.stdout)
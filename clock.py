@@ -0,0 +1,61 @@
+""" Clocks used to timestamp app launches
+
+SystemClock reads the wall clock. SimulatedClock is set explicitly,
+usually to the timestamp of the trace event being processed, so that
+launch history can be built from historical traces.
+"""
+import datetime
+import time
+
+
+_EPOCH = datetime.datetime(1970, 1, 1)
+_EPOCH_UTC = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+def to_seconds(timestamp):
+    """ Converts a trace timestamp to seconds since the epoch
+
+    Naive timestamps are treated as UTC so that differences between
+    them do not depend on the local timezone.
+    """
+    if timestamp.tzinfo is None:
+        return (timestamp - _EPOCH).total_seconds()
+    return (timestamp - _EPOCH_UTC).total_seconds()
+
+
+class SystemClock:
+    """ Wall clock time of the machine """
+    def time(self):
+        return time.time()
+
+    def hour(self):
+        return time.localtime().tm_hour
+
+    def weekday(self):
+        return time.localtime().tm_wday
+
+
+class SimulatedClock:
+    """ Clock that only moves when it is set
+
+    Attributes:
+        timestamp (:obj:'datetime'): Current time of the clock
+    """
+    def __init__(self, timestamp=None):
+        self.timestamp = None
+        self._seconds = 0.0
+        if timestamp is not None:
+            self.set(timestamp)
+
+    def set(self, timestamp):
+        self.timestamp = timestamp
+        self._seconds = to_seconds(timestamp)
+
+    def time(self):
+        return self._seconds
+
+    def hour(self):
+        return self.timestamp.hour
+
+    def weekday(self):
+        return self.timestamp.weekday()
@@ -0,0 +1,39 @@
+#! /usr/bin/env python
+""" Writes a trace without the events that change no device state
+
+State events (screen, network, battery, ...) that repeat the value of
+the previous event of their type are removed, except for the event
+types given with --keep. The number of removed events is reported
+per type. The output format and codec follow convert_trace.py.
+
+command: python3 compact_trace.py traces/trace2.json.gz trace2-compact.pkl.gz --keep screen
+"""
+import argparse
+import sys
+
+from convert_trace import read_trace, write_trace
+from events import get_event_types
+from trace_compaction import TraceCompactor
+
+
+def compact_trace(trace_data, compactor):
+    return {'start_time': trace_data['start_time'],
+            'end_time': trace_data['end_time'],
+            'logs': compactor.compact(trace_data['logs'])}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Remove redundant state events from a trace')
+    parser.add_argument('input', type=str, help='Trace file to read')
+    parser.add_argument('output', type=str, help='Trace file to write')
+    parser.add_argument('--keep', type=str, nargs='*', default=[],
+                        help="Event types to keep every event of, e.g. 'screen' or 'battery.*'")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    keep_types = [event_type for pattern in args.keep for event_type in get_event_types(pattern)]
+    compactor = TraceCompactor(keep_types)
+    write_trace(args.output, compact_trace(read_trace(args.input), compactor))
+    compactor.print_stats(sys.stdout)
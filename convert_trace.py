@@ -0,0 +1,95 @@
+#! /usr/bin/env python
+""" Converts a trace file between the supported trace formats
+
+The output format follows the extension of the output file:
+
+    .json       one JSON document with a 'logs' array
+    .pkl        pickled trace dictionary
+    .ndjson     header line followed by one event per line
+
+followed by the extension of the codec (.gz, .bz2, .xz, .zst, .lz4),
+which is also used to pick the codec unless --codec is given. Inputs
+of any format and codec are accepted.
+
+command: python3 convert_trace.py traces/trace2.json.gz traces/trace2.ndjson.zst
+         python3 convert_trace.py --codec bgzip traces/trace2.json.gz traces/trace2.json.gz
+"""
+import argparse
+import json
+import pickle
+
+from events import EventJsonEncoder
+from trace_codecs import CODEC_EXTENSIONS, codec_for_extension, open_trace_output, strip_codec_extension
+from trace_reader import get_trace_reader
+
+
+def read_trace(filename):
+    reader = get_trace_reader(filename)
+    reader.build()
+    try:
+        logs = []
+        while not reader.end_of_trace():
+            logs.extend(reader.get_events(100000))
+        return {'start_time': reader.get_start_time(),
+                'end_time': reader.get_end_time(),
+                'logs': logs}
+    finally:
+        reader.finish()
+
+
+def write_ndjson(fp, trace_data):
+    header = {'start_time': trace_data['start_time'].isoformat(),
+              'end_time': trace_data['end_time'].isoformat()}
+    fp.write((json.dumps(header) + '\n').encode())
+    encoder = EventJsonEncoder()
+    lines = []
+    for event in trace_data['logs']:
+        lines.append(encoder.encode(event))
+        if len(lines) >= 10000:
+            fp.write(('\n'.join(lines) + '\n').encode())
+            lines = []
+    if lines:
+        fp.write(('\n'.join(lines) + '\n').encode())
+
+
+def write_json(fp, trace_data):
+    document = {'start_time': trace_data['start_time'].isoformat(),
+                'end_time': trace_data['end_time'].isoformat(),
+                'logs': trace_data['logs']}
+    fp.write(json.dumps(document, cls=EventJsonEncoder).encode())
+
+
+def write_pickle(fp, trace_data):
+    pickle.dump(trace_data, fp, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def write_trace(filename, trace_data, codec=None, level=None):
+    name = strip_codec_extension(filename)
+    if name.endswith('.ndjson'):
+        writer = write_ndjson
+    elif name.endswith('.json'):
+        writer = write_json
+    elif name.endswith('.pkl'):
+        writer = write_pickle
+    else:
+        raise Exception("Invalid output trace type. Expected .json, .pkl or .ndjson")
+    if codec is None:
+        codec = codec_for_extension(filename)
+    with open_trace_output(filename, codec, level) as fp:
+        writer(fp, trace_data)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Convert uamp trace files')
+    parser.add_argument('input', type=str, help='Trace file to read')
+    parser.add_argument('output', type=str, help='Trace file to write')
+    parser.add_argument('--codec', type=str, default=None, choices=sorted(CODEC_EXTENSIONS),
+                        help='Compression codec, chosen from the output extension by default')
+    parser.add_argument('--level', type=int, default=None,
+                        help='Compression level of the codec')
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    write_trace(args.output, read_trace(args.input), args.codec, args.level)
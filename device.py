@@ -136,5 +136,6 @@ class DeviceState:
         self.phone_state = PhoneState.UNKNOWN
         self.headset_state = HeadsetState.UNKNOWN
         self.dock_state = DockState.UNKNOWN
+        self.storage_state = StorageState.UNKNOWN
         self.network_state = NetworkState()
         self.battery_state = BatteryState()
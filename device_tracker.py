@@ -0,0 +1,186 @@
+""" Built-in reducer that keeps DeviceState up to date
+
+The simulator applies every trace event to a DeviceStateTracker before
+dispatching it to modules, so modules can read the current device
+state instead of tracking screen, battery, network, headset and dock
+events themselves.
+
+Every change is also appended to a per-field change log, which answers
+"what was the value at time T" with a binary search.
+"""
+import array
+from bisect import bisect_right
+
+import device
+from events import EventType
+
+
+def _to_seconds(timestamp):
+    # Monotonic seconds value for a datetime, independent of tzinfo
+    return (timestamp.toordinal() * 86400 + timestamp.hour * 3600 +
+            timestamp.minute * 60 + timestamp.second + timestamp.microsecond / 1e6)
+
+
+class FieldLog:
+    """ Change log of a single device state field
+
+    Stores only actual changes, as parallel arrays of change times and
+    values. Enum values are stored by their integer value, plain fields
+    as floats since traces may carry fractional battery levels and
+    temperatures.
+
+    Attributes:
+        value_type (:obj:'Enum'): Enum class of the field, or None for
+            plain numeric fields
+        initial (object): Value of the field before the first change
+    """
+    def __init__(self, value_type, initial):
+        self.value_type = value_type
+        self.initial = initial
+        self.times = array.array('d')
+        self.values = array.array('q' if value_type is not None else 'd')
+
+    def record(self, timestamp, value):
+        if self.value_type is not None:
+            value = value.value
+        if self.values and self.values[-1] == value:
+            return
+        self.times.append(_to_seconds(timestamp))
+        self.values.append(value)
+
+    def get_value_at(self, timestamp):
+        pos = bisect_right(self.times, _to_seconds(timestamp)) - 1
+        if pos < 0:
+            return self.initial
+        if self.value_type is not None:
+            return self.value_type(self.values[pos])
+        return self.values[pos]
+
+    def __len__(self):
+        return len(self.times)
+
+
+class DeviceStateTracker:
+    """ Applies trace events to a DeviceState and logs its changes
+
+    Attributes:
+        device_state (:obj:'DeviceState'): State updated in place
+    """
+    def __init__(self, device_state):
+        self.device_state = device_state
+        self._logs = {
+            'screen_state': FieldLog(device.ScreenState, device_state.screen_state),
+            'screen_orientation': FieldLog(device.ScreenOrientation, device_state.screen_orientation),
+            'phone_state': FieldLog(device.PhoneState, device_state.phone_state),
+            'headset_state': FieldLog(device.HeadsetState, device_state.headset_state),
+            'dock_state': FieldLog(device.DockState, device_state.dock_state),
+            'storage_state': FieldLog(device.StorageState, device_state.storage_state),
+            'network_type': FieldLog(device.NetworkType, device_state.network_state.type),
+            'network_connection_state': FieldLog(device.NetworkConnectionState,
+                                                 device_state.network_state.connection_state),
+            'battery_level': FieldLog(None, device_state.battery_state.level),
+            'battery_temp': FieldLog(None, device_state.battery_state.temp),
+            'battery_status': FieldLog(device.BatteryStatus, device_state.battery_state.status),
+            'battery_plug_state': FieldLog(device.BatteryPlugState, device_state.battery_state.plug_state),
+            'battery_energy_state': FieldLog(device.BatteryEnergyState, device_state.battery_state.energy_state),
+        }
+        self._reducers = {
+            EventType.SCREEN: self._apply_screen,
+            EventType.SCREEN_ORIENTATION: self._apply_screen_orientation,
+            EventType.PHONE: self._apply_phone,
+            EventType.HEADSET: self._apply_headset,
+            EventType.DOCK: self._apply_dock,
+            EventType.DEVICE_STORAGE: self._apply_storage,
+            EventType.NETWORK_TYPE: self._apply_network_type,
+            EventType.NETWORK_STATUS: self._apply_network_status,
+            EventType.BATTERY_LEVEL: self._apply_battery_level,
+            EventType.BATTERY_TEMPERATURE: self._apply_battery_temp,
+            EventType.BATTERY_STATUS: self._apply_battery_status,
+            EventType.BATTERY_PLUG_STATE: self._apply_battery_plug_state,
+            EventType.BATTERY_ENERGY_STATE: self._apply_battery_energy_state,
+        }
+
+    def apply(self, event):
+        self.device_state.current_time = event.timestamp
+        reducer = self._reducers.get(event.event_type)
+        if reducer is not None:
+            reducer(event)
+
+    def get_field_log(self, field):
+        return self._logs[field]
+
+    def get_value_at(self, field, timestamp):
+        """ Returns the value of a single state field at the given time """
+        return self._logs[field].get_value_at(timestamp)
+
+    def get_state_at(self, timestamp):
+        """ Returns a DeviceState snapshot as it was at the given time """
+        state = device.DeviceState()
+        state.current_time = timestamp
+
+        state.screen_state = self.get_value_at('screen_state', timestamp)
+        state.screen_orientation = self.get_value_at('screen_orientation', timestamp)
+        state.phone_state = self.get_value_at('phone_state', timestamp)
+        state.headset_state = self.get_value_at('headset_state', timestamp)
+        state.dock_state = self.get_value_at('dock_state', timestamp)
+        state.storage_state = self.get_value_at('storage_state', timestamp)
+        state.network_state.type = self.get_value_at('network_type', timestamp)
+        state.network_state.connection_state = self.get_value_at('network_connection_state', timestamp)
+        state.battery_state.level = self.get_value_at('battery_level', timestamp)
+        state.battery_state.temp = self.get_value_at('battery_temp', timestamp)
+        state.battery_state.status = self.get_value_at('battery_status', timestamp)
+        state.battery_state.plug_state = self.get_value_at('battery_plug_state', timestamp)
+        state.battery_state.energy_state = self.get_value_at('battery_energy_state', timestamp)
+        return state
+
+    def _apply_screen(self, event):
+        self.device_state.screen_state = event.state
+        self._logs['screen_state'].record(event.timestamp, event.state)
+
+    def _apply_screen_orientation(self, event):
+        self.device_state.screen_orientation = event.state
+        self._logs['screen_orientation'].record(event.timestamp, event.state)
+
+    def _apply_phone(self, event):
+        self.device_state.phone_state = event.state
+        self._logs['phone_state'].record(event.timestamp, event.state)
+
+    def _apply_headset(self, event):
+        self.device_state.headset_state = event.state
+        self._logs['headset_state'].record(event.timestamp, event.state)
+
+    def _apply_dock(self, event):
+        self.device_state.dock_state = event.state
+        self._logs['dock_state'].record(event.timestamp, event.state)
+
+    def _apply_storage(self, event):
+        self.device_state.storage_state = event.state
+        self._logs['storage_state'].record(event.timestamp, event.state)
+
+    def _apply_network_type(self, event):
+        self.device_state.network_state.type = event.network_type
+        self._logs['network_type'].record(event.timestamp, event.network_type)
+
+    def _apply_network_status(self, event):
+        self.device_state.network_state.connection_state = event.state
+        self._logs['network_connection_state'].record(event.timestamp, event.state)
+
+    def _apply_battery_level(self, event):
+        self.device_state.battery_state.level = event.level
+        self._logs['battery_level'].record(event.timestamp, event.level)
+
+    def _apply_battery_temp(self, event):
+        self.device_state.battery_state.temp = event.temperature
+        self._logs['battery_temp'].record(event.timestamp, event.temperature)
+
+    def _apply_battery_status(self, event):
+        self.device_state.battery_state.status = event.status
+        self._logs['battery_status'].record(event.timestamp, event.status)
+
+    def _apply_battery_plug_state(self, event):
+        self.device_state.battery_state.plug_state = event.state
+        self._logs['battery_plug_state'].record(event.timestamp, event.state)
+
+    def _apply_battery_energy_state(self, event):
+        self.device_state.battery_state.energy_state = event.state
+        self._logs['battery_energy_state'].record(event.timestamp, event.state)
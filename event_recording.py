@@ -0,0 +1,236 @@
+""" Recorded simulator events
+
+A recording holds one record per event with four fields:
+
+    time        seconds since the epoch (see clock.to_seconds)
+    event_type  value of the EventType, e.g. 'preload_app'
+    source      module that generated the event, 'trace' for trace events
+                and 'simulator' for alarms of the simulator itself
+    detail      app id of the event or name of an alarm, '' if neither
+
+Two formats are supported, chosen by the file extension before the
+codec extension (see trace_codecs):
+
+    .ndjson     one JSON object per record
+    .evrec      binary blocks of columns. Every block starts with a
+                '<II' header giving the number of strings added to the
+                string table and the number of records, followed by the
+                new strings ('<H' length and utf-8 bytes), the times as
+                float64 and the event_type, source and detail columns as
+                uint32 indices into the string table. The file starts
+                with RECORDING_MAGIC.
+
+Records are handed to a background thread in blocks, so encoding,
+compressing and writing them stays off the simulation loop.
+
+command: python3 event_recording.py preload_events.evrec.gz
+"""
+import argparse
+import array
+import datetime
+import json
+import queue
+import struct
+import sys
+import threading
+from collections import Counter
+
+from clock import to_seconds
+from trace_codecs import codec_for_extension, open_trace_file, open_trace_output, strip_codec_extension
+
+RECORDING_MAGIC = b'UAMPREC1'
+TRACE_SOURCE = 'trace'
+SIMULATOR_SOURCE = 'simulator'
+
+_BLOCK_HEADER = struct.Struct('<II')
+_STRING_LENGTH = struct.Struct('<H')
+
+
+def _little_endian(values):
+    if sys.byteorder != 'little':
+        values.byteswap()
+    return values
+
+
+def get_recording_format(filename):
+    name = strip_codec_extension(filename)
+    if name.endswith('.ndjson'):
+        return 'ndjson'
+    if name.endswith('.evrec'):
+        return 'binary'
+    raise Exception("Invalid recording type. Expected .ndjson or .evrec")
+
+
+class _NdjsonEncoder:
+    def encode(self, block):
+        lines = []
+        for timestamp, event_type, source, detail in block:
+            lines.append(json.dumps({'timestamp': timestamp.isoformat(),
+                                     'event_type': event_type,
+                                     'source': source,
+                                     'detail': detail}))
+        return ('\n'.join(lines) + '\n').encode()
+
+
+class _BinaryEncoder:
+    def __init__(self):
+        self.strings = {}
+
+    def _index(self, string, new_strings):
+        index = self.strings.get(string)
+        if index is None:
+            index = self.strings[string] = len(self.strings)
+            new_strings.append(string)
+        return index
+
+    def encode(self, block):
+        new_strings = []
+        times = array.array('d')
+        columns = (array.array('I'), array.array('I'), array.array('I'))
+        for timestamp, *fields in block:
+            times.append(to_seconds(timestamp))
+            for column, field in zip(columns, fields):
+                column.append(self._index(field, new_strings))
+
+        parts = [_BLOCK_HEADER.pack(len(new_strings), len(block))]
+        for string in new_strings:
+            data = string.encode()
+            parts.append(_STRING_LENGTH.pack(len(data)))
+            parts.append(data)
+        parts.append(_little_endian(times).tobytes())
+        for column in columns:
+            parts.append(_little_endian(column).tobytes())
+        return b''.join(parts)
+
+
+class RecordingWriter:
+    """ Buffers records and writes them from a background thread
+
+    Attributes:
+        filename (str): File the recording is written to
+        buffer_size (int): Number of records handed to the writer
+            thread at a time
+        records (int): Number of records added so far
+    """
+    def __init__(self, filename, buffer_size=4096, max_blocks=16):
+        self.filename = filename
+        self.buffer_size = buffer_size
+        self.records = 0
+
+        if get_recording_format(filename) == 'ndjson':
+            self._encoder = _NdjsonEncoder()
+        else:
+            self._encoder = _BinaryEncoder()
+        self._fp = open_trace_output(filename, codec_for_extension(filename))
+        if isinstance(self._encoder, _BinaryEncoder):
+            self._fp.write(RECORDING_MAGIC)
+
+        self._block = []
+        self._error = None
+        self._blocks = queue.Queue(max_blocks)
+        self._thread = threading.Thread(target=self._write_blocks, name='recording-writer', daemon=True)
+        self._thread.start()
+
+    def add(self, timestamp, event_type, source, detail):
+        self._block.append((timestamp, event_type, source, detail))
+        self.records += 1
+        if len(self._block) >= self.buffer_size:
+            self._blocks.put(self._block)
+            self._block = []
+
+    def _write_blocks(self):
+        while True:
+            block = self._blocks.get()
+            if block is None:
+                return
+            if self._error is None:
+                try:
+                    self._fp.write(self._encoder.encode(block))
+                except Exception as error:
+                    # Raised from close() on the simulation thread
+                    self._error = error
+
+    def close(self):
+        if self._thread is None:
+            return
+        if self._block:
+            self._blocks.put(self._block)
+            self._block = []
+        self._blocks.put(None)
+        self._thread.join()
+        self._thread = None
+        self._fp.close()
+        if self._error is not None:
+            raise Exception("Failed to write recording %s: %s" % (self.filename, self._error))
+
+
+def _load_ndjson(fp, columns):
+    for line in fp:
+        if not line.strip():
+            continue
+        record = json.loads(line)
+        columns['time'].append(to_seconds(datetime.datetime.fromisoformat(record['timestamp'])))
+        columns['event_type'].append(record['event_type'])
+        columns['source'].append(record['source'])
+        columns['detail'].append(record['detail'])
+
+
+def _read_exact(fp, size):
+    data = fp.read(size)
+    if len(data) != size:
+        raise Exception("Recording is truncated")
+    return data
+
+
+def _load_binary(fp, columns):
+    if fp.read(len(RECORDING_MAGIC)) != RECORDING_MAGIC:
+        raise Exception("Not an event recording")
+    strings = []
+    while True:
+        header = fp.read(_BLOCK_HEADER.size)
+        if not header:
+            return
+        if len(header) != _BLOCK_HEADER.size:
+            raise Exception("Recording is truncated")
+        num_strings, num_records = _BLOCK_HEADER.unpack(header)
+        for _ in range(num_strings):
+            length, = _STRING_LENGTH.unpack(_read_exact(fp, _STRING_LENGTH.size))
+            strings.append(_read_exact(fp, length).decode())
+
+        times = array.array('d')
+        times.frombytes(_read_exact(fp, 8 * num_records))
+        columns['time'].extend(_little_endian(times))
+        for name in ('event_type', 'source', 'detail'):
+            indices = array.array('I')
+            indices.frombytes(_read_exact(fp, indices.itemsize * num_records))
+            columns[name].extend(strings[index] for index in _little_endian(indices))
+
+
+def load_recording(filename):
+    """ Loads a recording as columns
+
+    Returns a dict with a 'time' array('d') of seconds since the epoch
+    and 'event_type', 'source' and 'detail' lists, one entry per record.
+    """
+    columns = {'time': array.array('d'), 'event_type': [], 'source': [], 'detail': []}
+    with open_trace_file(filename) as fp:
+        if get_recording_format(filename) == 'ndjson':
+            _load_ndjson(fp, columns)
+        else:
+            _load_binary(fp, columns)
+    return columns
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Summarize an event recording')
+    parser.add_argument('recording', type=str, help='Recording file to read')
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    recording = load_recording(args.recording)
+    print("records: %d" % len(recording['time']))
+    for (event_type, source), count in sorted(Counter(zip(recording['event_type'],
+                                                          recording['source'])).items()):
+        print("%s (%s): %d" % (event_type, source, count))
@@ -68,6 +68,25 @@ class EventType(Enum):
     SIM_ALARM = 'sim.alarm'
 
 
+def get_event_types(pattern):
+    """ Returns the event types matching a pattern
+
+    A pattern is the value of an event type, or a value followed by
+    '.*' to match every event type below it in the hierarchy, for
+    example 'battery.*'.
+    """
+    if pattern.endswith('.*'):
+        prefix = pattern[:-1]
+        matches = [event_type for event_type in EventType if event_type.value.startswith(prefix)]
+        if not matches:
+            raise Exception("No event types match '%s'" % pattern)
+        return matches
+    try:
+        return [EventType(pattern)]
+    except ValueError:
+        raise Exception("Unknown event type '%s'" % pattern)
+
+
 class Event:
     """ Base event class
 
@@ -486,6 +505,23 @@ class SystemMemorySnapshot(Event):
         Event.__init__(self, event_type=EventType.SYSTEM_MEMORY_SNAPSHOT, timestamp=timestamp)
 
 
+class PreloadAppEvent(Event):
+    """ Represents a request to preload an application
+
+    Generated by predictor modules when they decide an
+    application should be preloaded.
+
+    Attributes:
+        app_id (str): Unique id representing the application to preload
+    """
+    def __init__(self, timestamp, app_id):
+        Event.__init__(self, event_type=EventType.PRELOAD_APP, timestamp=timestamp)
+        self.app_id = app_id
+
+    def __repr__(self, *args, **kwargs):
+        return '%s: %s' % (Event.__repr__(self, args, kwargs), self.app_id)
+
+
 class TraceStart(Event):
     def __init__(self, timestamp):
         Event.__init__(self, event_type=EventType.TRACE_START, timestamp=timestamp)
@@ -500,11 +536,14 @@ class SimDebug(Event):
     
     Essentially a Pseudo event representing fact
     that a debug should occur
-    
+
+    Attributes:
+        reason (str): Why the simulator stops, printed by the debugger
     """
-    def __init__(self, timestamp):
+    def __init__(self, timestamp, reason=""):
         Event.__init__(self, event_type=EventType.SIM_DEBUG,
                        timestamp=timestamp)
+        self.reason = reason
 
 
 class SimAlarm(Event):
@@ -627,6 +666,10 @@ class EventJsonEncoder(json.JSONEncoder):
             return {'timestamp': obj.timestamp.isoformat(),
                     'event_type': obj.event_type.value,
                     'state': obj.state.value}
+        elif isinstance(obj, DockEvent):
+            return {'timestamp': obj.timestamp.isoformat(),
+                    'event_type': obj.event_type.value,
+                    'state': obj.state.value}
         elif isinstance(obj, BluetoothEvent):
             return {'timestamp': obj.timestamp.isoformat(),
                     'event_type': obj.event_type.value,
@@ -634,6 +677,10 @@ class EventJsonEncoder(json.JSONEncoder):
         elif isinstance(obj, SystemMemorySnapshot):
             return {'timestamp': obj.timestamp.isoformat(),
                     'event_type': obj.event_type.value}
+        elif isinstance(obj, PreloadAppEvent):
+            return {'timestamp': obj.timestamp.isoformat(),
+                    'event_type': obj.event_type.value,
+                    'app_id': obj.app_id}
         elif isinstance(obj, TraceStart):
             return {'timestamp': obj.timestamp.isoformat(),
                     'event_type': obj.event_type.value}
@@ -696,11 +743,15 @@ def json_decode_event(obj):
             return DeviceStorageEvent(timestamp=timestamp, state=device.StorageState(obj['state']))
         elif event_type == EventType.HEADSET:
             return HeadsetEvent(timestamp=timestamp, state=device.HeadsetState(obj['state']))
+        elif event_type == EventType.DOCK:
+            return DockEvent(timestamp=timestamp, state=device.DockState(obj['state']))
         elif event_type == EventType.BLUETOOTH:
             return BluetoothEvent(timestamp=timestamp,
                                   connection_event=BluetoothEvent.ConnectionEvent(obj['connection_event']))
         elif event_type == EventType.SYSTEM_MEMORY_SNAPSHOT:
             return SystemMemorySnapshot(timestamp=timestamp)
+        elif event_type == EventType.PRELOAD_APP:
+            return PreloadAppEvent(timestamp=timestamp, app_id=obj['app_id'])
         elif event_type == EventType.TRACE_START:
             return TraceStart(timestamp=timestamp)
         elif event_type == EventType.TRACE_END:
@@ -0,0 +1,103 @@
+""" Time series of module counters
+
+Modules publish counters to a MetricsRegistry as gauges that read an
+attribute the module already keeps. The simulator snapshots every metric at a fixed simulated-time
+interval with a repeating SimAlarm, so convergence of a predictor can be
+plotted from a single run.
+
+Snapshots are stored column-wise and written as CSV (with a header row)
+or as a 2-D float64 .npy array whose columns follow the CSV header
+without the timestamp column.
+"""
+import array
+import csv
+import sys
+
+from events import SimAlarm
+
+
+class MetricsRegistry:
+    """ Collects named metrics and snapshots them into columns
+
+    Metrics registered after the first snapshot are back-filled with
+    zeros, so every column has one value per snapshot.
+    """
+    def __init__(self):
+        self._sources = {}
+        self._timestamps = []
+        self._elapsed = array.array('d')
+        self._columns = {}
+        self._start_time = None
+        self._alarm = None
+
+    def gauge(self, name, getter):
+        """ Registers a function that returns the current value of a metric """
+        if name in self._sources:
+            raise Exception("Metric %s already exists" % name)
+        self._sources[name] = getter
+        self._columns[name] = array.array('d', bytes(8 * len(self._timestamps)))
+
+    def names(self):
+        return list(self._columns)
+
+    def schedule(self, simulator, start_time, interval):
+        """ Snapshots all metrics every interval of simulated time """
+        self._start_time = start_time
+        self._alarm = SimAlarm(timestamp=start_time + interval,
+                               handler=lambda: self.snapshot(simulator.get_current_time()),
+                               interval=interval,
+                               name='Metrics Snapshot Alarm')
+        simulator.register_alarm(self._alarm)
+
+    def snapshot(self, timestamp):
+        if self._start_time is None:
+            self._start_time = timestamp
+        if self._timestamps and self._timestamps[-1] == timestamp:
+            return
+        self._timestamps.append(timestamp)
+        self._elapsed.append((timestamp - self._start_time).total_seconds())
+        for name, getter in self._sources.items():
+            self._columns[name].append(getter())
+
+    def __len__(self):
+        return len(self._timestamps)
+
+    def get_column(self, name):
+        return self._columns[name]
+
+    def write_csv(self, path):
+        names = self.names()
+        with open(path, 'w', newline='') as fp:
+            writer = csv.writer(fp)
+            writer.writerow(['timestamp', 'elapsed_seconds'] + names)
+            columns = [self._columns[name] for name in names]
+            for row, timestamp in enumerate(self._timestamps):
+                writer.writerow([timestamp.isoformat(), repr(self._elapsed[row])] +
+                                [repr(column[row]) for column in columns])
+
+    def write_npy(self, path):
+        """ Writes elapsed seconds and all metrics as a 2-D float64 array
+
+        The array is written in Fortran order, so each column is copied
+        straight from its buffer.
+        """
+        columns = [self._elapsed] + [self._columns[name] for name in self.names()]
+        descr = '<f8' if sys.byteorder == 'little' else '>f8'
+        header = "{'descr': '%s', 'fortran_order': True, 'shape': (%d, %d), }" \
+                 % (descr, len(self._timestamps), len(columns))
+        # Magic, version, header length and header are padded to 64 bytes
+        padding = -(10 + len(header) + 1) % 64
+        header = (header + ' ' * padding + '\n').encode('latin1')
+        with open(path, 'wb') as fp:
+            fp.write(b'\x93NUMPY\x01\x00')
+            fp.write(len(header).to_bytes(2, 'little'))
+            fp.write(header)
+            for column in columns:
+                column.tofile(fp)
+
+    def write(self, path):
+        """ Writes the time series based on the file extension of path """
+        if path.endswith('.npy'):
+            self.write_npy(path)
+        else:
+            self.write_csv(path)
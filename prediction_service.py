@@ -0,0 +1,332 @@
+#! /usr/bin/env python
+""" Local prediction service for the Preload predictor
+
+Hosts a Preload module outside of a trace simulation so that other
+processes can ask which applications to preload. The module learns
+online from usage events posted to the service.
+
+Requests and responses are newline-delimited JSON objects exchanged
+over a TCP port on localhost or a Unix socket:
+
+    {"id": 1, "op": "event", "event": {<trace event json>}}
+    {"id": 2, "op": "predict", "hour": 9, "k": 3, "weekday": 0}
+    {"id": 3, "op": "stats"}
+
+Requests that arrive together are handled as one batch, so concurrent
+clients asking the same question between two updates share a single
+ranking computation.
+"""
+import argparse
+import asyncio
+import configparser
+import json
+import socket
+import time
+from collections import defaultdict
+
+from device import DeviceState
+from device_tracker import DeviceStateTracker
+from events import Event, EventType, EventJsonEncoder, json_decode_event
+from metrics import MetricsRegistry
+from sim_interface import SimulatorBase, SimModuleType
+from sim_modules.preload_predictor import Preload
+from utils import LogHistogram, PriorityQueue
+
+
+class PredictionHost(SimulatorBase):
+    """ Minimal simulator hosting a single Preload module
+
+    Simulated time is driven by the timestamps of posted events.
+    Alarms registered by the module fire once a posted event
+    passes their timestamp, as they would during a trace run.
+    """
+    MODULE_NAME = 'preload'
+
+    def __init__(self):
+        self._module = None
+        self._built = False
+        self._current_time = None
+        self._device_state = DeviceState()
+        self._device_tracker = DeviceStateTracker(self._device_state)
+        self._alarm_queue = PriorityQueue()
+        self._event_listeners = defaultdict(list)
+        self._alarm_listeners = []
+        self._preloaded = []
+        self._metrics = MetricsRegistry()
+
+    def build(self, config):
+        module_settings = {}
+        if PredictionHost.MODULE_NAME in config:
+            module_settings = config[PredictionHost.MODULE_NAME]
+        self._module = Preload(PredictionHost.MODULE_NAME,
+                               SimModuleType.PRELOAD_PREDICTOR,
+                               self, module_settings)
+        self._module.enable_stats_collection()
+
+    def get_module_for_type(self, module_type):
+        if module_type == self._module.get_type():
+            return self._module
+        return None
+
+    def has_module_instance(self, name):
+        return name == PredictionHost.MODULE_NAME
+
+    def get_module_instance(self, name):
+        return self._module
+
+    def run(self):
+        raise Exception("Prediction host is driven by posted events")
+
+    def subscribe(self, event_type, handler, event_filter=None):
+        self._event_listeners[event_type].append((event_filter, handler))
+
+    def broadcast(self, event):
+        if not event.timestamp:
+            event.timestamp = self._current_time
+        if event.event_type == EventType.PRELOAD_APP:
+            self._preloaded.append(event.app_id)
+
+        for (event_filter, handler) in self._event_listeners[event.event_type]:
+            if not event_filter or event_filter(event):
+                handler(event)
+
+    def register_alarm(self, alarm):
+        self._alarm_queue.push(alarm, alarm.timestamp)
+
+    def subscribe_alarms(self, handler):
+        self._alarm_listeners.append(handler)
+
+    def get_current_time(self):
+        return self._current_time
+
+    def get_device_state(self):
+        return self._device_state
+
+    def get_device_state_at(self, timestamp):
+        return self._device_tracker.get_state_at(timestamp)
+
+    def get_metrics(self):
+        return self._metrics
+
+    def post_event(self, event):
+        """ Advance simulated time to the event and dispatch it
+
+        Returns:
+            list: App ids the module asked to preload for this event
+        """
+        if not self._built:
+            # Module alarms are anchored on the first posted event
+            self._current_time = event.timestamp
+            self._module.build()
+            self._built = True
+
+        # Simulated time never runs backwards
+        if event.timestamp < self._current_time:
+            event.timestamp = self._current_time
+
+        while not self._alarm_queue.empty() \
+                and self._alarm_queue.peek().timestamp <= event.timestamp:
+            alarm = self._alarm_queue.pop()
+            self._current_time = alarm.timestamp
+            for handler in self._alarm_listeners:
+                handler(alarm)
+            alarm.fire()
+            if alarm.is_repeating():
+                self.register_alarm(alarm)
+
+        self._current_time = event.timestamp
+        self._preloaded = []
+        self._device_tracker.apply(event)
+        self.broadcast(event)
+        return self._preloaded
+
+    def get_top_apps(self, hour, k, weekday=None):
+        if hour is None or weekday is None:
+            if self._current_time is None:
+                return []
+            if hour is None:
+                hour = self._current_time.hour
+            if weekday is None:
+                weekday = self._current_time.weekday()
+        # Out of range values would index another bucket of the week
+        if not isinstance(hour, int) or not 0 <= hour < 24:
+            raise ValueError("hour must be an integer from 0 to 23, got %r" % (hour,))
+        if not isinstance(weekday, int) or not 0 <= weekday < 7:
+            raise ValueError("weekday must be an integer from 0 to 6, got %r" % (weekday,))
+        return self._module.get_top_apps(hour, k, weekday)
+
+
+class LatencyRecorder:
+    """ Records request latencies in a fixed-memory histogram """
+    def __init__(self):
+        self.histogram = LogHistogram(unit=1e-6)
+
+    @property
+    def count(self):
+        return self.histogram.count
+
+    def record(self, seconds):
+        self.histogram.record(seconds)
+
+    def percentiles(self, quantiles=(0.5, 0.9, 0.99, 0.999)):
+        if not self.histogram.count:
+            return {}
+        return {'p%s' % ('%g' % (q * 100)).replace('.', ''): self.histogram.percentile(q * 100) * 1e6
+                for q in quantiles}
+
+
+class PredictionService:
+    """ Asyncio server answering requests against a PredictionHost
+
+    Attributes:
+        host (:obj:'PredictionHost'): Hosted predictor state
+        address (str): 'tcp:HOST:PORT' or 'unix:PATH'
+    """
+    def __init__(self, host, address):
+        self.host = host
+        self.address = address
+        self.latency = LatencyRecorder()
+        self.batch_count = 0
+        self._pending = []
+        self._server = None
+        self._loop = None
+
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+        if self.address.startswith('unix:'):
+            self._server = await asyncio.start_unix_server(
+                self._handle_client, path=self.address[len('unix:'):])
+        elif self.address.startswith('tcp:'):
+            host, _, port = self.address[len('tcp:'):].rpartition(':')
+            self._server = await asyncio.start_server(
+                self._handle_client, host=host or 'localhost', port=int(port))
+            # Resolve the port when an ephemeral one was requested
+            sock_host, sock_port = self._server.sockets[0].getsockname()[:2]
+            self.address = 'tcp:%s:%d' % (sock_host, sock_port)
+        else:
+            raise Exception("Invalid service address. Expected 'unix:PATH' or 'tcp:HOST:PORT'")
+
+    async def serve_forever(self):
+        await self.start()
+        async with self._server:
+            await self._server.serve_forever()
+
+    def close(self):
+        if self._server is not None:
+            self._server.close()
+
+    async def _handle_client(self, reader, writer):
+        sock = writer.get_extra_info('socket')
+        if sock is not None and sock.family != socket.AF_UNIX:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                self._pending.append((writer, line, time.perf_counter()))
+                if len(self._pending) == 1:
+                    # Process everything that arrives in this loop iteration together
+                    self._loop.call_soon(self._process_batch)
+        finally:
+            writer.close()
+
+    def _process_batch(self):
+        batch = self._pending
+        self._pending = []
+        self.batch_count += 1
+
+        # Rankings only change when an event is applied
+        rankings = {}
+        for (writer, line, start) in batch:
+            request = {}
+            try:
+                request = json.loads(line)
+                op = request.get('op')
+                if op == 'predict':
+                    key = (request.get('hour'), int(request.get('k', 1)), request.get('weekday'))
+                    if key not in rankings:
+                        rankings[key] = self.host.get_top_apps(*key)
+                    response = {'apps': rankings[key]}
+                elif op == 'event':
+                    event = json_decode_event(request['event'])
+                    if not isinstance(event, Event):
+                        raise ValueError("event has no event_type")
+                    response = {'preload': self.host.post_event(event)}
+                    rankings.clear()
+                elif op == 'stats':
+                    response = {'requests': self.latency.count,
+                                'batches': self.batch_count,
+                                'latency_us': self.latency.percentiles()}
+                else:
+                    response = {'error': 'unknown op %r' % op}
+            except Exception as e:
+                # Every request is answered, so one bad request cannot
+                # leave the others in the batch waiting
+                response = {'error': '%s: %s' % (type(e).__name__, e)}
+
+            if isinstance(request, dict) and 'id' in request:
+                response['id'] = request['id']
+            if not writer.is_closing():
+                writer.write((json.dumps(response, cls=EventJsonEncoder) + '\n').encode())
+            self.latency.record(time.perf_counter() - start)
+
+
+class PredictionClient:
+    """ Blocking client for the prediction service """
+    def __init__(self, address):
+        if address.startswith('unix:'):
+            self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self._sock.connect(address[len('unix:'):])
+        elif address.startswith('tcp:'):
+            host, _, port = address[len('tcp:'):].rpartition(':')
+            self._sock = socket.create_connection((host or 'localhost', int(port)))
+            self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        else:
+            raise Exception("Invalid service address. Expected 'unix:PATH' or 'tcp:HOST:PORT'")
+        self._file = self._sock.makefile('rb')
+        self._next_id = 0
+
+    def request(self, op, **kwargs):
+        self._next_id += 1
+        kwargs.update(op=op, id=self._next_id)
+        self._sock.sendall((json.dumps(kwargs, cls=EventJsonEncoder) + '\n').encode())
+        return json.loads(self._file.readline())
+
+    def post_event(self, event):
+        return self.request('event', event=event)['preload']
+
+    def predict(self, hour=None, k=1, weekday=None):
+        return self.request('predict', hour=hour, k=k, weekday=weekday)['apps']
+
+    def stats(self):
+        return self.request('stats')
+
+    def close(self):
+        self._file.close()
+        self._sock.close()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Run the uamp preload prediction service')
+    parser.add_argument('--sim_config', type=str, required=True,
+                        help='Sim Configuration File holding the preload settings')
+    parser.add_argument('--listen', type=str, default='tcp:localhost:9100',
+                        help="Address to serve on: 'tcp:HOST:PORT' or 'unix:PATH'")
+    return parser.parse_args()
+
+
+def build_service(args):
+    config = configparser.ConfigParser()
+    config.read(args.sim_config)
+    host = PredictionHost()
+    host.build(config)
+    return PredictionService(host, args.listen)
+
+
+if __name__ == "__main__":
+    service = build_service(parse_args())
+    try:
+        asyncio.run(service.serve_forever())
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,452 @@
+#! /usr/bin/env python
+""" Decoded traces shared between simulator processes
+
+A trace is decoded once into a columnar layout that is placed in a
+multiprocessing.shared_memory segment or written to a .coltrace file.
+Simulators read it through SharedTraceReader, which maps the columns
+read-only and builds event objects one batch at a time, so running
+more simulators on the same trace does not add a decoded copy per
+process.
+
+Layout, little-endian, every section aligned to 8 bytes:
+
+    header      '<8sQQ' magic, number of events, length of the schema
+    schema      JSON: start/end time, UTC offset, string count and the
+                event class and fields of every kind of event
+    time        int64 microseconds since the epoch
+    kind        uint8 index into the schema's kinds
+    int0, int1  int64 integer and enum fields
+    number      float64 float fields
+    text0, text1
+                uint32 indices into the string table, NO_STRING for None
+    strings     uint64 offsets of num_strings + 1 boundaries followed by
+                the utf-8 bytes of all strings
+
+Events of the same class, type and field types form a kind. Fields
+are assigned to columns per kind.
+
+command: python3 shared_trace.py traces/trace2.json.gz --output trace2.coltrace
+         python3 shared_trace.py traces/trace2.json.gz --name uamp-trace2 \\
+             --run sample.cfg sweep1.cfg sweep2.cfg --workers 2
+"""
+import argparse
+import array
+import datetime
+import enum
+import importlib
+import json
+import mmap
+import os
+import signal
+import struct
+import subprocess
+import sys
+import time
+from multiprocessing import shared_memory
+
+from events import Event, EventType
+from sim_interface import TraceReader
+
+SHARED_TRACE_MAGIC = b'UAMPCOL1'
+NO_STRING = 0xffffffff
+
+_HEADER = struct.Struct('<8sQQ')
+_EPOCH = datetime.datetime(1970, 1, 1)
+_EPOCH_UTC = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+_MICROSECOND = datetime.timedelta(microseconds=1)
+
+# Column name, array typecode and the field kinds stored in it
+_COLUMNS = (
+    ('time', 'q'),
+    ('kind', 'B'),
+    ('int0', 'q'),
+    ('int1', 'q'),
+    ('number', 'd'),
+    ('text0', 'I'),
+    ('text1', 'I'),
+)
+_FIELD_COLUMNS = {
+    'int': ('int0', 'int1'),
+    'enum': ('int0', 'int1'),
+    'float': ('number',),
+    'str': ('text0', 'text1'),
+}
+# Attributes every event has
+_BASE_ATTRIBUTES = ('timestamp', 'event_type', 'source', 'destination')
+
+
+def _align(offset):
+    return (offset + 7) & ~7
+
+
+def _class_path(cls):
+    return '%s:%s' % (cls.__module__, cls.__qualname__)
+
+
+def _resolve_class(path):
+    module_name, _, qualname = path.partition(':')
+    obj = importlib.import_module(module_name)
+    for name in qualname.split('.'):
+        obj = getattr(obj, name)
+    return obj
+
+
+def _field_kind(value):
+    if isinstance(value, enum.Enum):
+        return 'enum'
+    if isinstance(value, bool):
+        raise Exception("Boolean event fields are not supported")
+    if isinstance(value, int):
+        return 'int'
+    if isinstance(value, float):
+        return 'float'
+    if value is None or isinstance(value, str):
+        return 'str'
+    raise Exception("Unsupported event field type %s" % type(value).__name__)
+
+
+def _make_kind(event):
+    """ Schema entry of the events of the same class and type as event """
+    fields = []
+    used = {}
+    for attr, value in sorted(vars(event).items()):
+        if attr in _BASE_ATTRIBUTES:
+            continue
+        field_kind = _field_kind(value)
+        columns = _FIELD_COLUMNS[field_kind]
+        position = used.get(columns, 0)
+        if position >= len(columns):
+            raise Exception("Too many %s fields in %s" % (field_kind, type(event).__name__))
+        used[columns] = position + 1
+        enum_class = _class_path(type(value)) if field_kind == 'enum' else None
+        fields.append([attr, field_kind, columns[position], enum_class])
+    return {'event_type': event.event_type.value, 'class': _class_path(type(event)), 'fields': fields}
+
+
+class _Encoder:
+    def __init__(self, start_time):
+        self.utc_offset = None if start_time.tzinfo is None \
+            else start_time.utcoffset().total_seconds()
+        self.columns = {name: array.array(typecode) for name, typecode in _COLUMNS}
+        self.kinds = []
+        self._kind_index = {}
+        self.strings = []
+        self._string_index = {}
+
+    def timestamp(self, timestamp):
+        if self.utc_offset is None:
+            if timestamp.tzinfo is not None:
+                raise Exception("Trace mixes naive and timezone aware timestamps")
+            return (timestamp - _EPOCH) // _MICROSECOND
+        if timestamp.tzinfo is None or timestamp.utcoffset().total_seconds() != self.utc_offset:
+            raise Exception("Shared traces need the same UTC offset for every timestamp")
+        return (timestamp - _EPOCH_UTC) // _MICROSECOND
+
+    def string(self, value):
+        if value is None:
+            return NO_STRING
+        index = self._string_index.get(value)
+        if index is None:
+            index = self._string_index[value] = len(self.strings)
+            self.strings.append(value)
+        return index
+
+    def add(self, event):
+        # Some traces hold events whose enum fields use another enum
+        # class, those get a kind of their own
+        key = (type(event), event.event_type) + tuple(
+            type(value) if isinstance(value, enum.Enum) else _field_kind(value)
+            for attr, value in sorted(vars(event).items()) if attr not in _BASE_ATTRIBUTES)
+        kind = self._kind_index.get(key)
+        if kind is None:
+            if len(self.kinds) > 255:
+                raise Exception("Trace has too many kinds of events to share")
+            kind = self._kind_index[key] = len(self.kinds)
+            self.kinds.append(_make_kind(event))
+        row = {'time': self.timestamp(event.timestamp), 'kind': kind,
+               'int0': 0, 'int1': 0, 'number': 0.0, 'text0': NO_STRING, 'text1': NO_STRING}
+        for attr, field_kind, column, _ in self.kinds[kind]['fields']:
+            value = getattr(event, attr)
+            if field_kind == 'enum':
+                value = value.value
+            elif field_kind == 'str':
+                value = self.string(value)
+            row[column] = value
+        for name, column in self.columns.items():
+            column.append(row[name])
+
+
+def encode_trace(trace_data):
+    """ Returns the shared layout of a trace dict (see convert_trace.read_trace) """
+    if sys.byteorder != 'little':
+        raise Exception("Shared traces are only supported on little-endian machines")
+    encoder = _Encoder(trace_data['start_time'])
+    for event in trace_data['logs']:
+        encoder.add(event)
+
+    string_data = [string.encode() for string in encoder.strings]
+    string_offsets = array.array('Q', [0])
+    for data in string_data:
+        string_offsets.append(string_offsets[-1] + len(data))
+
+    schema = json.dumps({
+        'start_time': encoder.timestamp(trace_data['start_time']),
+        'end_time': encoder.timestamp(trace_data['end_time']),
+        'utc_offset': encoder.utc_offset,
+        'num_strings': len(encoder.strings),
+        'kinds': encoder.kinds,
+    }).encode()
+
+    parts = [_HEADER.pack(SHARED_TRACE_MAGIC, len(trace_data['logs']), len(schema)), schema]
+    offset = _HEADER.size + len(schema)
+    for name, _ in _COLUMNS:
+        parts.append(bytes(_align(offset) - offset))
+        offset = _align(offset)
+        data = encoder.columns[name].tobytes()
+        parts.append(data)
+        offset += len(data)
+    parts.append(bytes(_align(offset) - offset))
+    parts.append(string_offsets.tobytes())
+    parts.extend(string_data)
+    return b''.join(parts)
+
+
+def create_shared_trace(trace_data, name=None):
+    """ Places a trace in a new shared memory segment
+
+    The caller owns the returned SharedMemory and must unlink it once
+    no simulator needs the trace any more.
+    """
+    data = encode_trace(trace_data)
+    segment = shared_memory.SharedMemory(name=name, create=True, size=len(data))
+    segment.buf[:len(data)] = data
+    return segment
+
+
+def write_shared_trace(trace_data, path):
+    with open(path, 'wb') as fp:
+        fp.write(encode_trace(trace_data))
+
+
+def _attach_segment(name):
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Before Python 3.13 attaching registers the segment with the
+        # resource tracker, which would unlink it when this process exits
+        from multiprocessing import resource_tracker
+        segment = shared_memory.SharedMemory(name=name)
+        resource_tracker.unregister(segment._name, 'shared_memory')
+        return segment
+
+
+class SharedTraceReader(TraceReader):
+    """ Trace reader over a shared columnar trace
+
+    Attributes:
+        source (str): 'shm:NAME' for a shared memory segment, otherwise
+            the path of a .coltrace file
+    """
+    def __init__(self, source):
+        self.source = source
+        self.start_time = None
+        self.end_time = None
+        self.trace_pos = 0
+        self.count = 0
+
+        self._segment = None
+        self._mmap = None
+        self._views = []
+        self._columns = {}
+        self._kinds = []
+        self._strings = {}
+        self._string_offsets = None
+        self._string_data = None
+        self._tz = None
+
+    def _view(self, buf, offset, typecode, length):
+        view = buf[offset:offset + length * struct.calcsize(typecode)].cast(typecode)
+        self._views.append(view)
+        return view
+
+    def build(self):
+        if sys.byteorder != 'little':
+            raise Exception("Shared traces are only supported on little-endian machines")
+        if self.source.startswith('shm:'):
+            self._segment = _attach_segment(self.source[len('shm:'):])
+            buf = self._segment.buf
+        else:
+            with open(self.source, 'rb') as fp:
+                self._mmap = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+            buf = memoryview(self._mmap)
+            self._views.append(buf)
+
+        magic, self.count, schema_length = _HEADER.unpack_from(buf, 0)
+        if magic != SHARED_TRACE_MAGIC:
+            raise Exception("%s is not a shared trace" % self.source)
+        offset = _HEADER.size
+        schema = json.loads(bytes(buf[offset:offset + schema_length]))
+        offset += schema_length
+        for name, typecode in _COLUMNS:
+            offset = _align(offset)
+            self._columns[name] = self._view(buf, offset, typecode, self.count)
+            offset += self.count * struct.calcsize(typecode)
+        offset = _align(offset)
+        num_strings = schema['num_strings']
+        self._string_offsets = self._view(buf, offset, 'Q', num_strings + 1)
+        offset += 8 * (num_strings + 1)
+        self._string_data = self._view(buf, offset, 'B', self._string_offsets[-1])
+
+        if schema['utc_offset'] is not None:
+            self._tz = datetime.timezone(datetime.timedelta(seconds=schema['utc_offset']))
+        self._kinds = []
+        for kind in schema['kinds']:
+            fields = [(attr, column, _resolve_class(enum_class) if enum_class else None,
+                       field_kind == 'str')
+                      for attr, field_kind, column, enum_class in kind['fields']]
+            self._kinds.append((_resolve_class(kind['class']), EventType(kind['event_type']), fields))
+
+        self.start_time = self._timestamp(schema['start_time'])
+        self.end_time = self._timestamp(schema['end_time'])
+        self.trace_pos = 0
+
+    def finish(self):
+        self._columns = {}
+        self._string_offsets = None
+        self._string_data = None
+        for view in reversed(self._views):
+            view.release()
+        self._views = []
+        if self._segment is not None:
+            self._segment.close()
+            self._segment = None
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+
+    def _timestamp(self, microseconds):
+        if self._tz is None:
+            return _EPOCH + datetime.timedelta(microseconds=microseconds)
+        return (_EPOCH_UTC + datetime.timedelta(microseconds=microseconds)).astimezone(self._tz)
+
+    def _string(self, index):
+        if index == NO_STRING:
+            return None
+        string = self._strings.get(index)
+        if string is None:
+            start, end = self._string_offsets[index], self._string_offsets[index + 1]
+            string = self._strings[index] = bytes(self._string_data[start:end]).decode()
+        return string
+
+    def _event(self, pos):
+        cls, event_type, fields = self._kinds[self._columns['kind'][pos]]
+        event = cls.__new__(cls)
+        Event.__init__(event, self._timestamp(self._columns['time'][pos]), event_type)
+        for attr, column, enum_class, is_string in fields:
+            value = self._columns[column][pos]
+            if is_string:
+                value = self._string(value)
+            elif enum_class is not None:
+                value = enum_class(value)
+            setattr(event, attr, value)
+        return event
+
+    def get_event(self):
+        if self.end_of_trace():
+            return None
+        event = self._event(self.trace_pos)
+        self.trace_pos += 1
+        return event
+
+    def peek_event(self):
+        if self.end_of_trace():
+            return None
+        return self._event(self.trace_pos)
+
+    def end_of_trace(self):
+        return self.trace_pos >= self.count
+
+    def get_events(self, count):
+        end = min(self.trace_pos + count, self.count)
+        events_list = [self._event(pos) for pos in range(self.trace_pos, end)]
+        self.trace_pos = end
+        return events_list
+
+    def get_start_time(self):
+        return self.start_time
+
+    def get_end_time(self):
+        return self.end_time
+
+
+def run_simulations(trace_source, configs, workers, output_dir, extra_args=()):
+    """ Runs one simulator process per config against a shared trace
+
+    At most 'workers' simulators run at a time. The stats of each run
+    are written to <output_dir>/<config name>.txt.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    simulator = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'uamp_sim.py')
+    pending = list(configs)
+    running = []
+    failed = []
+    while pending or running:
+        while pending and len(running) < workers:
+            config = pending.pop(0)
+            name = os.path.splitext(os.path.basename(config))[0]
+            output = open(os.path.join(output_dir, name + '.txt'), 'w')
+            process = subprocess.Popen([sys.executable, simulator, '--trace', trace_source,
+                                        '--sim_config', config] + list(extra_args), stdout=output)
+            running.append((config, process, output))
+        config, process, output = running.pop(0)
+        if process.wait() != 0:
+            failed.append(config)
+        output.close()
+    if failed:
+        raise Exception("Simulations failed for %s" % ', '.join(failed))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Share a decoded trace between simulator processes')
+    parser.add_argument('trace', type=str, help='Trace file to decode')
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument('--output', type=str,
+                        help='Write the decoded trace to a .coltrace file')
+    target.add_argument('--name', type=str,
+                        help='Name of the shared memory segment to create')
+    parser.add_argument('--run', type=str, nargs='*', default=[],
+                        help='Sim configs to run against the shared trace, otherwise the '
+                             'segment is kept until interrupted')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help='Number of simulators to run at a time')
+    parser.add_argument('--output_dir', type=str, default='runs',
+                        help='Directory to write the stats of each run to')
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    from convert_trace import read_trace
+    args = parse_args()
+    trace_data = read_trace(args.trace)
+    if args.output:
+        write_shared_trace(trace_data, args.output)
+        if args.run:
+            run_simulations(args.output, args.run, args.workers, args.output_dir)
+    else:
+        segment = create_shared_trace(trace_data, args.name)
+        del trace_data
+        try:
+            if args.run:
+                run_simulations('shm:' + segment.name, args.run, args.workers, args.output_dir)
+            else:
+                print("Shared trace %s (%d bytes), use --trace shm:%s. Interrupt to remove it."
+                      % (segment.name, segment.size, segment.name), flush=True)
+                signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+                try:
+                    while True:
+                        time.sleep(3600)
+                except KeyboardInterrupt:
+                    pass
+        finally:
+            segment.close()
+            segment.unlink()
@@ -0,0 +1,99 @@
+""" Breakpoints and watches of the simulator debug console
+
+Breakpoints are compiled into event filters that the simulator
+subscribes ahead of the modules, so between hits events are only
+checked by the listeners of the types a breakpoint is set on.
+"""
+import operator
+from enum import Enum
+
+from events import get_event_types
+
+
+def _matches(value, expected):
+    if isinstance(value, Enum):
+        return expected == str(value.value) or expected.upper() == value.name
+    return expected == str(value)
+
+
+def compile_conditions(conditions):
+    """ Builds an event filter from 'attr=value' conditions
+
+    Attribute values are compared as strings. Enums match their value
+    or, ignoring case, their name, so 'state=on' and 'state=1' both
+    match a ScreenEvent whose state is ScreenState.ON.
+    Returns None when there are no conditions.
+    """
+    checks = []
+    for condition in conditions:
+        attr, sep, expected = condition.partition('=')
+        if not sep or not attr:
+            raise Exception("Breakpoint condition '%s' is not of the form attr=value" % condition)
+        checks.append((operator.attrgetter(attr), expected))
+    if not checks:
+        return None
+
+    def event_filter(event):
+        for getter, expected in checks:
+            try:
+                value = getter(event)
+            except AttributeError:
+                return False
+            if not _matches(value, expected):
+                return False
+        return True
+    return event_filter
+
+
+class Breakpoint:
+    """ Stop of the debugger on events of some types
+
+    Attributes:
+        number (int): Number used to delete the breakpoint
+        spec (str): Breakpoint as it was entered
+        event_types (list): Event types the breakpoint is set on
+        event_filter (:obj:'function'): Conditions an event must meet,
+            None to stop on every event of the types
+        handler (:obj:'function'): Listener the simulator subscribed
+            for the breakpoint
+        hits (int): Number of times the breakpoint stopped
+    """
+    def __init__(self, number, pattern, conditions):
+        self.number = number
+        self.spec = ' '.join([pattern] + list(conditions))
+        self.event_types = get_event_types(pattern)
+        self.event_filter = compile_conditions(conditions)
+        self.handler = None
+        self.hits = 0
+
+    def __repr__(self):
+        return '%d: break %s (%d hits)' % (self.number, self.spec, self.hits)
+
+
+class Watch:
+    """ Stop of the debugger when an attribute of a module changes
+
+    Values are compared with !=, so watches suit scalar attributes;
+    a container changed in place is not noticed.
+
+    Attributes:
+        spec (str): '<module>.<attr>' as it was entered
+        value: Value of the attribute when it was last checked
+        previous: Value before the last change
+    """
+    def __init__(self, spec, sim_module, attr):
+        self.spec = spec
+        self._getter = operator.attrgetter(attr)
+        self._module = sim_module
+        self.value = self._getter(sim_module)
+        self.previous = None
+
+    def changed(self):
+        value = self._getter(self._module)
+        if value != self.value:
+            self.previous, self.value = self.value, value
+            return True
+        return False
+
+    def __repr__(self):
+        return 'watch %s = %r' % (self.spec, self.value)
@@ -1,5 +1,6 @@
 from abc import ABCMeta, abstractmethod
 from enum import Enum, unique
+from functools import partial
 
 
 @unique
@@ -8,6 +9,8 @@ class SimModuleType(Enum):
     REUSE_PREDICTOR = 'reuse-predictor'
     MEMORY_MANAGER = 'memory-manager'
     FREQUENCY_COUNTER = 'frequency-counter'
+    LAUNCH_COST_MODEL = 'launch-cost-model'
+    EVENT_RECORDER = 'event-recorder'
 
 
 class SimModule(metaclass=ABCMeta):
@@ -29,6 +32,22 @@ class SimModule(metaclass=ABCMeta):
     def disable_stats_collection(self):
         self.collect_stats = False
 
+    def get_state(self):
+        """ Returns learned state to persist between runs
+
+        Modules with state worth keeping return a dict mapping section
+        names to values supported by state_store.save_state.
+        """
+        return None
+
+    def set_state(self, state):
+        """ Restores state previously returned by get_state
+
+        Called before build(). 'state' maps the section names returned
+        by get_state to the values read back from the state file.
+        """
+        pass
+
     @abstractmethod
     def build(self):
         pass
@@ -42,6 +61,20 @@ class SimModule(metaclass=ABCMeta):
         pass
 
 
+def handler_module_name(handler):
+    """ Returns the name of the module a handler is a method of
+
+    Handlers bound with functools.partial are unwrapped. Returns None
+    for handlers that do not belong to a SimModule.
+    """
+    while isinstance(handler, partial):
+        handler = handler.func
+    owner = getattr(handler, '__self__', None)
+    if isinstance(owner, SimModule):
+        return owner.get_name()
+    return None
+
+
 class TraceReader(metaclass=ABCMeta):
     @abstractmethod
     def build(self):
@@ -75,6 +108,10 @@ class TraceReader(metaclass=ABCMeta):
     def get_end_time(self):
         pass
 
+    def print_stats(self, output):
+        """ Writes reader statistics at the end of a run, if any """
+        pass
+
 
 class SimulatorBase(metaclass=ABCMeta):
     @abstractmethod
@@ -109,6 +146,11 @@ class SimulatorBase(metaclass=ABCMeta):
     def register_alarm(self, alarm):
         pass
 
+    @abstractmethod
+    def subscribe_alarms(self, handler):
+        """ Calls handler with every alarm just before it fires """
+        pass
+
     @abstractmethod
     def get_current_time(self):
         pass
@@ -116,3 +158,11 @@ class SimulatorBase(metaclass=ABCMeta):
     @abstractmethod
     def get_device_state(self):
         pass
+
+    @abstractmethod
+    def get_device_state_at(self, timestamp):
+        pass
+
+    @abstractmethod
+    def get_metrics(self):
+        pass
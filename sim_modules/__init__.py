@@ -1,5 +1,10 @@
 from sim_modules.preload_predictor import Preload
 from sim_modules.frequency_counter import FrequencyCounter
+from sim_modules.context_predictor import ContextPredictor
+from sim_modules.markov_predictor import MarkovPredictor
+from sim_modules.memory_manager import MemoryManager
+from sim_modules.launch_cost import LaunchCostModel
+from sim_modules.event_recorder import EventRecorder
 from sim_interface import SimModuleType
 
 
@@ -9,5 +14,15 @@ def get_simulator_module(module_name, simulator, module_settings):
         return Preload(module_name, SimModuleType.PRELOAD_PREDICTOR, simulator, module_settings)
     elif module_name == "frequencycounter":
         return FrequencyCounter(module_name, SimModuleType.FREQUENCY_COUNTER, simulator, module_settings)
+    elif module_name == "contextpredictor":
+        return ContextPredictor(module_name, SimModuleType.PRELOAD_PREDICTOR, simulator, module_settings)
+    elif module_name == "markov":
+        return MarkovPredictor(module_name, SimModuleType.REUSE_PREDICTOR, simulator, module_settings)
+    elif module_name == "memorymanager":
+        return MemoryManager(module_name, SimModuleType.MEMORY_MANAGER, simulator, module_settings)
+    elif module_name == "launchcost":
+        return LaunchCostModel(module_name, SimModuleType.LAUNCH_COST_MODEL, simulator, module_settings)
+    elif module_name == "eventrecorder":
+        return EventRecorder(module_name, SimModuleType.EVENT_RECORDER, simulator, module_settings)
     else:
         print("No relative module is created")
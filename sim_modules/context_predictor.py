@@ -0,0 +1,221 @@
+from sim_interface import SimModule
+from events import EventType, AppActivityUsageEvent, PreloadAppEvent
+from device import ScreenState, HeadsetState, DockState, NetworkConnectionState, BatteryStatus, BatteryPlugState
+import datetime
+import math
+
+
+class ContextTable:
+    """ Sparse app counts for a single device context
+
+    Attributes:
+        counts (dict): App id to decayed launch weight
+        total (float): Sum of all weights in the table
+        top (list): Cached app ids with the highest weights, in
+            descending order
+    """
+    def __init__(self):
+        self.counts = {}
+        self.total = 0.0
+        self.top = []
+
+
+class ContextPredictor(SimModule):
+    """ Predicts the app to preload from the current device context
+
+    Launches are counted per context, where a context combines a set
+    of DeviceState features (headset, dock, network, charging) with
+    the hour bucket of the launch. Each context keeps its own sparse
+    count table and a cached top-k list, so a prediction only reads
+    the cache of the current context.
+
+    Memory is bounded by max_contexts and max_apps_per_context. When
+    either bound is exceeded the rarest quarter of the entries is
+    evicted, skipping the cached top-k apps of a table. Counts decay
+    by 'depreciation' every 'decay_interval' hours; the decay is
+    applied lazily by scaling up new increments.
+    """
+    FEATURES = ('headset', 'dock', 'network', 'charging', 'hour')
+    RESCALE_LIMIT = 1e100
+
+    def __init__(self, name, module_type, simulator, module_settings):
+        super(ContextPredictor, self).__init__(name, module_type, simulator)
+        self.features = module_settings.get('features', ' '.join(ContextPredictor.FEATURES)).split()
+        for feature in self.features:
+            if feature not in ContextPredictor.FEATURES:
+                raise Exception("Unknown context feature '%s'" % feature)
+        self.hour_buckets = int(module_settings.get('hour_buckets', '6'))
+        # The hour bucket takes 5 bits of the context key
+        if not 1 <= self.hour_buckets <= 24:
+            raise Exception("hour_buckets must be between 1 and 24")
+        self.top_k = int(module_settings.get('top_k', '3'))
+        self.min_count = float(module_settings.get('min_count', '5'))
+        self.max_contexts = int(module_settings.get('max_contexts', '512'))
+        self.max_apps_per_context = int(module_settings.get('max_apps_per_context', '64'))
+        if self.max_apps_per_context <= self.top_k:
+            raise Exception("max_apps_per_context must be larger than top_k")
+        self.depreciation = float(module_settings.get('depreciation', '0.5'))
+        if not 0 < self.depreciation <= 1:
+            raise Exception("depreciation must be in (0, 1]")
+        self.decay_interval = datetime.timedelta(hours=float(module_settings.get('decay_interval', '24')))
+        self.margin = datetime.timedelta(seconds=float(module_settings.get('margin', '300')))
+
+        self.tables = {}
+        self.global_table = ContextTable()
+        self.weight = 1.0
+        self.next_decay_time = None
+
+        # prediction stats
+        self.prediction = (None, None, ())
+        self.total_predictions = 0
+        self.correct = 0
+        self.top_k_correct = 0
+        self.fallback_predictions = 0
+        self.evicted_contexts = 0
+        self.evicted_apps = 0
+
+    def build(self):
+        self.simulator.subscribe(EventType.SCREEN, self.predict,
+                                 lambda event: event.state == ScreenState.USER_PRESENT)
+        self.simulator.subscribe(EventType.APP_ACTIVITY_USAGE, self.update,
+                                 lambda event: event.usage_event == AppActivityUsageEvent.UsageEvent.MOVE_FOREGROUND)
+        self.next_decay_time = self.simulator.get_current_time() + self.decay_interval
+
+        metrics = self.simulator.get_metrics()
+        metrics.gauge(self.name + '.predictions', lambda: self.total_predictions)
+        metrics.gauge(self.name + '.correct', lambda: self.correct)
+        metrics.gauge(self.name + '.top_k_correct', lambda: self.top_k_correct)
+        metrics.gauge(self.name + '.fallback_predictions', lambda: self.fallback_predictions)
+
+    def finish(self):
+        pass
+
+    def get_context(self, timestamp):
+        """ Packs the enabled context features into an integer key """
+        device_state = self.simulator.get_device_state()
+        key = 0
+        for feature in self.features:
+            if feature == 'headset':
+                key = (key << 1) | (device_state.headset_state == HeadsetState.PLUGGED)
+            elif feature == 'dock':
+                dock_state = device_state.dock_state
+                key = (key << 3) | (0 if dock_state == DockState.UNKNOWN else dock_state.value + 1)
+            elif feature == 'network':
+                # 0 when disconnected, 1 when connected to an unknown type
+                network_state = device_state.network_state
+                connected = network_state.connection_state == NetworkConnectionState.CONNECTED
+                key = (key << 3) | (network_state.type.value + 2 if connected else 0)
+            elif feature == 'charging':
+                battery_state = device_state.battery_state
+                key = (key << 1) | (battery_state.status == BatteryStatus.CHARGING or
+                                    battery_state.plug_state != BatteryPlugState.NONE)
+            elif feature == 'hour':
+                key = (key << 5) | (timestamp.hour * self.hour_buckets // 24)
+        return key
+
+    def predict(self, event):
+        self.apply_decay(event.timestamp)
+        table = self.tables.get(self.get_context(event.timestamp))
+        if table is None or table.total < self.min_count * self.weight:
+            # Back off to the context free counts for rare contexts
+            table = self.global_table
+            if table.total < self.min_count * self.weight:
+                return
+            self.fallback_predictions += 1
+
+        app_id = table.top[0]
+        self.total_predictions += 1
+        self.prediction = (app_id, event.timestamp, tuple(table.top))
+        self.simulator.broadcast(PreloadAppEvent(event.timestamp, app_id))
+
+    def update(self, event):
+        app_id, timestamp, top = self.prediction
+        if timestamp is not None:
+            if event.timestamp - timestamp < self.margin:
+                if event.app_id == app_id:
+                    self.correct += 1
+                if event.app_id in top:
+                    self.top_k_correct += 1
+            self.prediction = (None, None, ())
+
+        self.apply_decay(event.timestamp)
+
+        context = self.get_context(event.timestamp)
+        table = self.tables.get(context)
+        if table is None:
+            if len(self.tables) >= self.max_contexts:
+                self.evict_contexts()
+            table = self.tables[context] = ContextTable()
+
+        self.add_launch(table, event.app_id)
+        self.add_launch(self.global_table, event.app_id)
+
+    def apply_decay(self, timestamp):
+        # Scaling new increments up is equivalent to scaling all
+        # existing counts down, and keeps every ranking intact
+        if timestamp < self.next_decay_time:
+            return
+        intervals = (timestamp - self.next_decay_time) // self.decay_interval + 1
+        self.next_decay_time += intervals * self.decay_interval
+
+        # The growth is computed in log space, since the weight would
+        # overflow after a long enough gap between events
+        log_weight = math.log(self.weight) - intervals * math.log(self.depreciation)
+        if log_weight <= math.log(ContextPredictor.RESCALE_LIMIT):
+            self.weight /= self.depreciation ** intervals
+            return
+
+        # Counts that decayed this far may underflow to zero
+        factor = math.exp(-log_weight)
+        for table in list(self.tables.values()) + [self.global_table]:
+            for app_id in table.counts:
+                table.counts[app_id] *= factor
+            table.total *= factor
+        self.weight = 1.0
+
+    def add_launch(self, table, app_id):
+        counts = table.counts
+        if app_id not in counts and len(counts) >= self.max_apps_per_context:
+            self.evict_apps(table)
+        count = counts.get(app_id, 0.0) + self.weight
+        counts[app_id] = count
+        table.total += self.weight
+
+        # Counts only grow, so the cached top-k only changes when the
+        # updated app is in it or overtakes its last entry
+        top = table.top
+        if app_id in top:
+            top.remove(app_id)
+        elif len(top) >= self.top_k and count <= counts[top[-1]]:
+            return
+        pos = len(top)
+        while pos > 0 and counts[top[pos - 1]] < count:
+            pos -= 1
+        top.insert(pos, app_id)
+        del top[self.top_k:]
+
+    def evict_apps(self, table):
+        # The cached top-k apps are never evicted, the rarest of the
+        # other apps are
+        keep = set(table.top)
+        ranked = [app_id for app_id in sorted(table.counts, key=table.counts.get) if app_id not in keep]
+        for app_id in ranked[:max(1, len(table.counts) // 4)]:
+            table.total -= table.counts.pop(app_id)
+            self.evicted_apps += 1
+
+    def evict_contexts(self):
+        ranked = sorted(self.tables, key=lambda context: self.tables[context].total)
+        for context in ranked[:max(1, len(ranked) // 4)]:
+            del self.tables[context]
+            self.evicted_contexts += 1
+
+    def print_stats(self, output):
+        output.write("contexts tracked: %s\n" % len(self.tables))
+        output.write("contexts evicted: %s\n" % self.evicted_contexts)
+        output.write("apps evicted: %s\n" % self.evicted_apps)
+        output.write("num correct: %s\n" % self.correct)
+        output.write("total prediction: %s\n" % self.total_predictions)
+        output.write("fallback prediction: %s\n" % self.fallback_predictions)
+        if self.total_predictions:
+            output.write("accuracy: %s\n" % (self.correct / self.total_predictions))
+            output.write("top %d accuracy: %s\n" % (self.top_k, self.top_k_correct / self.total_predictions))
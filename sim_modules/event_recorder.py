@@ -0,0 +1,68 @@
+from sim_interface import SimModule, handler_module_name
+from events import get_event_types
+from event_recording import RecordingWriter, SIMULATOR_SOURCE, TRACE_SOURCE
+
+
+class EventRecorder(SimModule):
+    """ Records chosen events of a run to a file for offline analysis
+
+    Events are recorded with the module that generated them (see
+    event_recording for the formats). Events read from the trace are
+    recorded with source 'trace', alarm firings with the module that
+    registered the alarm.
+
+    Settings:
+        output: Recording file, .ndjson or .evrec with an optional
+            codec extension such as .gz
+        event_types: Space separated event types to record. A type
+            ending in '.*' records every type below it, e.g. 'battery.*'
+        alarms: Whether to record alarm firings
+        buffer_size: Records handed to the writer thread at a time
+    """
+    def __init__(self, name, module_type, simulator, module_settings):
+        super(EventRecorder, self).__init__(name, module_type, simulator)
+        self.output = module_settings.get('output', '')
+        if not self.output:
+            raise Exception("Event recorder needs an output file")
+        self.event_types = self.parse_event_types(module_settings.get('event_types', 'preload_app'))
+        self.record_alarms = module_settings.get('alarms', 'false').lower() in ('true', 'yes', '1')
+        self.buffer_size = int(module_settings.get('buffer_size', '4096'))
+
+        self.writer = None
+        self.counts = {}
+
+    @staticmethod
+    def parse_event_types(setting_value):
+        event_types = []
+        for pattern in setting_value.split():
+            event_types.extend(event_type for event_type in get_event_types(pattern)
+                               if event_type not in event_types)
+        return event_types
+
+    def build(self):
+        self.writer = RecordingWriter(self.output, self.buffer_size)
+        for event_type in self.event_types:
+            self.simulator.subscribe(event_type, self.record)
+        if self.record_alarms:
+            self.simulator.subscribe_alarms(self.record_alarm)
+
+    def record(self, event):
+        event_type = event.event_type.value
+        self.counts[event_type] = self.counts.get(event_type, 0) + 1
+        self.writer.add(event.timestamp, event_type, event.source or TRACE_SOURCE,
+                        getattr(event, 'app_id', ''))
+
+    def record_alarm(self, alarm):
+        event_type = alarm.event_type.value
+        self.counts[event_type] = self.counts.get(event_type, 0) + 1
+        self.writer.add(alarm.timestamp, event_type,
+                        alarm.source or handler_module_name(alarm.handler) or SIMULATOR_SOURCE, alarm.name)
+
+    def print_stats(self, output):
+        output.write("output: %s\n" % self.output)
+        output.write("records: %d\n" % self.writer.records)
+        for event_type, count in sorted(self.counts.items()):
+            output.write("%s: %d\n" % (event_type, count))
+
+    def finish(self):
+        self.writer.close()
@@ -1,34 +1,135 @@
 from sim_interface import SimModule
-from events import EventType, Event, ScreenEvent
+from events import EventType
+from functools import partial
+import array
+import csv
+import datetime
 
 
 class FrequencyCounter(SimModule):
+    """ Counts events per event type and hour of the trace
+
+    Every event type is subscribed with its own handler bound to the
+    ordinal of the type, so counting an event is an index into the
+    counter row of the current hour. A new row is started whenever an
+    event passes the end of the current clock hour.
+
+    Rollups over the event type hierarchy ('battery.*' for all battery
+    events) and the hour-of-day and per-day histograms are computed
+    from the hourly rows when the stats are printed.
+
+    Settings:
+        histograms: Space separated list of 'hour' and 'day'
+        csv_output: File to write the hourly counts of every type to
+    """
+    HOUR = datetime.timedelta(hours=1)
+
     def __init__(self, name, module_type, simulator, module_settings):
         super(FrequencyCounter, self).__init__(name, module_type, simulator)
         self.name = name
         self.module_type = module_type
         self.simulator = simulator
-        self.event_counter = {}
+
+        self.event_types = list(EventType)
+        self.histograms = module_settings.get('histograms', '').split()
+        for histogram in self.histograms:
+            if histogram not in ('hour', 'day'):
+                raise Exception("Unknown frequency counter histogram '%s'" % histogram)
+        self.csv_output = module_settings.get('csv_output', '')
+
+        # one row of counts per hour of the trace, indexed by ordinal
+        self.start_time = None
+        self.rows = []
+        self._row = None
+        self._row_end = None
 
     def build(self):
-        for i, event_type in enumerate(EventType):
-            self.simulator.subscribe(event_type, self.freq_count)
+        # Rows cover whole hours of the clock
+        self.start_time = self.simulator.get_current_time().replace(minute=0, second=0, microsecond=0)
+        self._new_row()
+        self._row_end = self.start_time + FrequencyCounter.HOUR
+        for ordinal, event_type in enumerate(self.event_types):
+            self.simulator.subscribe(event_type, partial(self.freq_count, ordinal))
 
     def finish(self):
-        pass
+        if self.csv_output:
+            self.write_csv(self.csv_output)
+
+    def _new_row(self):
+        self._row = array.array('q', bytes(8 * len(self.event_types)))
+        self.rows.append(self._row)
 
     # method to handle the event type being called
-    def freq_count(self, event):
-        event_type = event.event_type
-        if event_type in self.event_counter:
-            self.event_counter[event_type] += 1
-        else:
-            self.event_counter.update({event_type: 1})
+    def freq_count(self, ordinal, event):
+        if event.timestamp >= self._row_end:
+            # Hours without events get empty rows, so row i always
+            # covers hour i of the trace
+            while event.timestamp >= self._row_end:
+                self._new_row()
+                self._row_end += FrequencyCounter.HOUR
+        self._row[ordinal] += 1
 
-    # method to verify the preload result
-    def verify(self, event):
-        pass
+    def get_totals(self):
+        totals = [0] * len(self.event_types)
+        for row in self.rows:
+            for ordinal, count in enumerate(row):
+                totals[ordinal] += count
+        return totals
+
+    def get_rollups(self, totals):
+        """ Sums the totals of every prefix in the event type hierarchy """
+        rollups = {}
+        for event_type, count in zip(self.event_types, totals):
+            parts = event_type.value.split('.')
+            for depth in range(1, len(parts)):
+                prefix = '.'.join(parts[:depth]) + '.*'
+                rollups[prefix] = rollups.get(prefix, 0) + count
+        return rollups
+
+    def get_hour_histogram(self):
+        histogram = [0] * 24
+        hour = self.start_time.hour
+        for row in self.rows:
+            histogram[hour] += sum(row)
+            hour = (hour + 1) % 24
+        return histogram
+
+    def get_day_histogram(self):
+        days = []
+        first_day = self.start_time.date()
+        timestamp = self.start_time
+        for row in self.rows:
+            day = (timestamp.date() - first_day).days
+            if day == len(days):
+                days.append(0)
+            days[day] += sum(row)
+            timestamp += FrequencyCounter.HOUR
+        return [(first_day + datetime.timedelta(days=day), count) for day, count in enumerate(days)]
+
+    def write_csv(self, path):
+        with open(path, 'w', newline='') as fp:
+            writer = csv.writer(fp)
+            writer.writerow(['hour'] + [event_type.value for event_type in self.event_types])
+            timestamp = self.start_time
+            for row in self.rows:
+                writer.writerow([timestamp.isoformat()] + list(row))
+                timestamp += FrequencyCounter.HOUR
 
     def print_stats(self, output):
-        for key, val in self.event_counter.items():
-            output.write("%s: %s\n" % (key, val))
+        totals = self.get_totals()
+        for event_type, count in zip(self.event_types, totals):
+            if count:
+                output.write("%s: %s\n" % (event_type, count))
+
+        for prefix, count in sorted(self.get_rollups(totals).items()):
+            if count:
+                output.write("%s: %s\n" % (prefix, count))
+
+        if 'hour' in self.histograms:
+            output.write("events per hour of day:\n")
+            for hour, count in enumerate(self.get_hour_histogram()):
+                output.write("%02d: %s\n" % (hour, count))
+        if 'day' in self.histograms:
+            output.write("events per day:\n")
+            for day, count in self.get_day_histogram():
+                output.write("%s: %s\n" % (day, count))
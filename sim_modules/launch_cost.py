@@ -0,0 +1,256 @@
+from sim_interface import SimModule, SimModuleType
+from events import EventType, AppActivityUsageEvent
+from collections import OrderedDict
+import datetime
+from utils import LogHistogram
+
+
+class RunningCost:
+    """ Launch cost (ms) of an app, learned as a running mean
+
+    Falls back to the configured default until enough samples
+    have been observed.
+    """
+    def __init__(self, default):
+        self.default = default
+        self.count = 0
+        self.mean = 0.0
+
+    def add(self, value):
+        self.count += 1
+        self.mean += (value - self.mean) / self.count
+
+    def get(self, min_samples):
+        if self.count >= min_samples:
+            return self.mean
+        return self.default
+
+
+class AppCostStats:
+    """ Per-app aggregates of the preload cost model """
+    def __init__(self, cold_cost, warm_cost):
+        self.cold = RunningCost(cold_cost)
+        self.warm = RunningCost(warm_cost)
+        self.launches = 0
+        self.preloads = 0
+        self.hits = 0
+        self.wasted = 0
+        self.saved_ms = 0.0
+        self.wasted_ms = 0.0
+        self.memory_seconds = 0.0
+
+    def costs(self, min_samples):
+        """ Returns the (cold, warm) launch costs of the app
+
+        Cold and warm costs are learned from separate samples, so a
+        learned warm cost can exceed the cold one. A warm launch is
+        never slower than a cold one, so warm is capped at cold.
+        """
+        cold = self.cold.get(min_samples)
+        return cold, min(self.warm.get(min_samples), cold)
+
+    def warm_above_cold(self, min_samples):
+        return self.warm.get(min_samples) > self.cold.get(min_samples)
+
+
+class LaunchCostModel(SimModule):
+    """ Estimates the user-perceived benefit and the cost of preloading
+
+    Every app has a cold and a warm launch cost in milliseconds. The
+    costs come from cold_launch_ms/warm_launch_ms, from per-app
+    overrides in app_costs ('app:cold:warm' entries), or they are
+    learned from the trace when learn_costs is enabled. Learning uses
+    the gap between one app moving to the background and the next one
+    moving to the foreground.
+
+    A PRELOAD_APP hint keeps the app warm for preload_window seconds.
+    A launch inside the window saves cold - warm milliseconds, unless
+    the memory manager already had the app resident. A hint that
+    expires unused wastes the cold launch work and app_size MB for the
+    whole window. Hints still unused when the trace ends are wasted
+    too, holding memory until the end of the trace. Break-even
+    precision for an app is the fraction of correct preloads at which
+    savings equal the wasted work: cold / (2 * cold - warm).
+
+    All aggregates are updated as events arrive. Expired hints are
+    kept in arrival order, so expiring them is amortized O(1).
+    """
+    def __init__(self, name, module_type, simulator, module_settings):
+        super(LaunchCostModel, self).__init__(name, module_type, simulator)
+        self.cold_launch_ms = float(module_settings.get('cold_launch_ms', '1500'))
+        self.warm_launch_ms = float(module_settings.get('warm_launch_ms', '300'))
+        self.app_size = float(module_settings.get('app_size', '200'))
+        self.preload_window = datetime.timedelta(seconds=float(module_settings.get('preload_window', '300')))
+        self.learn_costs = module_settings.get('learn_costs', 'false').lower() in ('true', 'yes', '1')
+        self.max_transition_ms = float(module_settings.get('max_transition_ms', '10000'))
+        self.min_samples = int(module_settings.get('min_samples', '3'))
+        self.report_apps = int(module_settings.get('report_apps', '10'))
+
+        self.app_costs = {}
+        for entry in module_settings.get('app_costs', '').split():
+            app_id, cold, warm = entry.rsplit(':', 2)
+            self.app_costs[app_id] = (float(cold), float(warm))
+
+        self.apps = {}
+        self.pending_preloads = OrderedDict()
+        self.memory_manager = None
+        self.foreground_app = None
+        self.background_time = None
+
+        self.launches = 0
+        self.total_latency_ms = 0.0
+        self.baseline_latency_ms = 0.0
+        self.latency = LogHistogram(unit=0.1)
+        self.baseline_latency = LogHistogram(unit=0.1)
+        self.saved_ms = 0.0
+        self.wasted_cpu_ms = 0.0
+        self.wasted_memory_seconds = 0.0
+        self.used_memory_seconds = 0.0
+        self.preloads = 0
+        self.preload_hits = 0
+        self.wasted_preloads = 0
+
+    def build(self):
+        self.simulator.subscribe(EventType.APP_ACTIVITY_USAGE, self.on_usage)
+        self.simulator.subscribe(EventType.PRELOAD_APP, self.on_preload)
+        self.simulator.subscribe(EventType.TRACE_END, self.on_trace_end)
+        self.memory_manager = self.simulator.get_module_for_type(SimModuleType.MEMORY_MANAGER)
+
+        metrics = self.simulator.get_metrics()
+        metrics.gauge(self.name + '.launches', lambda: self.launches)
+        metrics.gauge(self.name + '.preload_hits', lambda: self.preload_hits)
+        metrics.gauge(self.name + '.saved_ms', lambda: self.saved_ms)
+        metrics.gauge(self.name + '.wasted_cpu_ms', lambda: self.wasted_cpu_ms)
+
+    def finish(self):
+        pass
+
+    def get_app(self, app_id):
+        stats = self.apps.get(app_id)
+        if stats is None:
+            cold, warm = self.app_costs.get(app_id, (self.cold_launch_ms, self.warm_launch_ms))
+            stats = self.apps[app_id] = AppCostStats(cold, warm)
+        return stats
+
+    def is_resident(self, app_id):
+        # Residency the memory manager would have without preload hints
+        manager = self.memory_manager
+        if manager is None:
+            return False
+        return manager.is_resident(app_id) and app_id not in manager.pending_preloads
+
+    def was_resident_at_launch(self, app_id):
+        manager = self.memory_manager
+        if manager is None:
+            return False
+        if manager.foreground_app == app_id:
+            # The memory manager has already handled this launch
+            return manager.last_launch_warm and not manager.last_launch_preloaded
+        return self.is_resident(app_id)
+
+    def expire_preloads(self, now):
+        pending = self.pending_preloads
+        while pending:
+            app_id, timestamp = next(iter(pending.items()))
+            if now - timestamp < self.preload_window:
+                break
+            del pending[app_id]
+            self.waste_preload(app_id, self.preload_window)
+
+    def waste_preload(self, app_id, held):
+        stats = self.get_app(app_id)
+        wasted_ms = stats.cold.get(self.min_samples)
+        memory_seconds = held.total_seconds() * self.app_size
+        stats.wasted += 1
+        stats.wasted_ms += wasted_ms
+        stats.memory_seconds += memory_seconds
+        self.wasted_preloads += 1
+        self.wasted_cpu_ms += wasted_ms
+        self.wasted_memory_seconds += memory_seconds
+
+    def on_trace_end(self, event):
+        self.expire_preloads(event.timestamp)
+        # No launch can use the hints left after the trace
+        for app_id, timestamp in self.pending_preloads.items():
+            self.waste_preload(app_id, event.timestamp - timestamp)
+        self.pending_preloads.clear()
+
+    def on_preload(self, event):
+        self.expire_preloads(event.timestamp)
+        if event.app_id in self.pending_preloads or self.is_resident(event.app_id):
+            return
+        self.preloads += 1
+        self.get_app(event.app_id).preloads += 1
+        self.pending_preloads[event.app_id] = event.timestamp
+
+    def on_usage(self, event):
+        if event.usage_event == AppActivityUsageEvent.UsageEvent.MOVE_BACKGROUND:
+            self.background_time = event.timestamp
+            return
+        if event.app_id == self.foreground_app:
+            return
+        self.foreground_app = event.app_id
+        self.expire_preloads(event.timestamp)
+
+        stats = self.get_app(event.app_id)
+        resident = self.was_resident_at_launch(event.app_id)
+        if self.learn_costs and self.background_time is not None:
+            gap_ms = (event.timestamp - self.background_time).total_seconds() * 1000
+            if 0 <= gap_ms <= self.max_transition_ms:
+                (stats.warm if resident else stats.cold).add(gap_ms)
+        self.background_time = None
+
+        cold, warm = stats.costs(self.min_samples)
+        baseline = warm if resident else cold
+        latency = baseline
+
+        preload_time = self.pending_preloads.pop(event.app_id, None)
+        if preload_time is not None:
+            latency = warm
+            memory_seconds = (event.timestamp - preload_time).total_seconds() * self.app_size
+            stats.hits += 1
+            stats.saved_ms += baseline - warm
+            stats.memory_seconds += memory_seconds
+            self.preload_hits += 1
+            self.saved_ms += baseline - warm
+            self.used_memory_seconds += memory_seconds
+
+        stats.launches += 1
+        self.launches += 1
+        self.total_latency_ms += latency
+        self.baseline_latency_ms += baseline
+        self.latency.record(latency)
+        self.baseline_latency.record(baseline)
+
+    def print_stats(self, output):
+        output.write("launches: %s\n" % self.launches)
+        output.write("launch latency without preload (ms): %s\n" % self.baseline_latency_ms)
+        output.write("launch latency with preload (ms): %s\n" % self.total_latency_ms)
+        output.write("latency saved (ms): %s\n" % self.saved_ms)
+        if self.launches:
+            self.baseline_latency.write_percentiles(output, "launch latency without preload (ms)")
+            self.latency.write_percentiles(output, "launch latency with preload (ms)")
+        output.write("preloads: %s\n" % self.preloads)
+        output.write("preload hits: %s\n" % self.preload_hits)
+        output.write("wasted preloads: %s\n" % self.wasted_preloads)
+        output.write("wasted preload cpu (ms): %s\n" % self.wasted_cpu_ms)
+        output.write("wasted preload memory (MB-s): %s\n" % self.wasted_memory_seconds)
+        output.write("used preload memory (MB-s): %s\n" % self.used_memory_seconds)
+        output.write("net benefit (ms): %s\n" % (self.saved_ms - self.wasted_cpu_ms))
+        inverted = sorted(app_id for app_id, stats in self.apps.items()
+                          if stats.warm_above_cold(self.min_samples))
+        if inverted:
+            output.write("warm cost above cold, capped at cold: %s\n" % ' '.join(inverted))
+
+        ranked = sorted((stats for stats in self.apps.items() if stats[1].preloads),
+                        key=lambda item: item[1].saved_ms - item[1].wasted_ms, reverse=True)
+        if ranked:
+            output.write("app, preloads, hits, precision, break-even, cold (ms), warm (ms), net (ms)\n")
+        for app_id, stats in ranked[:self.report_apps]:
+            cold, warm = stats.costs(self.min_samples)
+            resolved = stats.hits + stats.wasted
+            precision = stats.hits / resolved if resolved else 0.0
+            break_even = cold / (2 * cold - warm) if 2 * cold > warm else 1.0
+            output.write("%s, %s, %s, %.3f, %.3f, %.1f, %.1f, %.1f\n"
+                         % (app_id, stats.preloads, stats.hits, precision, break_even,
+                            cold, warm, stats.saved_ms - stats.wasted_ms))
@@ -0,0 +1,187 @@
+from sim_interface import SimModule
+from events import EventType, AppActivityUsageEvent
+import datetime
+import math
+from utils import LogHistogram
+
+
+class MarkovPredictor(SimModule):
+    """ Next-app predictor based on app-to-app transition counts
+
+    Every time a different app moves to the foreground, the transition
+    from the previous app is counted and the most likely successor of
+    the new app is predicted. Stats are reported the same way as the
+    Preload module so both can be compared on the same run.
+
+    App ids are interned to integers. Row i of the transition table is
+    a sparse dict from successor id to decayed weight, with a cached
+    list of its top_k successors that is kept sorted on every update,
+    so a prediction costs O(k). Rows hold at most max_row_size entries;
+    the weakest quarter is dropped when a row overflows.
+
+    Weights decay with the given half life. Instead of decaying every
+    entry, new increments are scaled up over time and all weights are
+    renormalized once the scale gets large.
+    """
+    RESCALE_LIMIT = 1e100
+
+    def __init__(self, name, module_type, simulator, module_settings):
+        super(MarkovPredictor, self).__init__(name, module_type, simulator)
+        self.top_k = int(module_settings.get('top_k', '3'))
+        self.max_row_size = int(module_settings.get('max_row_size', '64'))
+        if self.max_row_size <= self.top_k:
+            raise Exception("max_row_size must be larger than top_k")
+        self.min_count = float(module_settings.get('min_count', '1'))
+        self.half_life = datetime.timedelta(hours=float(module_settings.get('half_life', '168')))
+        self.margin = datetime.timedelta(seconds=float(module_settings.get('margin', '300')))
+
+        # interned app ids
+        self.app_index = {}
+        self.app_names = []
+
+        # transition table
+        self.rows = []
+        self.row_totals = []
+        self.row_tops = []
+        self.weight = 1.0
+        self.weight_time = None
+        self.pruned_entries = 0
+
+        self.prev_app = None
+
+        # app, timestamp, top-k tuple structure for prediction
+        self.prediction = (None, None, ())
+        self.total_predictions = 0
+        self.correct = 0
+        self.top_k_correct = 0
+        self.num_launched = 0
+
+        # timeliness of correct predictions in seconds
+        self.timeliness = LogHistogram(unit=0.001)
+
+    def build(self):
+        self.simulator.subscribe(EventType.APP_ACTIVITY_USAGE, self.on_foreground,
+                                 lambda event: event.usage_event == AppActivityUsageEvent.UsageEvent.MOVE_FOREGROUND)
+        self.weight_time = self.simulator.get_current_time()
+
+        metrics = self.simulator.get_metrics()
+        metrics.gauge(self.name + '.predictions', lambda: self.total_predictions)
+        metrics.gauge(self.name + '.correct', lambda: self.correct)
+        metrics.gauge(self.name + '.top_k_correct', lambda: self.top_k_correct)
+        metrics.gauge(self.name + '.launches', lambda: self.num_launched)
+
+    def finish(self):
+        pass
+
+    def intern(self, app_id):
+        index = self.app_index.get(app_id)
+        if index is None:
+            index = len(self.app_names)
+            self.app_index[app_id] = index
+            self.app_names.append(app_id)
+            self.rows.append({})
+            self.row_totals.append(0.0)
+            self.row_tops.append([])
+        return index
+
+    def on_foreground(self, event):
+        app = self.intern(event.app_id)
+        if app == self.prev_app:
+            # Activity switch within the same app
+            return
+
+        self.num_launched += 1
+        self.verify(event, app)
+        if self.prev_app is not None:
+            self.add_transition(self.prev_app, app, event.timestamp)
+        self.prev_app = app
+        self.predict(event, app)
+
+    def verify(self, event, app):
+        predicted, timestamp, top = self.prediction
+        if timestamp is None:
+            return
+        self.prediction = (None, None, ())
+        if event.timestamp - timestamp >= self.margin:
+            return
+
+        if app in top:
+            self.top_k_correct += 1
+        if app == predicted:
+            self.correct += 1
+            self.timeliness.record((event.timestamp - timestamp).total_seconds())
+
+    def predict(self, event, app):
+        top = self.row_tops[app]
+        if top and self.row_totals[app] >= self.min_count * self.weight:
+            self.total_predictions += 1
+            self.prediction = (top[0], event.timestamp, tuple(top))
+
+    def update_weight(self, timestamp):
+        # Gaps beyond a few hundred half lives make old weights negligible
+        growth = math.pow(2.0, min((timestamp - self.weight_time) / self.half_life, 300.0))
+        self.weight_time = timestamp
+
+        if self.weight * growth > MarkovPredictor.RESCALE_LIMIT:
+            for row in self.rows:
+                for successor in row:
+                    row[successor] /= self.weight
+            self.row_totals = [total / self.weight for total in self.row_totals]
+            self.weight = 1.0
+        self.weight *= growth
+
+    def add_transition(self, prev_app, app, timestamp):
+        self.update_weight(timestamp)
+        row = self.rows[prev_app]
+        if app not in row and len(row) >= self.max_row_size:
+            self.prune_row(prev_app)
+        count = row.get(app, 0.0) + self.weight
+        row[app] = count
+        self.row_totals[prev_app] += self.weight
+
+        # Weights only grow, so the cached top-k only changes when the
+        # updated successor is in it or overtakes its last entry
+        top = self.row_tops[prev_app]
+        if app in top:
+            top.remove(app)
+        elif len(top) >= self.top_k and count <= row[top[-1]]:
+            return
+        pos = len(top)
+        while pos > 0 and row[top[pos - 1]] < count:
+            pos -= 1
+        top.insert(pos, app)
+        del top[self.top_k:]
+
+    def prune_row(self, app):
+        # The cached top-k successors are never pruned, the weakest of
+        # the other successors are
+        row = self.rows[app]
+        keep = set(self.row_tops[app])
+        ranked = [successor for successor in sorted(row, key=row.get) if successor not in keep]
+        for successor in ranked[:max(1, len(row) // 4)]:
+            self.row_totals[app] -= row.pop(successor)
+            self.pruned_entries += 1
+
+    def get_successors(self, app_id):
+        """ Returns the cached top-k successors of an app by name """
+        index = self.app_index.get(app_id)
+        if index is None:
+            return []
+        return [self.app_names[successor] for successor in self.row_tops[index]]
+
+    def print_stats(self, output):
+        output.write("apps: %s\n" % len(self.app_names))
+        output.write("transitions: %s\n" % sum(len(row) for row in self.rows))
+        output.write("pruned transitions: %s\n" % self.pruned_entries)
+        output.write("num correct: %s\n" % self.correct)
+        output.write("total prediction: %s\n" % self.total_predictions)
+        if self.total_predictions:
+            output.write("accuracy: %s\n" % (self.correct / self.total_predictions))
+            output.write("top %d accuracy: %s\n" % (self.top_k, self.top_k_correct / self.total_predictions))
+        if self.num_launched:
+            output.write("converge: %s\n" % (self.correct / self.num_launched))
+        if self.timeliness.count:
+            output.write("timeliness: min -  %s\n" % self.timeliness.min)
+            output.write("timeliness: max - %s\n" % self.timeliness.max)
+            output.write("timeliness: average - %s\n" % self.timeliness.mean())
+            self.timeliness.write_percentiles(output, "timeliness")
@@ -0,0 +1,311 @@
+from abc import ABCMeta, abstractmethod
+
+from sim_interface import SimModule
+from events import EventType, AppActivityUsageEvent
+from collections import OrderedDict, defaultdict
+
+
+class ResidencyPolicy(metaclass=ABCMeta):
+    """ Decides which apps stay resident in a fixed number of slots
+
+    Subclasses implement contains(), __len__() and access() for
+    launches, and may implement preload() when they act on preload
+    hints. access() and preload() return the apps evicted to make room.
+
+    Attributes:
+        capacity (int): Number of apps that fit in memory
+    """
+    honours_hints = False
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+
+    @abstractmethod
+    def contains(self, app_id):
+        pass
+
+    @abstractmethod
+    def access(self, app_id):
+        """ Launches an app
+
+        Returns:
+            tuple: (True if the app was resident, list of evicted apps)
+        """
+        pass
+
+    def preload(self, app_id):
+        return []
+
+    @abstractmethod
+    def __len__(self):
+        pass
+
+
+class LruPolicy(ResidencyPolicy):
+    """ Evicts the least recently launched app """
+    def __init__(self, capacity):
+        super(LruPolicy, self).__init__(capacity)
+        self.resident = OrderedDict()
+
+    def contains(self, app_id):
+        return app_id in self.resident
+
+    def access(self, app_id):
+        if app_id in self.resident:
+            self.resident.move_to_end(app_id)
+            return True, []
+        return False, self._insert(app_id)
+
+    def _insert(self, app_id):
+        evicted = []
+        while len(self.resident) >= self.capacity:
+            evicted.append(self.resident.popitem(last=False)[0])
+        self.resident[app_id] = None
+        return evicted
+
+    def __len__(self):
+        return len(self.resident)
+
+
+class PreloadAwareLruPolicy(LruPolicy):
+    """ LRU that also loads apps named by PRELOAD_APP hints
+
+    A hinted app is made resident at the most recently used end,
+    evicting the least recently used app if needed.
+    """
+    honours_hints = True
+
+    def preload(self, app_id):
+        if app_id in self.resident:
+            self.resident.move_to_end(app_id)
+            return []
+        return self._insert(app_id)
+
+
+class LfuPolicy(ResidencyPolicy):
+    """ Evicts the least frequently launched app
+
+    Apps are grouped in buckets by launch count, each bucket in LRU
+    order, so launches and evictions are O(1). Ties are broken by
+    evicting the least recently used app of the lowest count.
+    """
+    def __init__(self, capacity):
+        super(LfuPolicy, self).__init__(capacity)
+        self.frequency = {}
+        self.buckets = defaultdict(OrderedDict)
+        self.min_frequency = 0
+
+    def contains(self, app_id):
+        return app_id in self.frequency
+
+    def access(self, app_id):
+        if app_id in self.frequency:
+            count = self.frequency[app_id]
+            bucket = self.buckets[count]
+            del bucket[app_id]
+            if not bucket:
+                del self.buckets[count]
+                if self.min_frequency == count:
+                    self.min_frequency = count + 1
+            self.frequency[app_id] = count + 1
+            self.buckets[count + 1][app_id] = None
+            return True, []
+
+        evicted = []
+        while len(self.frequency) >= self.capacity:
+            bucket = self.buckets[self.min_frequency]
+            victim = bucket.popitem(last=False)[0]
+            if not bucket:
+                del self.buckets[self.min_frequency]
+            del self.frequency[victim]
+            evicted.append(victim)
+
+        self.frequency[app_id] = 1
+        self.buckets[1][app_id] = None
+        self.min_frequency = 1
+        return False, evicted
+
+    def __len__(self):
+        return len(self.frequency)
+
+
+class ArcPolicy(ResidencyPolicy):
+    """ Adaptive Replacement Cache
+
+    Resident apps are split between t1 (launched once recently) and
+    t2 (launched at least twice). Ghost lists b1 and b2 remember apps
+    recently evicted from each and steer the target size p of t1.
+    """
+    def __init__(self, capacity):
+        super(ArcPolicy, self).__init__(capacity)
+        self.p = 0
+        self.t1 = OrderedDict()
+        self.t2 = OrderedDict()
+        self.b1 = OrderedDict()
+        self.b2 = OrderedDict()
+
+    def contains(self, app_id):
+        return app_id in self.t1 or app_id in self.t2
+
+    def access(self, app_id):
+        c = self.capacity
+        if app_id in self.t1:
+            del self.t1[app_id]
+            self.t2[app_id] = None
+            return True, []
+        if app_id in self.t2:
+            self.t2.move_to_end(app_id)
+            return True, []
+
+        evicted = []
+        if app_id in self.b1:
+            self.p = min(c, self.p + max(len(self.b2) // len(self.b1), 1))
+            self._replace(app_id, evicted)
+            del self.b1[app_id]
+            self.t2[app_id] = None
+            return False, evicted
+        if app_id in self.b2:
+            self.p = max(0, self.p - max(len(self.b1) // len(self.b2), 1))
+            self._replace(app_id, evicted)
+            del self.b2[app_id]
+            self.t2[app_id] = None
+            return False, evicted
+
+        l1 = len(self.t1) + len(self.b1)
+        total = l1 + len(self.t2) + len(self.b2)
+        if l1 >= c:
+            if len(self.t1) < c:
+                self.b1.popitem(last=False)
+                self._replace(app_id, evicted)
+            else:
+                evicted.append(self.t1.popitem(last=False)[0])
+        elif total >= c:
+            if total >= 2 * c:
+                self.b2.popitem(last=False)
+            self._replace(app_id, evicted)
+        self.t1[app_id] = None
+        return False, evicted
+
+    def _replace(self, app_id, evicted):
+        if len(self.t1) + len(self.t2) < self.capacity:
+            return
+        if self.t1 and (len(self.t1) > self.p or (app_id in self.b2 and len(self.t1) == self.p)):
+            victim = self.t1.popitem(last=False)[0]
+            self.b1[victim] = None
+        else:
+            victim = self.t2.popitem(last=False)[0]
+            self.b2[victim] = None
+        evicted.append(victim)
+
+    def __len__(self):
+        return len(self.t1) + len(self.t2)
+
+
+RESIDENCY_POLICIES = {
+    'lru': LruPolicy,
+    'lfu': LfuPolicy,
+    'arc': ArcPolicy,
+    'preload': PreloadAwareLruPolicy,
+}
+
+
+class MemoryManager(SimModule):
+    """ Models which apps are resident under a memory budget
+
+    Every app is assumed to take app_size MB, so the budget holds
+    memory_budget // app_size apps. A launch is the foreground move
+    of an app other than the current one. The launch is warm if the
+    app is still resident and cold otherwise. The eviction policy is
+    selected with the 'policy' setting (lru, lfu, arc or preload).
+    """
+    def __init__(self, name, module_type, simulator, module_settings):
+        super(MemoryManager, self).__init__(name, module_type, simulator)
+        self.memory_budget = float(module_settings.get('memory_budget', '2048'))
+        self.app_size = float(module_settings.get('app_size', '200'))
+        self.capacity = max(1, int(self.memory_budget // self.app_size))
+
+        policy_name = module_settings.get('policy', 'lru')
+        if policy_name not in RESIDENCY_POLICIES:
+            raise Exception("Unknown memory manager policy '%s'" % policy_name)
+        self.policy_name = policy_name
+        self.policy = RESIDENCY_POLICIES[policy_name](self.capacity)
+
+        self.foreground_app = None
+        self.last_launch_warm = None
+        self.last_launch_preloaded = False
+        self.pending_preloads = set()
+
+        self.launches = 0
+        self.warm_launches = 0
+        self.evictions = 0
+        self.preload_hints = 0
+        self.preloads = 0
+        self.preload_hits = 0
+        self.wasted_preloads = 0
+
+    def build(self):
+        self.simulator.subscribe(EventType.APP_ACTIVITY_USAGE, self.launch,
+                                 lambda event: event.usage_event == AppActivityUsageEvent.UsageEvent.MOVE_FOREGROUND)
+        self.simulator.subscribe(EventType.PRELOAD_APP, self.preload)
+
+        metrics = self.simulator.get_metrics()
+        metrics.gauge(self.name + '.launches', lambda: self.launches)
+        metrics.gauge(self.name + '.warm_launches', lambda: self.warm_launches)
+        metrics.gauge(self.name + '.evictions', lambda: self.evictions)
+        metrics.gauge(self.name + '.preload_hits', lambda: self.preload_hits)
+
+    def finish(self):
+        pass
+
+    def is_resident(self, app_id):
+        return self.policy.contains(app_id)
+
+    def launch(self, event):
+        app_id = event.app_id
+        if app_id == self.foreground_app:
+            return
+        self.foreground_app = app_id
+
+        warm, evicted = self.policy.access(app_id)
+        self.last_launch_warm = warm
+        self.last_launch_preloaded = False
+        self.launches += 1
+        if warm:
+            self.warm_launches += 1
+        if app_id in self.pending_preloads:
+            self.pending_preloads.discard(app_id)
+            if warm:
+                self.last_launch_preloaded = True
+                self.preload_hits += 1
+        self.evict(evicted)
+
+    def preload(self, event):
+        self.preload_hints += 1
+        if not self.policy.honours_hints:
+            return
+        if not self.policy.contains(event.app_id):
+            self.preloads += 1
+            self.pending_preloads.add(event.app_id)
+        self.evict(self.policy.preload(event.app_id))
+
+    def evict(self, evicted):
+        self.evictions += len(evicted)
+        for app_id in evicted:
+            if app_id in self.pending_preloads:
+                self.pending_preloads.discard(app_id)
+                self.wasted_preloads += 1
+
+    def print_stats(self, output):
+        output.write("policy: %s\n" % self.policy_name)
+        output.write("capacity: %s apps (%s MB / %s MB)\n" % (self.capacity, self.memory_budget, self.app_size))
+        output.write("launches: %s\n" % self.launches)
+        output.write("warm launches: %s\n" % self.warm_launches)
+        output.write("cold launches: %s\n" % (self.launches - self.warm_launches))
+        if self.launches:
+            output.write("warm launch ratio: %s\n" % (self.warm_launches / self.launches))
+            output.write("cold launch ratio: %s\n" % ((self.launches - self.warm_launches) / self.launches))
+        output.write("evictions: %s\n" % self.evictions)
+        output.write("preload hints: %s\n" % self.preload_hints)
+        output.write("preloads: %s\n" % self.preloads)
+        output.write("preload hits: %s\n" % self.preload_hits)
+        output.write("wasted preloads: %s\n" % self.wasted_preloads)
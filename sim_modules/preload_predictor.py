@@ -1,7 +1,13 @@
 from sim_interface import SimModule
-from events import EventType, Event, SimAlarm
+from events import EventType, PreloadAppEvent, SimAlarm
+import array
 import datetime
+import dateutil.parser
+import heapq
+from operator import itemgetter
 from device import ScreenState
+from time_buckets import get_bucket_scheme
+from utils import LogHistogram
 
 
 class Preload(SimModule):
@@ -22,7 +28,10 @@ class Preload(SimModule):
         # freq_dict_index(time) -> the interval index
         self.interval_time = int(module_settings['interval_time'])
         self.depreciation = float(module_settings['depreciation'])
-        self.intervals = 24 // self.interval_time
+        # time buckets of the frequency counts, interval_time hours of
+        # the day each unless the 'buckets' setting names another scheme
+        self.buckets = get_bucket_scheme(module_settings.get('buckets', 'hour_of_day:%d' % self.interval_time))
+        self.intervals = self.buckets.num_buckets
         self.time_expon = 1
         self.index = 0
 
@@ -30,24 +39,77 @@ class Preload(SimModule):
         self.num_launched = 0
         self.prev_app_launched = None
 
-        # new variables to record timeliness stats
-        self.timeliness_min = 0
-        self.timeliness_max = 0
-        self.timeliness_sum = 0
-        self.timeliness_count = 0
+        # timeliness of correct predictions in seconds
+        self.timeliness = LogHistogram(unit=0.001)
 
         # add an alarm
         self.alarm = None
+        # next decay time restored from a previous run
+        self.restored_alarm_time = None
 
     def build(self):
         self.simulator.subscribe(EventType.SCREEN, self.preload, lambda event: event.state == ScreenState.USER_PRESENT)
         self.simulator.subscribe(EventType.APP_ACTIVITY_USAGE, self.verify)
-        for x in range(self.intervals):
+        for x in range(self.intervals - len(self.freq_count_list)):
             self.freq_count_list.append({})
-        self.alarm = SimAlarm(self.simulator.get_current_time(), self.decrement,
-                              datetime.timedelta(hours=self.interval_time))
+
+        current_time = self.simulator.get_current_time()
+        alarm_interval = datetime.timedelta(hours=self.interval_time)
+        alarm_time = current_time
+        if self.restored_alarm_time is not None:
+            # Apply the decay steps that fell between the two runs
+            alarm_time = self.restored_alarm_time
+            while alarm_time < current_time:
+                self.decrement()
+                alarm_time += alarm_interval
+        self.alarm = SimAlarm(alarm_time, self.decrement, alarm_interval)
         self.simulator.register_alarm(self.alarm)
 
+        metrics = self.simulator.get_metrics()
+        metrics.gauge(self.name + '.predictions', lambda: self.total_predictions)
+        metrics.gauge(self.name + '.correct', lambda: self.correct)
+        metrics.gauge(self.name + '.launches', lambda: self.num_launched)
+
+    def get_state(self):
+        # Sparse interval x app table in CSR layout. Entries keep the
+        # dictionary order so ties resolve the same way after a restore.
+        app_ids = {}
+        offsets = array.array('q', [0])
+        columns = array.array('q')
+        counts = array.array('d')
+        for freq_count in self.freq_count_list:
+            for app_id, count in freq_count.items():
+                columns.append(app_ids.setdefault(app_id, len(app_ids)))
+                counts.append(count)
+            offsets.append(len(columns))
+
+        return {'meta': {'interval_time': self.interval_time,
+                         'buckets': self.buckets.spec,
+                         'index': self.index,
+                         'alarm_time': self.alarm.timestamp.isoformat()},
+                'apps': list(app_ids),
+                'offsets': offsets,
+                'columns': columns,
+                'counts': counts}
+
+    def set_state(self, state):
+        meta = state['meta']
+        if meta['interval_time'] != self.interval_time:
+            raise Exception("Saved preload state uses interval_time %s, config has %s"
+                            % (meta['interval_time'], self.interval_time))
+        if meta.get('buckets', self.buckets.spec) != self.buckets.spec:
+            raise Exception("Saved preload state uses buckets %s, config has %s"
+                            % (meta['buckets'], self.buckets.spec))
+        self.index = meta['index']
+        self.restored_alarm_time = dateutil.parser.parse(meta['alarm_time'])
+
+        apps = list(state['apps'])
+        offsets = state['offsets']
+        columns = state['columns']
+        counts = state['counts']
+        self.freq_count_list = [{apps[columns[j]]: counts[j] for j in range(offsets[i], offsets[i + 1])}
+                                for i in range(self.intervals)]
+
     def finish(self):
         pass
 
@@ -55,6 +117,13 @@ class Preload(SimModule):
         for app in self.freq_count_list[self.index]:
             self.freq_count_list[self.index][app] *= self.depreciation
 
+    # returns the k apps with the highest frequency for the given hour
+    def get_top_apps(self, hour, k=1, weekday=0):
+        if not self.freq_count_list:
+            return []
+        freq_count = self.freq_count_list[self.buckets.bucket_of(weekday, hour)]
+        return heapq.nlargest(k, freq_count.items(), key=itemgetter(1))
+
     # method to handle the event type being called
     def preload(self, event):
         # subscribe to an alarm at first preload
@@ -64,7 +133,7 @@ class Preload(SimModule):
         #     self.simulator.register_alarm(self.alarm)
 
         # gets the current time and converts that into an index
-        self.index = event.timestamp.hour // self.interval_time
+        self.index = self.buckets.bucket(event.timestamp)
 
         # check Screen On event and preloads the app that has the highest frequency of usage
         # before preloading the app check to see if it is morning, afternoon or night and then preload the
@@ -76,7 +145,7 @@ class Preload(SimModule):
             if self.freq_count_list[self.index][highest_app] > 20:
                 self.total_predictions += 1
                 self.prediction = (highest_app, event.timestamp)
-                self.simulator.broadcast(Event(event.timestamp, EventType.PRELOAD_APP))
+                self.simulator.broadcast(PreloadAppEvent(event.timestamp, highest_app))
 
     # method to verify the preload result
     def verify(self, event):
@@ -92,16 +161,10 @@ class Preload(SimModule):
         if timestamp is not None and event.timestamp - timestamp < margin and event.app_id == app_id:
             self.correct += 1
             self.prediction = (None, None)
-            time_diff = (event.timestamp - timestamp).total_seconds()
-            if time_diff > self.timeliness_max:
-                self.timeliness_max = time_diff
-            elif time_diff < self.timeliness_min:
-                self.timeliness_min = time_diff
-            self.timeliness_sum += time_diff
-            self.timeliness_count += 1
+            self.timeliness.record((event.timestamp - timestamp).total_seconds())
 
         # update current index to correct interval
-        self.index = event.timestamp.hour // self.interval_time
+        self.index = self.buckets.bucket(event.timestamp)
 
         # update freq count dictionary
         if event.app_id in self.freq_count_list[self.index]:
@@ -113,8 +176,12 @@ class Preload(SimModule):
         output.write("num correct: %s\n" % self.correct)
 
         output.write("total prediction: %s\n" % self.total_predictions)
-        output.write("accuracy: %s\n" % (self.correct / self.total_predictions))
-        output.write("converge: %s\n" % (self.correct / self.num_launched))
-        output.write("timeliness: min -  %s\n" % self.timeliness_min)
-        output.write("timeliness: max - %s\n" % self.timeliness_max)
-        output.write("timeliness: average - %s\n" % (self.timeliness_sum * 1.0 / self.timeliness_count))
+        # Stats can be printed during a run, before anything was predicted
+        if self.total_predictions:
+            output.write("accuracy: %s\n" % (self.correct / self.total_predictions))
+        if self.num_launched:
+            output.write("converge: %s\n" % (self.correct / self.num_launched))
+        output.write("timeliness: min -  %s\n" % self.timeliness.min)
+        output.write("timeliness: max - %s\n" % self.timeliness.max)
+        output.write("timeliness: average - %s\n" % self.timeliness.mean())
+        self.timeliness.write_percentiles(output, "timeliness")
@@ -0,0 +1,182 @@
+""" Versioned on-disk format for learned module state
+
+A state file holds a set of named sections. Each section is either a
+typed numeric array, a table of strings or a small JSON document:
+
+    header:   magic (8 bytes) | version (u32) | section count (u32)
+    table:    per section - name length (u16) | name (utf-8) |
+              kind (1 byte) | offset (u64) | item count (u64)
+    payload:  section data, each aligned to 8 bytes
+
+Numeric arrays are stored in native machine layout so that a reader
+can memory-map the file and expose them without copying. String
+tables store an offset array followed by the concatenated utf-8 data
+and are decoded one entry at a time on access.
+"""
+import array
+import json
+import mmap
+import struct
+
+STATE_MAGIC = b'UAMPSTAT'
+STATE_VERSION = 1
+
+_HEADER = struct.Struct('<8sII')
+_SECTION = struct.Struct('<cQQ')
+
+KIND_DOUBLE = b'd'
+KIND_INT = b'q'
+KIND_STRINGS = b's'
+KIND_JSON = b'j'
+
+
+def _align(offset):
+    return (offset + 7) & ~7
+
+
+def _encode_section(value):
+    if isinstance(value, array.array):
+        if value.typecode == 'd':
+            return KIND_DOUBLE, len(value), value.tobytes()
+        elif value.typecode == 'q':
+            return KIND_INT, len(value), value.tobytes()
+        raise Exception("Unsupported array type '%s' in state" % value.typecode)
+    elif isinstance(value, dict):
+        data = json.dumps(value).encode()
+        return KIND_JSON, len(data), data
+    else:
+        encoded = [s.encode() for s in value]
+        offsets = array.array('q', [0])
+        for s in encoded:
+            offsets.append(offsets[-1] + len(s))
+        return KIND_STRINGS, len(encoded), offsets.tobytes() + b''.join(encoded)
+
+
+def save_state(path, sections):
+    """ Write named state sections to a file
+
+    Args:
+        path (str): Output file path
+        sections (dict): Section name to value. Values may be an
+            array.array of type 'd' or 'q', a dict (stored as JSON)
+            or a sequence of strings.
+    """
+    encoded = [(name.encode(),) + _encode_section(value)
+               for name, value in sections.items()]
+
+    offset = _HEADER.size
+    for (name, kind, count, data) in encoded:
+        offset += 2 + len(name) + _SECTION.size
+
+    table = []
+    payload = []
+    for (name, kind, count, data) in encoded:
+        offset = _align(offset)
+        table.append(struct.pack('<H', len(name)) + name + _SECTION.pack(kind, offset, count))
+        payload.append((offset, data))
+        offset += len(data)
+
+    with open(path, 'wb') as fp:
+        fp.write(_HEADER.pack(STATE_MAGIC, STATE_VERSION, len(encoded)))
+        for entry in table:
+            fp.write(entry)
+        for (data_offset, data) in payload:
+            fp.write(b'\0' * (data_offset - fp.tell()))
+            fp.write(data)
+
+
+class StringTable:
+    """ Read-only sequence of strings decoded lazily from a state file """
+    def __init__(self, offsets, data):
+        self._offsets = offsets
+        self._data = data
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, index):
+        if not 0 <= index < len(self):
+            raise IndexError('string table index out of range')
+        return bytes(self._data[self._offsets[index]:self._offsets[index + 1]]).decode()
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+
+class StateFile:
+    """ Memory-mapped view of a state file
+
+    Numeric sections are returned as memoryviews into the mapped file,
+    so they must not be used after close() is called.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._fp = open(path, 'rb')
+        self._map = mmap.mmap(self._fp.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._map)
+        self._sections = {}
+
+        magic, version, count = _HEADER.unpack_from(self._map, 0)
+        if magic != STATE_MAGIC:
+            raise Exception('%s is not a simulator state file' % path)
+        if version != STATE_VERSION:
+            raise Exception('Unsupported state file version %d (expected %d)'
+                            % (version, STATE_VERSION))
+
+        pos = _HEADER.size
+        for i in range(count):
+            (name_len,) = struct.unpack_from('<H', self._map, pos)
+            pos += 2
+            name = bytes(self._map[pos:pos + name_len]).decode()
+            pos += name_len
+            self._sections[name] = _SECTION.unpack_from(self._map, pos)
+            pos += _SECTION.size
+
+    def __contains__(self, name):
+        return name in self._sections
+
+    def __getitem__(self, name):
+        kind, offset, count = self._sections[name]
+        if kind == KIND_DOUBLE or kind == KIND_INT:
+            return self._view[offset:offset + count * 8].cast(kind.decode())
+        elif kind == KIND_JSON:
+            return json.loads(bytes(self._view[offset:offset + count]).decode())
+        elif kind == KIND_STRINGS:
+            offsets = self._view[offset:offset + (count + 1) * 8].cast('q')
+            data_start = offset + (count + 1) * 8
+            return StringTable(offsets, self._view[data_start:data_start + offsets[count]])
+        raise Exception("Unknown state section kind %r" % kind)
+
+    def section_names(self):
+        return list(self._sections)
+
+    def has_prefix(self, prefix):
+        prefix += '/'
+        return any(name.startswith(prefix) for name in self._sections)
+
+    def prefixed(self, prefix):
+        """ Returns a view of the sections whose names start with 'prefix/' """
+        return StateSections(self, prefix + '/')
+
+    def close(self):
+        self._view.release()
+        self._map.close()
+        self._fp.close()
+
+
+class StateSections:
+    """ Subset of a state file's sections sharing a name prefix """
+    def __init__(self, state_file, prefix):
+        self._state_file = state_file
+        self._prefix = prefix
+
+    def __contains__(self, name):
+        return self._prefix + name in self._state_file
+
+    def __getitem__(self, name):
+        return self._state_file[self._prefix + name]
+
+
+def load_state(path):
+    return StateFile(path)
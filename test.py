@@ -1,8 +1,17 @@
+import datetime
+
 from applist import applist
+from device_tracker import FieldLog
 
 a = applist()
 a.load_app("google maps")
 a.load_app("facebook")
 for i in range(0, 10):
     a.load_app("emails")
-a.get_result("test.csv", 10)
\ No newline at end of file
+a.get_result("test.csv", 10)
+
+# Battery levels and temperatures may be fractional
+log = FieldLog(None, 100)
+log.record(datetime.datetime(2017, 3, 14, 12), 36.6)
+assert log.get_value_at(datetime.datetime(2017, 3, 14, 11)) == 100
+assert log.get_value_at(datetime.datetime(2017, 3, 14, 13)) == 36.6
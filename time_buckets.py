@@ -0,0 +1,111 @@
+""" Time bucketing schemes shared by applist and the Preload module
+
+A scheme maps a point in the week to one of num_buckets buckets. Every
+scheme is a 168-entry lookup table indexed by hour of week, so finding
+the bucket of a timestamp costs the same for any granularity.
+
+Schemes are described by short strings, for example:
+
+    hour_of_day         24 buckets, one per hour
+    hour_of_day:4       6 buckets of 4 hours
+    hour_of_week        168 buckets, one per hour of the week
+    weekday_weekend     2 buckets, Monday-Friday and Saturday-Sunday
+    day_parts:12,20     hours before 12, 12 to 19 and from 20 on
+"""
+import array
+
+HOURS_PER_WEEK = 7 * 24
+
+
+class BucketScheme:
+    """ Mapping from hour of week to bucket index
+
+    Attributes:
+        spec (str): Description the scheme was built from
+        table (:obj:'array'): Bucket of every hour of the week, indexed
+            by weekday * 24 + hour with Monday as weekday 0
+        num_buckets (int): Number of buckets in the scheme
+        labels (list): Name of every bucket
+    """
+    def __init__(self, spec, table, labels=None):
+        if len(table) != HOURS_PER_WEEK:
+            raise Exception("Bucket table must have %d entries" % HOURS_PER_WEEK)
+        self.spec = spec
+        self.table = array.array('H', table)
+        self.num_buckets = max(self.table) + 1
+        if labels is None:
+            labels = [str(bucket) for bucket in range(self.num_buckets)]
+        if len(labels) != self.num_buckets:
+            raise Exception("Bucket scheme %s needs %d labels" % (spec, self.num_buckets))
+        self.labels = list(labels)
+
+    def bucket(self, timestamp):
+        """ Returns the bucket of a datetime """
+        return self.table[timestamp.weekday() * 24 + timestamp.hour]
+
+    def bucket_of(self, weekday, hour):
+        return self.table[weekday * 24 + hour]
+
+    def bucket_of_seconds(self, seconds):
+        """ Returns the bucket of seconds since the epoch (see clock.to_seconds) """
+        # 1970-01-01 was a Thursday
+        hours = int(seconds // 3600)
+        return self.table[((hours // 24 + 3) % 7) * 24 + hours % 24]
+
+    def __repr__(self):
+        return 'BucketScheme(%s)' % self.spec
+
+
+def hour_of_day(width=1):
+    num_buckets = -(-24 // width)
+    return BucketScheme('hour_of_day:%d' % width,
+                        [(hour % 24) // width for hour in range(HOURS_PER_WEEK)],
+                        ['%02d' % (bucket * width) for bucket in range(num_buckets)])
+
+
+def hour_of_week(width=1):
+    days = ('mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun')
+    num_buckets = -(-HOURS_PER_WEEK // width)
+    return BucketScheme('hour_of_week:%d' % width,
+                        [hour // width for hour in range(HOURS_PER_WEEK)],
+                        ['%s%02d' % (days[bucket * width // 24], bucket * width % 24)
+                         for bucket in range(num_buckets)])
+
+
+def weekday_weekend():
+    return BucketScheme('weekday_weekend',
+                        [1 if hour // 24 >= 5 else 0 for hour in range(HOURS_PER_WEEK)],
+                        ['weekday', 'weekend'])
+
+
+def day_parts(boundaries=(12, 20), labels=None):
+    """ Hour-of-day buckets split at the given hours """
+    boundaries = sorted(boundaries)
+    table = []
+    for hour in range(HOURS_PER_WEEK):
+        table.append(sum(1 for boundary in boundaries if hour % 24 >= boundary))
+    if labels is None and list(boundaries) == [12, 20]:
+        labels = ['mor', 'non', 'ngt']
+    return BucketScheme('day_parts:%s' % ','.join(str(boundary) for boundary in boundaries),
+                        table, labels)
+
+
+_SCHEMES = {
+    'hour_of_day': hour_of_day,
+    'hour_of_week': hour_of_week,
+    'weekday_weekend': weekday_weekend,
+    'day_parts': day_parts,
+}
+
+
+def get_bucket_scheme(spec):
+    """ Builds a scheme from a description such as 'hour_of_day:4' """
+    name, _, args = spec.strip().partition(':')
+    if name not in _SCHEMES:
+        raise Exception("Unknown time bucket scheme '%s'" % name)
+    if not args:
+        return _SCHEMES[name]()
+    values = [int(value) for value in args.split(',')]
+    if name == 'day_parts':
+        return day_parts(values)
+    return _SCHEMES[name](*values)
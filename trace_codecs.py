@@ -0,0 +1,265 @@
+""" Compression codecs for trace files
+
+Compressed traces are recognised by their magic bytes, so the file
+extension only has to describe the trace format (.json, .pkl, .ndjson).
+
+Supported codecs:
+
+    gzip    standard library
+    bgzip   block gzip: a series of independent gzip members, each
+            holding at most BLOCK_SIZE bytes of data and recording its
+            compressed size in an extra field, so members can be located
+            without inflating and decompressed in parallel. Any gzip
+            reader can still read the file.
+    bz2     standard library
+    xz      standard library
+    zstd    compression.zstd (Python 3.14) or the zstandard package
+    lz4     the lz4 package
+    none    no compression
+
+zstd and lz4 are optional. Opening a file that needs a missing codec
+raises an exception naming the package to install.
+"""
+import bz2
+import concurrent.futures
+import gzip
+import io
+import lzma
+import os
+import struct
+import zlib
+
+BLOCK_SIZE = 1 << 20
+
+# Extra field subfield holding the compressed size of a bgzip member
+_BGZIP_SUBFIELD = b'UB'
+_BGZIP_HEADER = struct.Struct('<4sIBB H 2sH I')
+_BGZIP_TRAILER = struct.Struct('<II')
+
+_MAGIC = (
+    (b'\x1f\x8b', 'gzip'),
+    (b'BZh', 'bz2'),
+    (b'\xfd7zXZ\x00', 'xz'),
+    (b'\x28\xb5\x2f\xfd', 'zstd'),
+    (b'\x04\x22\x4d\x18', 'lz4'),
+)
+
+CODEC_EXTENSIONS = {
+    'gzip': '.gz',
+    'bgzip': '.gz',
+    'bz2': '.bz2',
+    'xz': '.xz',
+    'zstd': '.zst',
+    'lz4': '.lz4',
+    'none': '',
+}
+
+
+def _zstd_module():
+    try:
+        from compression import zstd
+        return zstd
+    except ImportError:
+        pass
+    try:
+        import zstandard
+        return zstandard
+    except ImportError:
+        return None
+
+
+def _lz4_module():
+    try:
+        import lz4.frame
+        return lz4.frame
+    except ImportError:
+        return None
+
+
+def available_codecs():
+    codecs = ['gzip', 'bgzip', 'bz2', 'xz', 'none']
+    if _zstd_module() is not None:
+        codecs.append('zstd')
+    if _lz4_module() is not None:
+        codecs.append('lz4')
+    return codecs
+
+
+def strip_codec_extension(filename):
+    for extension in set(CODEC_EXTENSIONS.values()):
+        if extension and filename.endswith(extension):
+            return filename[:-len(extension)]
+    return filename
+
+
+def codec_for_extension(filename):
+    """ Codec to write a file with, from the extension of its name """
+    for codec, extension in CODEC_EXTENSIONS.items():
+        if extension and filename.endswith(extension):
+            return codec
+    return 'none'
+
+
+def detect_codec(filename):
+    with open(filename, 'rb') as fp:
+        magic = fp.read(_BGZIP_HEADER.size)
+    for prefix, codec in _MAGIC:
+        if magic.startswith(prefix):
+            if codec == 'gzip' and _is_bgzip_header(magic):
+                return 'bgzip'
+            return codec
+    return 'none'
+
+
+def _is_bgzip_header(header):
+    if len(header) < _BGZIP_HEADER.size:
+        return False
+    flags = header[3]
+    subfield = header[12:14]
+    return bool(flags & 4) and subfield == _BGZIP_SUBFIELD
+
+
+def _missing(codec, package):
+    raise Exception("Trace codec %s is not available, install the '%s' package to use it" % (codec, package))
+
+
+def open_trace_file(filename, workers=None):
+    """ Opens a trace file for reading decompressed bytes """
+    codec = detect_codec(filename)
+    if codec == 'gzip':
+        return gzip.open(filename, 'rb')
+    if codec == 'bgzip':
+        return io.BytesIO(read_bgzip(filename, workers))
+    if codec == 'bz2':
+        return bz2.open(filename, 'rb')
+    if codec == 'xz':
+        return lzma.open(filename, 'rb')
+    if codec == 'zstd':
+        zstd = _zstd_module()
+        if zstd is None:
+            _missing(codec, 'zstandard')
+        if zstd.__name__ == 'compression.zstd':
+            return zstd.open(filename, 'rb')
+        return zstd.ZstdDecompressor().stream_reader(open(filename, 'rb'), closefd=True)
+    if codec == 'lz4':
+        lz4_frame = _lz4_module()
+        if lz4_frame is None:
+            _missing(codec, 'lz4')
+        return lz4_frame.open(filename, 'rb')
+    return open(filename, 'rb')
+
+
+def open_trace_output(filename, codec, level=None):
+    """ Opens a trace file for writing with the given codec """
+    if codec == 'gzip':
+        return gzip.open(filename, 'wb', compresslevel=6 if level is None else level)
+    if codec == 'bgzip':
+        return BgzipWriter(filename, level=6 if level is None else level)
+    if codec == 'bz2':
+        return bz2.open(filename, 'wb', compresslevel=9 if level is None else level)
+    if codec == 'xz':
+        return lzma.open(filename, 'wb', preset=level)
+    if codec == 'zstd':
+        zstd = _zstd_module()
+        if zstd is None:
+            _missing(codec, 'zstandard')
+        if zstd.__name__ == 'compression.zstd':
+            return zstd.open(filename, 'wb', level=level)
+        compressor = zstd.ZstdCompressor(level=3 if level is None else level)
+        return compressor.stream_writer(open(filename, 'wb'), closefd=True)
+    if codec == 'lz4':
+        lz4_frame = _lz4_module()
+        if lz4_frame is None:
+            _missing(codec, 'lz4')
+        return lz4_frame.open(filename, 'wb', compression_level=0 if level is None else level)
+    if codec == 'none':
+        return open(filename, 'wb')
+    raise Exception("Unknown trace codec '%s'" % codec)
+
+
+def _bgzip_member(data, level):
+    # A raw deflate stream wrapped in a gzip member header whose extra
+    # field records the total member size
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    deflated = compressor.compress(data) + compressor.flush()
+    member_size = _BGZIP_HEADER.size + len(deflated) + 8
+    header = _BGZIP_HEADER.pack(b'\x1f\x8b\x08\x04', 0, 0, 255, 8,
+                                _BGZIP_SUBFIELD, 4, member_size)
+    return header + deflated + _BGZIP_TRAILER.pack(zlib.crc32(data), len(data) & 0xffffffff)
+
+
+class BgzipWriter(io.RawIOBase):
+    """ Writes block gzip files, compressing blocks in a thread pool
+
+    zlib releases the GIL while compressing, so blocks are compressed
+    in parallel and written in order.
+    """
+    def __init__(self, filename, level=6, workers=None):
+        self._fp = open(filename, 'wb')
+        self._level = level
+        self._pending = bytearray()
+        self._workers = workers or os.cpu_count() or 1
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=self._workers)
+        self._futures = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._pending += data
+        while len(self._pending) >= BLOCK_SIZE:
+            self._submit(bytes(self._pending[:BLOCK_SIZE]))
+            del self._pending[:BLOCK_SIZE]
+        return len(data)
+
+    def _submit(self, block):
+        self._futures.append(self._executor.submit(_bgzip_member, block, self._level))
+        # Keep the number of blocks held in memory bounded
+        while len(self._futures) > 2 * self._workers:
+            self._fp.write(self._futures.pop(0).result())
+
+    def close(self):
+        if self.closed:
+            return
+        if self._pending:
+            self._submit(bytes(self._pending))
+            self._pending = bytearray()
+        for future in self._futures:
+            self._fp.write(future.result())
+        self._futures = []
+        self._executor.shutdown()
+        self._fp.close()
+        super(BgzipWriter, self).close()
+
+
+def _inflate_member(member):
+    # Corrupt blocks are caught by the CRC32 and size trailer, as the
+    # gzip module does for plain gzip members
+    try:
+        data = zlib.decompress(member[_BGZIP_HEADER.size:-_BGZIP_TRAILER.size], -zlib.MAX_WBITS)
+    except zlib.error as e:
+        raise Exception("Corrupt block gzip member: %s" % e)
+    crc, size = _BGZIP_TRAILER.unpack(member[-_BGZIP_TRAILER.size:])
+    if zlib.crc32(data) != crc or len(data) & 0xffffffff != size:
+        raise Exception("Corrupt block gzip member: CRC or size mismatch")
+    return data
+
+
+def read_bgzip(filename, workers=None):
+    """ Decompresses a block gzip file, inflating members in parallel """
+    with open(filename, 'rb') as fp:
+        data = fp.read()
+    view = memoryview(data)
+    members = []
+    pos = 0
+    while pos < len(data):
+        if not _is_bgzip_header(data[pos:pos + _BGZIP_HEADER.size]):
+            # Not written by BgzipWriter, fall back to sequential inflate
+            return gzip.decompress(data)
+        member_size = _BGZIP_HEADER.unpack_from(data, pos)[-1]
+        if pos + member_size > len(data):
+            raise Exception("Block gzip file %s is truncated" % filename)
+        members.append(view[pos:pos + member_size])
+        pos += member_size
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1) as executor:
+        return b''.join(executor.map(_inflate_member, members))
@@ -0,0 +1,83 @@
+""" Removal of trace events that do not change anything
+
+Device state events (screen, network, battery, ...) are often repeated
+with an unchanged value. Such an event does not change the state kept
+by DeviceStateTracker, so it only matters to modules that subscribe to
+its type. TraceCompactor drops these events for every type that is not
+kept, and counts what it removed per type.
+
+The simulator compacts while reading with --compact, keeping every type
+a module subscribes to. compact_trace.py writes a compacted trace for
+reuse.
+"""
+from events import EventType
+
+# Attribute of each state event holding the value DeviceStateTracker keeps
+STATE_ATTRIBUTES = {
+    EventType.SCREEN: 'state',
+    EventType.SCREEN_ORIENTATION: 'state',
+    EventType.PHONE: 'state',
+    EventType.HEADSET: 'state',
+    EventType.DOCK: 'state',
+    EventType.DEVICE_STORAGE: 'state',
+    EventType.NETWORK_TYPE: 'network_type',
+    EventType.NETWORK_STATUS: 'state',
+    EventType.BATTERY_LEVEL: 'level',
+    EventType.BATTERY_TEMPERATURE: 'temperature',
+    EventType.BATTERY_STATUS: 'status',
+    EventType.BATTERY_PLUG_STATE: 'state',
+    EventType.BATTERY_ENERGY_STATE: 'state',
+}
+
+# Events the simulator itself relies on
+_ALWAYS_KEPT = (EventType.TRACE_START, EventType.TRACE_END)
+
+
+class TraceCompactor:
+    """ Filters events that do not change the tracked device state
+
+    Attributes:
+        keep_types (set): Event types that are never removed
+        drop_unobserved (bool): Also remove events of types that are
+            neither kept nor device state, which nothing in the
+            simulator would look at
+        removed (dict): Number of removed events per EventType
+        events_read (int): Number of events passed to the compactor
+    """
+    def __init__(self, keep_types=(), drop_unobserved=False):
+        self.keep_types = set(keep_types)
+        self.keep_types.update(_ALWAYS_KEPT)
+        self.drop_unobserved = drop_unobserved
+        self.removed = {}
+        self.events_read = 0
+        self._values = {}
+
+    def keep(self, event):
+        """ Returns whether the event should stay in the trace """
+        event_type = event.event_type
+        if event_type in self.keep_types:
+            return True
+        attribute = STATE_ATTRIBUTES.get(event_type)
+        if attribute is None:
+            if not self.drop_unobserved:
+                return True
+        else:
+            value = getattr(event, attribute)
+            if event_type not in self._values or self._values[event_type] != value:
+                self._values[event_type] = value
+                return True
+        self.removed[event_type] = self.removed.get(event_type, 0) + 1
+        return False
+
+    def compact(self, events):
+        """ Returns the events of a batch that should stay in the trace """
+        self.events_read += len(events)
+        keep = self.keep
+        return [event for event in events if keep(event)]
+
+    def print_stats(self, output):
+        total_removed = sum(self.removed.values())
+        output.write("events read: %s\n" % self.events_read)
+        output.write("events removed: %s\n" % total_removed)
+        for event_type, count in sorted(self.removed.items(), key=lambda item: item[0].value):
+            output.write("%s: %s\n" % (event_type, count))
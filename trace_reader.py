@@ -2,9 +2,38 @@ import dateutil
 
 import events
 from sim_interface import TraceReader
+import asyncio
+import collections
+import concurrent.futures
 import json
+import os
 import pickle
-import gzip
+import queue
+import stat
+import sys
+import threading
+import time
+
+from trace_codecs import detect_codec, open_trace_file, strip_codec_extension
+from trace_compaction import TraceCompactor
+from shared_trace import SharedTraceReader
+
+
+def _split_trace_data(trace_data):
+    """ Returns start time, end time and logs of a decoded trace
+
+    Older traces are a bare list of events. Their start and end time
+    are taken from the first and last event, and trace start and end
+    events are added so the simulator knows where the trace ends.
+    """
+    if isinstance(trace_data, list):
+        if not trace_data:
+            raise Exception('Trace contains no events')
+        start_time = trace_data[0].timestamp
+        end_time = trace_data[-1].timestamp
+        logs = [events.TraceStart(timestamp=start_time)] + trace_data + [events.TraceEnd(timestamp=end_time)]
+        return start_time, end_time, logs
+    return trace_data['start_time'], trace_data['end_time'], trace_data['logs']
 
 
 class JsonTraceReader(TraceReader):
@@ -16,21 +45,14 @@ class JsonTraceReader(TraceReader):
         self.end_time = None
 
     def build(self):
-        if self.trace_filename.endswith('.json'):
-            with open(self.trace_filename, 'r') as fp:
-                trace_data = json.dumps(fp)
-        elif self.trace_filename.endswith('.json.gz'):
-            with gzip.open(self.trace_filename, 'rt') as fp:
-                trace_data = json.load(fp, object_hook=events.json_decode_event)
-        else:
-            raise Exception('Invalid JSON file type. Expected .json or .json.gz')
-
-        # Identify start and end time of trace
-        self.start_time = dateutil.parser.parse(trace_data['start_time'])
-        self.end_time = dateutil.parser.parse(trace_data['end_time'])
+        with open_trace_file(self.trace_filename) as fp:
+            trace_data = json.load(fp, object_hook=events.json_decode_event)
 
-        # Get the list of logs in the trace
-        self.trace_logs = trace_data['logs']
+        # Identify start and end time of trace and the list of logs
+        self.start_time, self.end_time, self.trace_logs = _split_trace_data(trace_data)
+        if isinstance(self.start_time, str):
+            self.start_time = dateutil.parser.parse(self.start_time)
+            self.end_time = dateutil.parser.parse(self.end_time)
 
     def finish(self):
         pass
@@ -79,21 +101,11 @@ class PickleTraceReader(TraceReader):
         self.end_time = None
 
     def build(self):
-        if self.trace_filename.endswith('.pkl'):
-            with open(self.trace_filename, 'r') as fp:
-                trace_data = pickle.load(fp)
-        elif self.trace_filename.endswith('.pkl.gz'):
-            with gzip.open(self.trace_filename, 'rb') as fp:
-                trace_data = pickle.load(fp)
-        else:
-            raise Exception('Invalid JSON file type. Expected .json or .json.gz')
+        with open_trace_file(self.trace_filename) as fp:
+            trace_data = pickle.load(fp)
 
-        # Identify start and end time of trace
-        self.start_time = trace_data['start_time']
-        self.end_time = trace_data['end_time']
-
-        # Get the list of logs in the trace
-        self.trace_logs = trace_data['logs']
+        # Identify start and end time of trace and the list of logs
+        self.start_time, self.end_time, self.trace_logs = _split_trace_data(trace_data)
 
     def finish(self):
         pass
@@ -133,18 +145,797 @@ class PickleTraceReader(TraceReader):
         return self.end_time
 
 
+def _decode_ndjson_chunk(seq, data):
+    # Runs in a worker process. A chunk is a run of complete lines, so
+    # it can be decoded as a single JSON array.
+    lines = [line for line in data.split(b'\n') if line.strip()]
+    logs = json.loads(b'[' + b','.join(lines) + b']', object_hook=events.json_decode_event)
+    return seq, logs
+
+
+class NdjsonTraceReader(TraceReader):
+    """ Trace reader for newline-delimited JSON traces
+
+    The first line of the trace is a header object holding
+    'start_time' and 'end_time', every following line holds one
+    event. A feeder thread splits the decompressed file into chunks of
+    about chunk_size bytes of whole lines and submits them to a pool of
+    worker processes for decoding. Decoded chunks are consumed in
+    sequence order; at most prefetch chunks are in flight, which bounds
+    the memory used for read-ahead.
+
+    Attributes:
+        filename (str): Path of a .ndjson trace, compressed with any
+            codec of trace_codecs
+        workers (int): Number of decoding processes. 0 decodes in the
+            feeder thread.
+        chunk_size (int): Approximate number of bytes per chunk
+        prefetch (int): Maximum number of chunks decoded ahead
+    """
+    _END_OF_TRACE = object()
+
+    def __init__(self, filename, workers=None, chunk_size=1 << 20, prefetch=None):
+        self.trace_filename = filename
+        if workers is None:
+            # A single worker process only adds pickling overhead
+            cpus = os.cpu_count() or 1
+            workers = min(cpus, 8) if cpus > 1 else 0
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.prefetch = prefetch if prefetch is not None else 2 * max(self.workers, 1)
+        self.start_time = None
+        self.end_time = None
+
+        self._chunks = queue.Queue(maxsize=self.prefetch)
+        self._buffer = collections.deque()
+        self._next_seq = 0
+        self._last_event = None
+        self._done = False
+        self._stop = threading.Event()
+        self._executor = None
+        self._feeder = None
+        self._error = None
+
+    def build(self):
+        fp = open_trace_file(self.trace_filename)
+        header = json.loads(fp.readline())
+        self.start_time = dateutil.parser.parse(header['start_time'])
+        self.end_time = dateutil.parser.parse(header['end_time'])
+
+        if self.workers:
+            self._executor = concurrent.futures.ProcessPoolExecutor(max_workers=self.workers)
+        self._feeder = threading.Thread(target=self._feed, args=(fp,),
+                                        name='uamp-ndjson-feeder', daemon=True)
+        self._feeder.start()
+
+    def _feed(self, fp):
+        try:
+            with fp:
+                seq = 0
+                while not self._stop.is_set():
+                    lines = fp.readlines(self.chunk_size)
+                    if not lines:
+                        break
+                    data = b''.join(lines)
+                    if self._executor is not None:
+                        chunk = self._executor.submit(_decode_ndjson_chunk, seq, data)
+                    else:
+                        chunk = concurrent.futures.Future()
+                        chunk.set_result(_decode_ndjson_chunk(seq, data))
+                    self._put(chunk)
+                    seq += 1
+        except Exception as e:
+            self._error = e
+        self._put(NdjsonTraceReader._END_OF_TRACE)
+
+    def _put(self, item):
+        # Waits for room in the prefetch queue unless the reader is
+        # shutting down
+        while not self._stop.is_set():
+            try:
+                self._chunks.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def _fill(self):
+        # Blocks until the next decoded chunk is buffered or the trace
+        # has ended
+        while not self._buffer and not self._done:
+            chunk = self._chunks.get()
+            if chunk is NdjsonTraceReader._END_OF_TRACE:
+                self._done = True
+                if self._error is not None:
+                    raise Exception('Failed to read trace %s: %s' % (self.trace_filename, self._error))
+                # A truncated trace still needs an end, or repeating
+                # alarms would never stop
+                if self._last_event is None or self._last_event.event_type != events.EventType.TRACE_END:
+                    timestamp = self._last_event.timestamp if self._last_event is not None else self.end_time
+                    self._buffer.append(events.TraceEnd(timestamp=timestamp))
+                break
+            seq, logs = chunk.result()
+            if seq != self._next_seq:
+                raise Exception('Trace chunk %d decoded out of order' % seq)
+            self._next_seq += 1
+            if logs:
+                self._last_event = logs[-1]
+            self._buffer.extend(logs)
+
+    def finish(self):
+        self._stop.set()
+        if self._feeder is not None:
+            self._feeder.join()
+            self._feeder = None
+        while not self._chunks.empty():
+            chunk = self._chunks.get_nowait()
+            if chunk is not NdjsonTraceReader._END_OF_TRACE:
+                chunk.cancel()
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    def get_event(self):
+        self._fill()
+        if not self._buffer:
+            return None
+        return self._buffer.popleft()
+
+    def peek_event(self):
+        self._fill()
+        if not self._buffer:
+            return None
+        return self._buffer[0]
+
+    def end_of_trace(self):
+        self._fill()
+        return not self._buffer
+
+    def get_events(self, count):
+        self._fill()
+        buffer = self._buffer
+        events_list = []
+        while len(events_list) < count and buffer:
+            take = min(count - len(events_list), len(buffer))
+            events_list.extend(buffer.popleft() for _ in range(take))
+            if len(events_list) < count:
+                self._fill()
+        return events_list
+
+    def get_start_time(self):
+        return self.start_time
+
+    def get_end_time(self):
+        return self.end_time
+
+
+class PrefetchTraceReader(TraceReader):
+    """ Reads another trace reader ahead in a background thread
+
+    A producer thread pulls batches of batch_size events from the
+    wrapped reader into a queue of at most max_batches batches, so
+    file I/O, decompression and decoding overlap with event dispatch.
+    peek_event, get_event and get_events are served from the queued
+    batches. Time the simulator spends waiting for the producer is
+    reported as stall time.
+
+    The wrapped reader must block until events are available, so live
+    stream readers cannot be wrapped.
+
+    Attributes:
+        reader (:obj:'TraceReader'): Wrapped reader
+        batch_size (int): Number of events per batch
+        max_batches (int): Maximum number of batches read ahead
+    """
+    _END_OF_TRACE = object()
+
+    def __init__(self, reader, batch_size=1000, max_batches=8):
+        self.reader = reader
+        self.batch_size = batch_size
+        self.max_batches = max_batches
+
+        self._batches = queue.Queue(maxsize=max_batches)
+        self._buffer = collections.deque()
+        self._done = False
+        self._stop = threading.Event()
+        self._thread = None
+        self._error = None
+
+        self.batches_read = 0
+        self.stall_time = 0.0
+        self.stalls = 0
+
+    def build(self):
+        self.reader.build()
+        self._thread = threading.Thread(target=self._produce, name='uamp-prefetch', daemon=True)
+        self._thread.start()
+
+    def _produce(self):
+        try:
+            while not self._stop.is_set() and not self.reader.end_of_trace():
+                self._put(self.reader.get_events(self.batch_size))
+        except Exception as e:
+            self._error = e
+        self._put(PrefetchTraceReader._END_OF_TRACE)
+
+    def _put(self, item):
+        while not self._stop.is_set():
+            try:
+                self._batches.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def _fill(self):
+        while not self._buffer and not self._done:
+            try:
+                batch = self._batches.get_nowait()
+            except queue.Empty:
+                start = time.perf_counter()
+                batch = self._batches.get()
+                self.stall_time += time.perf_counter() - start
+                self.stalls += 1
+            if batch is PrefetchTraceReader._END_OF_TRACE:
+                self._done = True
+                if self._error is not None:
+                    raise self._error
+                break
+            self.batches_read += 1
+            self._buffer.extend(batch)
+
+    def finish(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.reader.finish()
+
+    def get_event(self):
+        self._fill()
+        if not self._buffer:
+            return None
+        return self._buffer.popleft()
+
+    def peek_event(self):
+        self._fill()
+        if not self._buffer:
+            return None
+        return self._buffer[0]
+
+    def end_of_trace(self):
+        self._fill()
+        return not self._buffer
+
+    def get_events(self, count):
+        events_list = []
+        while len(events_list) < count:
+            self._fill()
+            if not self._buffer:
+                break
+            take = min(count - len(events_list), len(self._buffer))
+            events_list.extend(self._buffer.popleft() for _ in range(take))
+        return events_list
+
+    def get_start_time(self):
+        return self.reader.get_start_time()
+
+    def get_end_time(self):
+        return self.reader.get_end_time()
+
+    def print_stats(self, output):
+        output.write("prefetched batches: %s\n" % self.batches_read)
+        output.write("stalls: %s\n" % self.stalls)
+        output.write("stall time (s): %s\n" % self.stall_time)
+        self.reader.print_stats(output)
+
+
+class CompactingTraceReader(TraceReader):
+    """ Drops events that do not change anything from another reader
+
+    Events are read from the wrapped reader in batches of batch_size
+    and filtered by a TraceCompactor (see trace_compaction). The
+    compactor can be given the event types to keep after the reader is
+    built, as long as no events have been read yet.
+
+    Attributes:
+        reader (:obj:'TraceReader'): Wrapped reader
+        compactor (:obj:'TraceCompactor'): Filter applied to the events
+        batch_size (int): Number of events read from the wrapped reader
+            at a time
+    """
+    def __init__(self, reader, compactor, batch_size=1000):
+        self.reader = reader
+        self.compactor = compactor
+        self.batch_size = batch_size
+        self._buffer = collections.deque()
+
+    def build(self):
+        self.reader.build()
+
+    def finish(self):
+        self.reader.finish()
+
+    def _fill(self):
+        while not self._buffer and not self.reader.end_of_trace():
+            self._buffer.extend(self.compactor.compact(self.reader.get_events(self.batch_size)))
+
+    def get_event(self):
+        self._fill()
+        if not self._buffer:
+            return None
+        return self._buffer.popleft()
+
+    def peek_event(self):
+        self._fill()
+        if not self._buffer:
+            return None
+        return self._buffer[0]
+
+    def end_of_trace(self):
+        self._fill()
+        return not self._buffer
+
+    def get_events(self, count):
+        events_list = []
+        while len(events_list) < count:
+            self._fill()
+            if not self._buffer:
+                break
+            take = min(count - len(events_list), len(self._buffer))
+            events_list.extend(self._buffer.popleft() for _ in range(take))
+        return events_list
+
+    def get_start_time(self):
+        return self.reader.get_start_time()
+
+    def get_end_time(self):
+        return self.reader.get_end_time()
+
+    def print_stats(self, output):
+        self.compactor.print_stats(output)
+        self.reader.print_stats(output)
+
+
+class FollowTraceReader(TraceReader):
+    """ Reads an NDJSON trace file and follows events appended to it
+
+    Like 'tail -f', the file is read to its end and then polled every
+    poll_interval seconds for appended lines. Only complete lines are
+    decoded, so a line that is still being written is picked up on a
+    later poll, and every poll only reads the bytes added since the
+    previous one. Files must be uncompressed.
+
+    Like the stream reader, peek_event() does not block and returns
+    None when no new event has been appended, checking the file at
+    most once per poll interval. get_events() waits at most one poll
+    interval and may return no events, so the simulator keeps control
+    while the file is idle. Following ends when a
+    trace.end event is appended or stop() is called, after which a
+    TraceEnd event is added if the file had none.
+
+    Attributes:
+        filename (str): NDJSON trace file to follow
+        poll_interval (float): Seconds between polls once at the end
+            of the file
+    """
+    def __init__(self, filename, poll_interval=1.0):
+        self.filename = filename
+        self.poll_interval = poll_interval
+        self.start_time = None
+        self.end_time = None
+
+        self._fp = None
+        self._partial = b''
+        self._buffer = collections.deque()
+        self._closed = False
+        self._stop_requested = False
+        self._last_event = None
+        self._next_poll = 0
+
+        self.bytes_read = 0
+        self.events_read = 0
+        self.polls = 0
+
+    def build(self):
+        if detect_codec(self.filename) != 'none':
+            raise Exception("Only uncompressed NDJSON traces can be followed")
+        self._fp = open(self.filename, 'rb')
+
+        # Wait until the file tells us where simulated time starts
+        while self.start_time is None and not self._closed:
+            if not self._poll():
+                time.sleep(self.poll_interval)
+        if self.start_time is None:
+            raise Exception('Stopped before any event was appended to %s' % self.filename)
+
+    def finish(self):
+        if self._fp is not None:
+            self._fp.close()
+            self._fp = None
+
+    def stop(self):
+        """ Ends following once the events already appended are read
+
+        Only sets a flag, so it is safe to call from a signal handler.
+        """
+        self._stop_requested = True
+
+    def _poll(self):
+        """ Decodes the lines appended since the last poll
+
+        Returns whether any new event was read.
+        """
+        if self._closed:
+            return False
+        self.polls += 1
+        self._next_poll = time.monotonic() + self.poll_interval
+        data = self._fp.read()
+        if not data:
+            if os.path.getsize(self.filename) < self._fp.tell():
+                raise Exception("Trace file %s was truncated while following it" % self.filename)
+            if self._stop_requested:
+                self._close()
+            return False
+        self.bytes_read += len(data)
+
+        lines = (self._partial + data).split(b'\n')
+        self._partial = lines.pop()
+        events_before = len(self._buffer)
+        for line in lines:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                item = json.loads(line, object_hook=events.json_decode_event)
+            except (ValueError, KeyError):
+                sys.stderr.write('Dropping malformed trace line: %r\n' % line)
+                continue
+            if isinstance(item, dict):
+                # Header line describing the trace
+                if 'start_time' in item:
+                    self.start_time = dateutil.parser.parse(item['start_time'])
+                if item.get('end_time'):
+                    self.end_time = dateutil.parser.parse(item['end_time'])
+                continue
+            self._add(item)
+            if item.event_type == events.EventType.TRACE_END:
+                self._close()
+                break
+        return len(self._buffer) > events_before
+
+    def _add(self, event):
+        # Simulated time never runs backwards, so late events are
+        # clamped to the latest timestamp in the file
+        if self._last_event is not None and event.timestamp < self._last_event.timestamp:
+            event.timestamp = self._last_event.timestamp
+        if self.start_time is None:
+            self.start_time = event.timestamp
+        self._last_event = event
+        self.events_read += 1
+        self._buffer.append(event)
+
+    def _close(self):
+        self._closed = True
+        if self._last_event is not None and self._last_event.event_type != events.EventType.TRACE_END:
+            self._add(events.TraceEnd(timestamp=self._last_event.timestamp))
+        if self.end_time is None and self._last_event is not None:
+            self.end_time = self._last_event.timestamp
+
+    def get_event(self):
+        while not self._buffer and not self._closed:
+            if not self._poll():
+                time.sleep(self.poll_interval)
+        if not self._buffer:
+            return None
+        return self._buffer.popleft()
+
+    def peek_event(self):
+        # Peeks come between every queued event, so they poll at most
+        # once per interval
+        if not self._buffer and time.monotonic() >= self._next_poll:
+            self._poll()
+        if not self._buffer:
+            return None
+        return self._buffer[0]
+
+    def end_of_trace(self):
+        return self.peek_event() is None and self._closed
+
+    def get_events(self, count):
+        if not self._buffer and not self._poll() and not self._closed:
+            time.sleep(self.poll_interval)
+            self._poll()
+        events_list = []
+        while self._buffer and len(events_list) < count:
+            events_list.append(self._buffer.popleft())
+        return events_list
+
+    def get_start_time(self):
+        return self.start_time
+
+    def get_end_time(self):
+        return self.end_time
+
+    def print_stats(self, output):
+        output.write("events read: %s\n" % self.events_read)
+        output.write("bytes read: %s\n" % self.bytes_read)
+        output.write("polls: %s\n" % self.polls)
+
+
+class _FileLineReader:
+    """ readline() of a regular file for StreamTraceReader._consume
+
+    Event loops cannot watch regular files, so lines are read in
+    batches in the loop's executor.
+    """
+    def __init__(self, loop, fp, chunk_size=1 << 16):
+        self._loop = loop
+        self._fp = fp
+        self._chunk_size = chunk_size
+        self._lines = collections.deque()
+
+    async def readline(self):
+        if not self._lines:
+            self._lines.extend(await self._loop.run_in_executor(None, self._fp.readlines, self._chunk_size))
+            if not self._lines:
+                return b''
+        return self._lines.popleft()
+
+
+class StreamTraceReader(TraceReader):
+    """ Trace reader for live newline-delimited JSON event streams
+
+    Events are read as one JSON object per line from a Unix socket,
+    a TCP port or stdin by an asyncio event loop running in a
+    background thread. Decoded events are handed to the simulator
+    through a bounded queue; once the queue is full the loop stops
+    reading from the stream, so a fast producer is throttled by
+    the transport's flow control rather than buffered in memory.
+
+    The first line may optionally be a header object holding
+    'start_time' (and 'end_time'), otherwise the timestamp of the
+    first event is used as the trace start time.
+
+    Unlike file readers, peek_event() does not block and returns None
+    when no event has arrived yet. end_of_trace() only becomes true
+    once the client has closed the stream. Stdin may also be
+    redirected from a regular file, which is then read to its end.
+
+    Predictions sent with send_event() go back to the connected
+    client, or to stdout when reading from stdin.
+
+    Attributes:
+        address (str): 'unix:PATH', 'tcp:HOST:PORT' or '-' for stdin
+        queue_size (int): Maximum number of decoded events buffered
+    """
+    _END_OF_STREAM = object()
+
+    def __init__(self, address, queue_size=1024):
+        self.address = address
+        self.queue_size = queue_size
+        self.start_time = None
+        self.end_time = None
+
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._next_event = None
+        self._closed = False
+        self._last_timestamp = None
+
+        self._loop = None
+        self._thread = None
+        self._server = None
+        self._writer = None
+        self._consumer = None
+
+    def build(self):
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever,
+                                        name='uamp-stream-reader', daemon=True)
+        self._thread.start()
+        asyncio.run_coroutine_threadsafe(self._open(), self._loop).result()
+
+        # Block until the stream tells us where simulated time starts
+        self.peek_event()
+        while self._next_event is None and not self._closed:
+            self._fetch(block=True)
+        if self.start_time is None:
+            raise Exception('Stream closed before any event was received')
+
+    def finish(self):
+        if self._loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(self._close(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+        self._loop = None
+
+    def send_event(self, event):
+        """ Emit an event back to the connected client
+
+        Serialized with the trace JSON encoding, one object per line.
+        Safe to call from the simulator thread; the write is scheduled
+        on the stream's event loop and flushed immediately.
+        """
+        line = (json.dumps(event, cls=events.EventJsonEncoder) + '\n').encode()
+        if self.address == '-':
+            sys.stdout.buffer.write(line)
+            sys.stdout.buffer.flush()
+        elif self._loop is not None:
+            self._loop.call_soon_threadsafe(self._write, line)
+
+    def get_event(self):
+        while self._next_event is None and not self._closed:
+            self._fetch(block=True)
+
+        event = self._next_event
+        self._next_event = None
+        return event
+
+    def peek_event(self):
+        if self._next_event is None and not self._closed:
+            self._fetch(block=False)
+        return self._next_event
+
+    def end_of_trace(self):
+        return self.peek_event() is None and self._closed
+
+    def get_events(self, count):
+        # Wait for at least one event, then take whatever else is
+        # already buffered without blocking
+        events_list = []
+        event = self.get_event()
+        while event:
+            events_list.append(event)
+            if len(events_list) >= count or self.peek_event() is None:
+                break
+            event = self.get_event()
+        return events_list
+
+    def get_start_time(self):
+        return self.start_time
+
+    def get_end_time(self):
+        return self.end_time
+
+    def _fetch(self, block):
+        try:
+            item = self._queue.get(block=block)
+        except queue.Empty:
+            return
+
+        if item is StreamTraceReader._END_OF_STREAM:
+            self._closed = True
+            if self.end_time is None:
+                self.end_time = self._last_timestamp
+            return
+
+        # Simulated time never runs backwards, so late events are
+        # clamped to the latest timestamp seen on the stream
+        if self._last_timestamp is not None and item.timestamp < self._last_timestamp:
+            item.timestamp = self._last_timestamp
+        self._last_timestamp = item.timestamp
+        if self.start_time is None:
+            self.start_time = item.timestamp
+        self._next_event = item
+
+    async def _open(self):
+        if self.address == '-':
+            if stat.S_ISREG(os.fstat(sys.stdin.fileno()).st_mode):
+                reader = _FileLineReader(self._loop, sys.stdin.buffer)
+            else:
+                # Pipes, FIFOs and sockets
+                reader = asyncio.StreamReader(limit=2 ** 20)
+                await self._loop.connect_read_pipe(
+                    lambda: asyncio.StreamReaderProtocol(reader), sys.stdin)
+            self._consumer = self._loop.create_task(self._consume(reader))
+        elif self.address.startswith('unix:'):
+            self._server = await asyncio.start_unix_server(
+                self._handle_client, path=self.address[len('unix:'):])
+        elif self.address.startswith('tcp:'):
+            host, _, port = self.address[len('tcp:'):].rpartition(':')
+            self._server = await asyncio.start_server(
+                self._handle_client, host=host or 'localhost', port=int(port))
+        else:
+            raise Exception("Invalid stream address. Expected 'unix:PATH', 'tcp:HOST:PORT' or '-'")
+
+    async def _close(self):
+        if self._server is not None:
+            self._server.close()
+        if self._writer is not None:
+            self._writer.close()
+
+    async def _handle_client(self, reader, writer):
+        # Only a single device logger is simulated; reject others
+        if self._writer is not None:
+            writer.close()
+            return
+        self._writer = writer
+        self._server.close()
+        await self._consume(reader)
+
+    async def _consume(self, reader):
+        last_event = None
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                line = line.strip()
+                if not line:
+                    continue
+
+                try:
+                    item = json.loads(line.decode(), object_hook=events.json_decode_event)
+                except (ValueError, KeyError):
+                    sys.stderr.write('Dropping malformed stream line: %r\n' % line)
+                    continue
+                if isinstance(item, dict):
+                    # Header line describing the trace
+                    if 'start_time' in item:
+                        self.start_time = dateutil.parser.parse(item['start_time'])
+                    if item.get('end_time'):
+                        self.end_time = dateutil.parser.parse(item['end_time'])
+                    continue
+
+                last_event = item
+                await self._put(item)
+        finally:
+            if last_event is not None and last_event.event_type != events.EventType.TRACE_END:
+                await self._put(events.TraceEnd(timestamp=last_event.timestamp))
+            await self._put(StreamTraceReader._END_OF_STREAM)
+
+    async def _put(self, item):
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            # Stop reading until the simulator catches up
+            await self._loop.run_in_executor(None, self._queue.put, item)
+
+    def _write(self, line):
+        if self._writer is not None and not self._writer.is_closing():
+            self._writer.write(line)
+
+
+def get_prefetch_reader(reader, max_batches=8):
+    return PrefetchTraceReader(reader=reader, max_batches=max_batches)
+
+
+def get_compacting_reader(reader, keep_types=(), drop_unobserved=False):
+    return CompactingTraceReader(reader=reader,
+                                 compactor=TraceCompactor(keep_types, drop_unobserved))
+
+
+def get_follow_reader(filename, poll_interval=1.0):
+    return FollowTraceReader(filename=filename, poll_interval=poll_interval)
+
+
+def get_stream_reader(address):
+    return StreamTraceReader(address=address)
+
+
 def get_trace_reader(filename, trace_type=None):
     if trace_type:
         if trace_type == 'json':
             return JsonTraceReader(filename=filename)
         elif trace_type == 'pickle':
             return PickleTraceReader(filename=filename)
+        elif trace_type == 'ndjson':
+            return NdjsonTraceReader(filename=filename)
+        elif trace_type == 'shared':
+            return SharedTraceReader(source=filename)
         else:
             raise Exception("Invalid Trace File Type")
+    elif filename.startswith('shm:') or filename.endswith('.coltrace'):
+        return SharedTraceReader(source=filename)
     else:
-        if filename.endswith('.json') or filename.endswith('.json.gz'):
+        # Compression is detected from the file contents, the extension
+        # that is left names the trace format
+        name = strip_codec_extension(filename)
+        if name.endswith('.json'):
             return JsonTraceReader(filename=filename)
-        elif filename.endswith('.pkl') or filename.endswith('.pkl.gz'):
+        elif name.endswith('.pkl'):
             return PickleTraceReader(filename=filename)
+        elif name.endswith('.ndjson'):
+            return NdjsonTraceReader(filename=filename)
         else:
             raise Exception("Invalid Trace File Type")
@@ -3,16 +3,24 @@ import argparse
 import configparser
 from collections import defaultdict, deque
 
+import signal
 import sys
 import datetime
+import time
+import dateutil.parser
 
 from device import DeviceState
-from events import EventType, SimAlarm
-from sim_interface import SimulatorBase, SimModule
+from device_tracker import DeviceStateTracker
+from events import EventType, SimAlarm, SimDebug
+from metrics import MetricsRegistry
+from sim_debug import Breakpoint, Watch
+from sim_interface import SimulatorBase, SimModule, handler_module_name
 from sim_modules import get_simulator_module
+from state_store import load_state, save_state
 from utils import PriorityQueue
 
-from trace_reader import get_trace_reader
+from trace_reader import get_trace_reader, get_stream_reader, get_prefetch_reader, get_compacting_reader, \
+    get_follow_reader
 
 
 class Priority:
@@ -23,6 +31,24 @@ class Priority:
     DEBUG_LAST = 1024
 
 
+DEBUG_HELP = """\
+<enter>                         run the next interval of events
+step, s                         stop every 'interval' events again
+interval <n>                    events to run between stops
+continue, c                     run until a breakpoint, watch or 'until' stops
+until <time>                    stop before the first event at or after time
+break, b <type> [attr=value..]  stop after events of a type ('battery.*' for
+                                a hierarchy) whose attributes match
+break                           list breakpoints
+delete [n..]                    delete breakpoints, all without arguments
+watch <module>.<attr>           stop when a module attribute changes
+watch                           list watches
+unwatch [<module>.<attr>..]     remove watches, all without arguments
+verbose [on|off]                print every event
+time                            print the current simulated time
+quit, exit, q                   terminate the simulation"""
+
+
 class Simulator(SimulatorBase):
     EVENT_QUEUE_THRESHOLD = 100
 
@@ -31,18 +57,46 @@ class Simulator(SimulatorBase):
         self._module_type_map = defaultdict(deque)
 
         self._device_state = DeviceState()
+        self._device_tracker = DeviceStateTracker(self._device_state)
         self._event_queue = PriorityQueue()
 
         self._current_time = None
         self._warmup_period = None
 
         self._event_listeners = defaultdict(deque)
+        self._alarm_listeners = []
+        # Module whose handler is running, used as the source of the
+        # events it broadcasts
+        self._running_module = None
         self._trace_reader = None
         self._trace_executed = False
+        # Timestamp of the latest trace event pushed to the event queue
+        self._last_trace_time = None
         self._verbose = False
         self._debug_mode = False
         self._debug_interval = 1
         self._debug_interval_cnt = 0
+        # Debug mode stops every _debug_interval events until 'continue'
+        self._stepping = False
+        self._breakpoints = []
+        self._breakpoint_cnt = 0
+        self._watches = []
+        # Whether the run needs the loop with verbose/debug checks
+        self._instrumented = False
+        self._dump_state_path = None
+        self._print_reader_stats = False
+        # Stats go to stderr when stdout carries the predictions of a
+        # stream read from stdin
+        self._stats_output = sys.stdout
+        self._following = False
+        # Module stats are printed while running on SIGUSR1 and every
+        # _stats_interval seconds of wall time, if set
+        self._stats_requested = False
+        self._stats_interval = None
+        self._next_stats_time = None
+        self._metrics = MetricsRegistry()
+        self._metrics_interval = None
+        self._metrics_path = None
 
     def has_module_instance(self, name):
         return name in self._sim_modules
@@ -51,7 +105,7 @@ class Simulator(SimulatorBase):
         return self._sim_modules[name]
 
     def get_module_for_type(self, module_type):
-        if module_type in self._module_type_map:
+        if self._module_type_map.get(module_type.value):
             return self._module_type_map[module_type.value][0]
         else:
             return None
@@ -73,12 +127,18 @@ class Simulator(SimulatorBase):
     def build(self, args):
         self._verbose = args.verbose
         self._debug_mode = args.debug
+        # Prefetching and compaction only apply to complete trace files
+        self._following = bool(args.follow)
+        self._print_reader_stats = self._following \
+            or (bool(args.prefetch or args.compact) and bool(args.trace))
+        self._stats_interval = args.stats_interval or None
+        self._stats_output = sys.stderr if args.stream == '-' else sys.stdout
 
         # Instantiate necessary modules based on config files
         config = configparser.ConfigParser()
         config.read(args.sim_config)
 
-        config['DEFAULT'] = {'modules': '', 'warmup_period': ''}
+        config['DEFAULT'] = {'modules': '', 'warmup_period': '', 'metrics_interval': '1h'}
 
         if 'Simulator' not in config:
             raise Exception("Simulator section missing from config file")
@@ -95,8 +155,23 @@ class Simulator(SimulatorBase):
         self._warmup_period = \
             self.__parse_warmup_setting(sim_settings['warmup_period'])
 
+        # Module counters are snapshotted when a metrics file is requested
+        self._metrics_path = args.metrics
+        self._metrics_interval = \
+            self.__parse_interval_setting(sim_settings['metrics_interval'])
+
         # Setup the trace file reader and initial simulator time
-        self._trace_reader = get_trace_reader(args.trace)
+        if args.stream:
+            self._trace_reader = get_stream_reader(args.stream)
+        elif args.follow:
+            self._trace_reader = get_follow_reader(args.follow, args.poll_interval)
+        else:
+            self._trace_reader = get_trace_reader(args.trace)
+            if args.prefetch:
+                self._trace_reader = get_prefetch_reader(self._trace_reader, args.prefetch)
+            if args.compact:
+                # The types to keep are known once the modules are built
+                self._trace_reader = get_compacting_reader(self._trace_reader, drop_unobserved=True)
         self._trace_reader.build()
         self._trace_executed = False
         self._current_time = self._trace_reader.get_start_time()
@@ -108,12 +183,36 @@ class Simulator(SimulatorBase):
 
             self.register(get_simulator_module(module_name, self, module_settings))
 
+        # Warm start modules from the state of a previous run
+        if args.load_state:
+            self.__load_module_state(args.load_state)
+        self._dump_state_path = args.dump_state
+
         # Build list of modules
         for sim_module in self._sim_modules.values():
             sim_module.build()
 
+        # Predictions made on a live stream are sent back to the client
+        if args.stream:
+            self.subscribe(EventType.PRELOAD_APP, self._trace_reader.send_event)
+        elif args.trace and args.compact:
+            self._trace_reader.compactor.keep_types.update(
+                event_type for event_type, listeners in self._event_listeners.items() if listeners)
+
     def run(self):
+        # Signal handlers only set flags that are checked between
+        # batches of trace events, when module state is consistent
+        if hasattr(signal, 'SIGUSR1'):
+            signal.signal(signal.SIGUSR1, self.__request_stats)
+        if self._following:
+            signal.signal(signal.SIGINT, self.__stop_following)
+            signal.signal(signal.SIGTERM, self.__stop_following)
+        if self._stats_interval:
+            self._next_stats_time = time.monotonic() + self._stats_interval
+
         # Check if we need to enter debug mode immediately
+        self._stepping = self._debug_mode
+        self.__update_instrumented()
         if self._debug_mode:
             self._debug_interval_cnt = 0
             self.__debug()
@@ -126,12 +225,31 @@ class Simulator(SimulatorBase):
         self._event_queue.push(warmup_finish_alarm,
                                (warmup_finish_alarm.timestamp, Priority.SIMULATOR))
 
+        if self._metrics_path:
+            self._metrics.schedule(self, self._trace_reader.get_start_time(),
+                                   self._metrics_interval)
+
+        # Verbose output, stepping and watches need checks on every
+        # event. The debugger switches loops when they are turned on or
+        # off, other runs use the loop without those checks throughout
+        while not self._trace_reader.end_of_trace() \
+                or not self._event_queue.empty():
+            if self._instrumented:
+                self.__run_instrumented()
+            else:
+                self.__run_fast()
+        self.__finish()
+
+    def __run_instrumented(self):
         while not self._trace_reader.end_of_trace() \
                 or not self._event_queue.empty():
 
-            # Populate event queue if it is below the threshold number of events
+            # Populate event queue if it is below the threshold number of events.
+            # Live readers only have events to offer once they have arrived,
+            # so only wait on them when there is nothing else to execute
             if self._event_queue.size() < Simulator.EVENT_QUEUE_THRESHOLD \
-                    and not self._trace_reader.end_of_trace():
+                    and not self._trace_reader.end_of_trace() \
+                    and (self._event_queue.empty() or self._trace_reader.peek_event()):
                 self.__populate_event_queue_from_trace()
                 continue
 
@@ -148,6 +266,15 @@ class Simulator(SimulatorBase):
                 self.__populate_event_queue_from_trace()
                 continue
 
+            # A live stream has not caught up with this alarm yet. Alarms
+            # only fire once the stream has passed their timestamp, so they
+            # wait unless a trace event at or after them is already queued
+            if not trace_event and cur_event.event_type == EventType.SIM_ALARM \
+                    and self.__alarm_ahead_of_trace(cur_event) \
+                    and not self._trace_reader.end_of_trace():
+                self.__populate_event_queue_from_trace()
+                continue
+
             self._event_queue.pop()
 
             # Set current time of simulator
@@ -155,19 +282,84 @@ class Simulator(SimulatorBase):
             if self._verbose:
                 print(cur_event)
 
-            if self._debug_mode:
+            if self._stepping:
                 self._debug_interval_cnt += 1
-                if self._debug_interval_cnt == self._debug_interval:
-                    self.__debug()
+                if self._debug_interval_cnt >= self._debug_interval:
                     self._debug_interval_cnt = 0
+                    self.__debug()
 
             self.__execute_event(cur_event)
-        self.__finish()
+
+            if self._watches:
+                self.__check_watches(cur_event)
+            if not self._instrumented:
+                return
+
+    def __run_fast(self):
+        """ Same event order as __run_instrumented without per-event checks
+
+        Lookups are hoisted out of the loop, and trace events are
+        broadcast inline: their timestamp is the current time and no
+        module is running, so broadcast's checks cannot fail.
+        """
+        threshold = Simulator.EVENT_QUEUE_THRESHOLD
+        end_of_trace = self._trace_reader.end_of_trace
+        peek_trace_event = self._trace_reader.peek_event
+        queue_size = self._event_queue.size
+        queue_empty = self._event_queue.empty
+        queue_peek = self._event_queue.peek
+        queue_pop = self._event_queue.pop
+        populate = self.__populate_event_queue_from_trace
+        execute = self.__execute_event
+        apply_event = self._device_tracker.apply
+        listeners_for = self._event_listeners.get
+        sim_events = (EventType.SIM_DEBUG, EventType.SIM_ALARM, EventType.TRACE_END)
+        sim_alarm = EventType.SIM_ALARM
+
+        while not end_of_trace() or not queue_empty():
+            if queue_size() < threshold and not end_of_trace() \
+                    and (queue_empty() or peek_trace_event()):
+                populate()
+                continue
+
+            cur_event = queue_peek()
+            trace_event = peek_trace_event()
+            if trace_event and cur_event.timestamp > trace_event.timestamp:
+                populate()
+                continue
+
+            event_type = cur_event.event_type
+            if not trace_event and event_type == sim_alarm \
+                    and self.__alarm_ahead_of_trace(cur_event) and not end_of_trace():
+                populate()
+                continue
+
+            queue_pop()
+            self._current_time = cur_event.timestamp
+
+            if event_type in sim_events:
+                execute(cur_event)
+                # The debugger may have turned on stepping or watches
+                if self._instrumented:
+                    return
+                continue
+
+            apply_event(cur_event)
+            listeners = listeners_for(event_type)
+            if listeners:
+                for (event_filter, handler, module_name) in listeners:
+                    if not event_filter or event_filter(cur_event):
+                        self._running_module = module_name
+                        handler(cur_event)
+                self._running_module = None
 
     def subscribe(self, event_type, handler, event_filter=None):
         if event_type not in self._event_listeners:
             self._event_listeners[event_type] = []
-        self._event_listeners[event_type].append((event_filter, handler))
+        self._event_listeners[event_type].append((event_filter, handler, handler_module_name(handler)))
+
+    def subscribe_alarms(self, handler):
+        self._alarm_listeners.append(handler)
 
     def broadcast(self, event):
         if event.timestamp:
@@ -176,12 +368,19 @@ class Simulator(SimulatorBase):
         else:
             event.timestamp = self._current_time
 
+        # Events broadcast from a module handler are attributed to it
+        running_module = self._running_module
+        if event.source is None:
+            event.source = running_module
+
         # Get the set of listeners for the given event type
         listeners = self._event_listeners[event.event_type]
-        for (event_filter, handler) in listeners:
+        for (event_filter, handler, module_name) in listeners:
             # Send event to each subscribed listener
             if not event_filter or event_filter(event):
+                self._running_module = module_name
                 handler(event)
+        self._running_module = running_module
 
     def register_alarm(self, alarm):
         self._event_queue.push(alarm, (alarm.timestamp, Priority.ALARM))
@@ -192,6 +391,15 @@ class Simulator(SimulatorBase):
     def get_device_state(self):
         return self._device_state
 
+    def get_device_state_at(self, timestamp):
+        return self._device_tracker.get_state_at(timestamp)
+
+    def get_device_tracker(self):
+        return self._device_tracker
+
+    def get_metrics(self):
+        return self._metrics
+
     def __parse_warmup_setting(self, setting_value):
         if setting_value:
             if setting_value.endswith('h'):
@@ -201,6 +409,31 @@ class Simulator(SimulatorBase):
         else:
             return datetime.timedelta()
 
+    def __parse_interval_setting(self, setting_value):
+        if setting_value.endswith('h'):
+            return datetime.timedelta(hours=float(setting_value[:-1]))
+        if setting_value.endswith('m'):
+            return datetime.timedelta(minutes=float(setting_value[:-1]))
+        raise Exception("Invalid metrics interval setting format")
+
+    def __load_module_state(self, path):
+        state_file = load_state(path)
+        try:
+            for sim_module in self._sim_modules.values():
+                if state_file.has_prefix(sim_module.get_name()):
+                    sim_module.set_state(state_file.prefixed(sim_module.get_name()))
+        finally:
+            state_file.close()
+
+    def __dump_module_state(self, path):
+        sections = {}
+        for sim_module in self._sim_modules.values():
+            module_state = sim_module.get_state()
+            if module_state:
+                for key, value in module_state.items():
+                    sections['%s/%s' % (sim_module.get_name(), key)] = value
+        save_state(path, sections)
+
     def __enable_stats_collection(self):
         for sim_module in self._sim_modules.values():
             sim_module.enable_stats_collection()
@@ -215,15 +448,23 @@ class Simulator(SimulatorBase):
     """
     def __execute_event(self, event):
         if event.event_type == EventType.SIM_DEBUG:
-            self.__debug()
+            self.__debug(event.reason)
         elif event.event_type == EventType.SIM_ALARM:
             if not self._trace_executed:
+                for handler in self._alarm_listeners:
+                    handler(event)
+                self._running_module = handler_module_name(event.handler)
                 event.fire()
+                self._running_module = None
                 if event.is_repeating():
                     self._event_queue.push(event, (event.timestamp, Priority.ALARM))
         elif event.event_type == EventType.TRACE_END:
             self._trace_executed = True
+            # Lets modules settle what is still outstanding
+            self.broadcast(event)
         else:
+            # Device state is updated before modules see the event
+            self._device_tracker.apply(event)
             self.broadcast(event)
 
     def __populate_event_queue_from_trace(self):
@@ -231,9 +472,36 @@ class Simulator(SimulatorBase):
         events = self._trace_reader.get_events(count=Simulator.EVENT_QUEUE_THRESHOLD)
         for x in events:
             self._event_queue.push(x, (x.timestamp, Priority.TRACE))
-
-    def __finish(self):
-        output_file = sys.stdout
+        if events:
+            self._last_trace_time = events[-1].timestamp
+
+        if self._stats_requested or \
+                (self._stats_interval and time.monotonic() >= self._next_stats_time):
+            self.__print_running_stats()
+
+    def __alarm_ahead_of_trace(self, alarm):
+        return self._last_trace_time is None or alarm.timestamp > self._last_trace_time
+
+    def __request_stats(self, signum, frame):
+        self._stats_requested = True
+
+    def __stop_following(self, signum, frame):
+        # A second interrupt terminates the simulator right away
+        signal.signal(signum, signal.SIG_DFL)
+        self._trace_reader.stop()
+
+    def __print_running_stats(self):
+        self._stats_requested = False
+        if self._stats_interval:
+            self._next_stats_time = time.monotonic() + self._stats_interval
+        output_file = self._stats_output
+        header = "######## Stats at %s ########\n" % self._current_time
+        output_file.write(header)
+        self.__print_stats(output_file)
+        output_file.write("#" * (len(header) - 1) + '\n')
+        output_file.flush()
+
+    def __print_stats(self, output_file):
         # Print status from all modules
         for sim_module in self._sim_modules.values():
             header = "======== %s Stats ========\n" % sim_module.get_name()
@@ -242,15 +510,86 @@ class Simulator(SimulatorBase):
             sim_module.print_stats(output_file)
             output_file.write(footer)
 
+        if self._print_reader_stats:
+            header = "======== trace reader Stats ========\n"
+            output_file.write(header)
+            self._trace_reader.print_stats(output_file)
+            output_file.write("=" * (len(header) - 1) + '\n')
+
+    def __finish(self):
+        output_file = self._stats_output
+        self.__print_stats(output_file)
+
+        if self._dump_state_path:
+            self.__dump_module_state(self._dump_state_path)
+
+        if self._metrics_path:
+            self._metrics.snapshot(self._current_time)
+            self._metrics.write(self._metrics_path)
+
         # Call finish for all modules
         for sim_module in self._sim_modules.values():
             sim_module.finish()
 
-    def __debug(self):
+        self._trace_reader.finish()
+
+    def __update_instrumented(self):
+        self._instrumented = self._verbose or self._stepping or bool(self._watches)
+
+    def __stop(self, reason):
+        # Stops before the next event is executed
+        self._event_queue.push(SimDebug(self._current_time, reason),
+                               (self._current_time, Priority.DEBUG_FIRST))
+
+    def __breakpoint_hit(self, breakpoint, event):
+        breakpoint.hits += 1
+        self.__stop("Breakpoint %d: %s" % (breakpoint.number, event))
+
+    def __add_breakpoint(self, pattern, conditions):
+        self._breakpoint_cnt += 1
+        breakpoint = Breakpoint(self._breakpoint_cnt, pattern, conditions)
+        # Breakpoints are checked by the listeners of their event
+        # types only, ahead of the modules
+        handler = lambda event: self.__breakpoint_hit(breakpoint, event)
+        for event_type in breakpoint.event_types:
+            if event_type not in self._event_listeners:
+                self._event_listeners[event_type] = []
+            self._event_listeners[event_type].insert(0, (breakpoint.event_filter, handler, None))
+        breakpoint.handler = handler
+        self._breakpoints.append(breakpoint)
+        return breakpoint
+
+    def __delete_breakpoint(self, breakpoint):
+        for event_type in breakpoint.event_types:
+            self._event_listeners[event_type].remove((breakpoint.event_filter, breakpoint.handler, None))
+        self._breakpoints.remove(breakpoint)
+
+    def __add_watch(self, spec):
+        module_name, sep, attr = spec.partition('.')
+        if not sep or not attr:
+            raise Exception("Expected <module>.<attr>")
+        if module_name not in self._sim_modules:
+            raise Exception("Unknown module '%s'" % module_name)
+        try:
+            watch = Watch(spec, self._sim_modules[module_name], attr)
+        except AttributeError:
+            raise Exception("Module %s has no attribute '%s'" % (module_name, attr))
+        self._watches.append(watch)
+        return watch
+
+    def __check_watches(self, event):
+        changes = ["%s: %r -> %r" % (watch.spec, watch.previous, watch.value)
+                   for watch in self._watches if watch.changed()]
+        if changes:
+            self.__debug("Watch after %s\n  %s" % (event, '\n  '.join(changes)))
+
+    def __debug(self, reason=None):
+        if reason:
+            print(reason)
         while True:
             command = input("(uamp-sim debug) $ ")
             if command:
-                tokens = command.split(sep=' ')
+                tokens = command.split()
                 cmd = tokens[0]
                 args = tokens[1:]
                 if cmd == 'quit' or cmd == 'exit' or cmd == 'q':
@@ -278,16 +617,96 @@ class Simulator(SimulatorBase):
 
                     else:
                         print("Command Usage Error: verbose command expects at most one argument")
+                elif cmd == 'continue' or cmd == 'c':
+                    # Run until a breakpoint, watch or 'until' time stops
+                    self._stepping = False
+                    break
+                elif cmd == 'step' or cmd == 's':
+                    self._stepping = True
+                    self._debug_interval_cnt = 0
+                    break
+                elif cmd == 'until':
+                    try:
+                        timestamp = dateutil.parser.parse(' '.join(args))
+                    except (ValueError, OverflowError):
+                        print("Command Usage Error: until command expects a time, e.g. until 2017-03-20T08:00")
+                        continue
+                    if self._current_time and timestamp.tzinfo is None:
+                        timestamp = timestamp.replace(tzinfo=self._current_time.tzinfo)
+                    if self._current_time and timestamp <= self._current_time:
+                        print("Command Usage Error: %s is not after the current time %s"
+                              % (timestamp, self._current_time))
+                        continue
+                    self._event_queue.push(SimDebug(timestamp, "Reached %s" % timestamp),
+                                           (timestamp, Priority.DEBUG_FIRST))
+                    self._stepping = False
+                    break
+                elif cmd == 'break' or cmd == 'b':
+                    if not args:
+                        for breakpoint in self._breakpoints:
+                            print(breakpoint)
+                        continue
+                    try:
+                        print(self.__add_breakpoint(args[0], args[1:]))
+                    except Exception as error:
+                        print("Command Usage Error: %s" % error)
+                elif cmd == 'delete':
+                    numbers = set(args)
+                    for breakpoint in [b for b in self._breakpoints if not args or str(b.number) in numbers]:
+                        self.__delete_breakpoint(breakpoint)
+                elif cmd == 'watch':
+                    if not args:
+                        for watch in self._watches:
+                            print(watch)
+                        continue
+                    try:
+                        print(self.__add_watch(args[0]))
+                    except Exception as error:
+                        print("Command Usage Error: %s" % error)
+                elif cmd == 'unwatch':
+                    self._watches = [watch for watch in self._watches if args and watch.spec not in args]
+                elif cmd == 'time':
+                    print(self._current_time)
+                elif cmd == 'help':
+                    print(DEBUG_HELP)
+                else:
+                    print("Unknown command '%s', type 'help' for the list of commands" % cmd)
             else:
                 break
+        self.__update_instrumented()
 
 
 def parse_args():
     parser = argparse.ArgumentParser(description='Run uamp_sim')
-    parser.add_argument('--trace', type=str, required=True,
-                        help='User log trace file')
+    trace_group = parser.add_mutually_exclusive_group(required=True)
+    trace_group.add_argument('--trace', type=str,
+                             help='User log trace file')
+    trace_group.add_argument('--stream', type=str,
+                             help="Live newline-delimited JSON event stream to simulate: "
+                                  "'unix:PATH', 'tcp:HOST:PORT' or '-' for stdin. With stdin, "
+                                  "predictions are written to stdout and stats to stderr")
+    trace_group.add_argument('--follow', type=str,
+                             help='Uncompressed newline-delimited JSON trace to simulate and keep '
+                                  'following as events are appended, until interrupted')
     parser.add_argument('--sim_config', type=str, required=True,
                         help='Sim Configuration File')
+    parser.add_argument('--load_state', type=str, default=None,
+                        help='Module state file from a previous run to warm start from')
+    parser.add_argument('--dump_state', type=str, default=None,
+                        help='File to write module state to at the end of the run')
+    parser.add_argument('--prefetch', type=int, default=0,
+                        help='Read up to this many batches of trace events ahead in a '
+                             'background thread (0 disables prefetching)')
+    parser.add_argument('--compact', action='store_true', default=False,
+                        help='Skip trace events that change no device state and that no '
+                             'module subscribes to')
+    parser.add_argument('--poll_interval', type=float, default=1.0,
+                        help='Seconds between checks for appended events with --follow')
+    parser.add_argument('--stats_interval', type=float, default=0,
+                        help='Print module stats every this many seconds of wall time while '
+                             'running (0 disables, SIGUSR1 prints them on demand)')
+    parser.add_argument('--metrics', type=str, default=None,
+                        help='File to write module metrics snapshots to (.csv or .npy)')
     parser.add_argument('-v,--verbose', dest='verbose', action='store_true',
                         default=False, help='Print out simulation run data')
     parser.add_argument('-D,--debug', dest='debug', action='store_true',
@@ -1,5 +1,7 @@
+import array
 import heapq
 import itertools
+import math
 
 
 class PriorityQueue:
@@ -23,3 +25,129 @@ class PriorityQueue:
 
     def empty(self):
         return len(self._queue) == 0
+
+
+class LogHistogram:
+    """ Fixed-memory histogram with logarithmic buckets
+
+    Values are recorded as integer multiples of 'unit'. Values below
+    2 ** sub_bucket_bits units get a bucket each; above that every
+    power of two is split into 2 ** (sub_bucket_bits - 1) buckets, so
+    the relative error of a reported percentile stays below
+    2 ** (1 - sub_bucket_bits). Memory is bounded by the number of
+    powers of two between unit and the largest value recorded.
+
+    Histograms with the same unit and precision merge by adding
+    their bucket counts, so per-trace results can be combined
+    without keeping samples around.
+
+    Attributes:
+        unit (float): Resolution of recorded values
+        sub_bucket_bits (int): Precision of the buckets
+    """
+    def __init__(self, unit=1.0, sub_bucket_bits=7):
+        self.unit = unit
+        self.sub_bucket_bits = sub_bucket_bits
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+        self._half = 1 << (sub_bucket_bits - 1)
+        self._counts = array.array('Q')
+
+    def _index(self, units):
+        exponent = units.bit_length() - self.sub_bucket_bits
+        if exponent <= 0:
+            return units
+        return exponent * self._half + (units >> exponent)
+
+    def _lower_bound(self, index):
+        # Inverse of _index: smallest unit count mapped to a bucket
+        if index < 2 * self._half:
+            return index
+        exponent = index // self._half - 1
+        mantissa = index - exponent * self._half
+        return mantissa << exponent
+
+    def record(self, value):
+        if value < 0:
+            value = 0
+        index = self._index(int(value / self.unit))
+        counts = self._counts
+        if index >= len(counts):
+            counts.extend([0] * (index + 1 - len(counts)))
+        counts[index] += 1
+
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        if other.unit != self.unit or other.sub_bucket_bits != self.sub_bucket_bits:
+            raise Exception("Cannot merge histograms with different resolutions")
+        if len(other._counts) > len(self._counts):
+            self._counts.extend([0] * (len(other._counts) - len(self._counts)))
+        for index, bucket_count in enumerate(other._counts):
+            if bucket_count:
+                self._counts[index] += bucket_count
+
+        self.count += other.count
+        self.total += other.total
+        if other.min is not None and (self.min is None or other.min < self.min):
+            self.min = other.min
+        if other.max is not None and (self.max is None or other.max > self.max):
+            self.max = other.max
+
+    def mean(self):
+        if not self.count:
+            return None
+        return self.total / self.count
+
+    def percentile(self, percent):
+        """ Returns the value at the given percentile (0 - 100) """
+        if not self.count:
+            return None
+        target = max(1, int(math.ceil(percent / 100.0 * self.count)))
+        seen = 0
+        for index, bucket_count in enumerate(self._counts):
+            seen += bucket_count
+            if seen >= target:
+                low = self._lower_bound(index)
+                high = self._lower_bound(index + 1)
+                value = (low + high - 1) / 2.0 * self.unit
+                return min(max(value, self.min), self.max)
+        return self.max
+
+    def percentiles(self, percents=(50, 90, 99, 99.9)):
+        return [(percent, self.percentile(percent)) for percent in percents]
+
+    def to_dict(self):
+        return {'unit': self.unit,
+                'sub_bucket_bits': self.sub_bucket_bits,
+                'count': self.count,
+                'total': self.total,
+                'min': self.min,
+                'max': self.max,
+                'buckets': {index: bucket_count for index, bucket_count in enumerate(self._counts)
+                            if bucket_count}}
+
+    @classmethod
+    def from_dict(cls, data):
+        histogram = cls(unit=data['unit'], sub_bucket_bits=data['sub_bucket_bits'])
+        buckets = {int(index): bucket_count for index, bucket_count in data['buckets'].items()}
+        if buckets:
+            histogram._counts.extend([0] * (max(buckets) + 1))
+            for index, bucket_count in buckets.items():
+                histogram._counts[index] = bucket_count
+        histogram.count = data['count']
+        histogram.total = data['total']
+        histogram.min = data['min']
+        histogram.max = data['max']
+        return histogram
+
+    def write_percentiles(self, output, label):
+        for (percent, value) in self.percentiles():
+            output.write("%s: p%s - %s\n" % (label, ('%g' % percent).replace('.', ''), value))